@@ -1,10 +1,76 @@
-import socket, json, sys, select, time
+import socket, json, sys, time, asyncio, contextlib, heapq, os, math, random, struct, hashlib, select, threading
+import concurrent.futures
 from styles.bcolors import bcolors
-from collections import deque
+from protocol import framing
+from protocol.hashring import HashRing, parse_node
+from peer.dispatcher import MessageDispatcher
+from peer.timers import TimerQueue, LoopTimers, ScopedTimers
+from peer.failure_detector import FailureDetector
+from peer.recovery import RecoverySender, pack_batches, to_ranges
+from peer.reliability import ReliableTransport
+from peer.lossy import LossySocket
+from peer.message_store import MessageStore
+from peer import wire
+from peer.fragments import FragmentingSocket, Reassembler, is_fragment
+from peer.batching import BatchingSocket
+from peer.room import RoomState
+
+# Datagrams about the connection to a peer rather than about a room. Everything else
+# carries the id of the room it belongs to.
+ROOMLESS_TYPES = {"swim_ping", "swim_ping_req", "swim_ack", "rel_data", "rel_ack", "features"}
+
+# Datagram types a peer only understands if it advertised the feature they belong to.
+# Clients that predate them take any unknown type for chat, so they are never sent these.
+FEATURE_TYPES = {
+    "swim_ping": "swim",
+    "swim_ping_req": "swim",
+    "swim_ack": "swim",
+    "rel_data": "reliable",
+    "rel_ack": "reliable",
+    "gossip": "gossip"
+}
+
+# Name server requests that are safe to send again when a connection drops before they
+# are answered. A second create would reset the room's membership, and a second leave
+# fails, so those are never resent.
+REPLAYABLE_ACTIONS = {"list", "cluster", "join", "update_room"}
+
+
+def room_attribute(name):
+    '''
+    A P2PClient attribute kept per room. It reads and writes the state of the room the
+    client is acting in: the room a datagram or timer belongs to while handling it, and
+    the room in the foreground otherwise.
+
+    args:
+        name (str): The RoomState attribute.
+    '''
+    return property(
+        lambda self: getattr(self.room_state, name),
+        lambda self, value: setattr(self.room_state, name, value)
+    )
+
 
 class P2PClient(object):
 
-    def __init__(self, hostname, port, auto_run_handler = True):
+    room = room_attribute("room")
+    room_id = room_attribute("room_id")
+    peers = room_attribute("peers")
+    message_log = room_attribute("message_log")
+    message_clock = room_attribute("message_clock")
+    join_time_clock = room_attribute("join_time_clock")
+    recovery_in_progress = room_attribute("recovery_in_progress")
+    recovery_buffers = room_attribute("recovery_buffers")
+    recovery_senders = room_attribute("recovery_senders")
+    received_messages = room_attribute("received_messages")
+    clock_baselines = room_attribute("clock_baselines")
+    ping_responses = room_attribute("ping_responses")
+    multicast_socket = room_attribute("multicast_socket")
+    multicast_group = room_attribute("multicast_group")
+    multicast_peers = room_attribute("multicast_peers")
+    multicast_tail_timer = room_attribute("multicast_tail_timer")
+
+    def __init__(self, hostname, port, auto_run_handler = True, cluster = None, endpoints = None):
         '''
         Create a P2PClient object. 
 
@@ -12,23 +78,69 @@ class P2PClient(object):
             hostname (str): The IP address of the central server that stores room information.
             port (int): The port where the central server is running. 
             auto_run_handler (bool): Set to False for stress testing, otherwise leave untouched.
+            cluster (list): "host:port" names of every node in a sharded server cluster. If not
+                given, the client asks the central server for them on first use.
+            endpoints (list): "host:port" names of replicated central servers to fail over
+                between, in priority order.
         '''
         self.server_hostname = hostname
         self.server_port = port
-        self.server_socket = None
-        self.room = None
-        self.peers = []
+        self.server_sockets = {}  # Long-lived framed connections, keyed by "host:port"
+        self.server_lock = threading.RLock()  # Held while a thread uses the connections above
+        self.server_executor = None  # Worker thread that makes name server requests for the event loop
+        self.server_updates = set()  # Tasks sending changes to the server in the background
+        self.ring = HashRing(cluster) if cluster else None
+        self.cluster_discovered = cluster is not None
+        self.endpoints = list(endpoints) if endpoints else []
+        if self.endpoints and f"{hostname}:{port}" not in self.endpoints:
+            self.endpoints.insert(0, f"{hostname}:{port}")
+        self.endpoint_index = 0
         self.running = False
+        self.session_closed = None  # Future resolved when the user leaves the chat session
+        self.echo = True  # Print chat, room notices and the prompt; turn off when used as a library
+        self.message_callbacks = []  # Called as callback(room, user, body) for each chat message delivered
         self.address = None
         self.port = None
         self.tcp_address = None
         self.tcp_port = None
         self.user_id = None
-        self.message_log = deque(maxlen=20)
-        self.message_clock = dict()
-        self.join_time_clock = {}  # Track clock values at join time
-        self.recovery_in_progress = set()
-        self.received_messages = set()
+        self.message_log_size = 1024  # Sent messages kept in memory for recovery
+        self.message_log_dir = None  # Directory to persist sent messages in, one file per user and room
+        self.rooms = {}  # Room name -> RoomState, for every room we are in
+        self.room_ids = {}  # Room id -> RoomState, to route incoming datagrams
+        self.lobby = RoomState(message_log_size=self.message_log_size)  # Stands in while we are in no room
+        self.foreground = self.lobby  # The room the user is typing into
+        self.room_state = self.lobby  # The room the client is acting in; see room_attribute
+        self.recovery_mtu = 1024  # Largest recovery_batch datagram to send or ask for
+        self.next_request_id = 0
+        self.udp_socket = None
+        self.ping_timeout = 5.0
+        self.timers = TimerQueue()
+        self.failure_detection = True  # Probe peers in the background and evict dead ones
+        self.failure_detector = None
+        self.reliable_delivery = True  # Sequence, acknowledge and retransmit chat messages
+        self.transport = None
+        self.simulated_drop = 0.0  # Fractions of outgoing datagrams to drop or reorder, for testing
+        self.simulated_reorder = 0.0
+        self.receive_buffer_size = 65535  # Largest datagram read from the socket
+        self.socket_receive_buffer = 1 << 20  # SO_RCVBUF, so bursts of fragments are not dropped
+        self.fragment_mtu = 1200  # Larger datagrams are sent as fragments of at most this size
+        self.reassembly_timeout = 5.0  # Seconds a fragmented datagram may take to arrive
+        self.reassembly_memory = 4 << 20  # Bytes of fragments held while waiting for the rest
+        self.reassembler = None
+        self.peer_features = {}  # Peer -> features it advertised; peers missing here predate them
+        self.join_attempts = 4  # Join announcements sent to peers that have not answered one
+        self.join_retry_interval = 0.25  # Seconds before the first repeat, doubling after each
+        self.binary_wire = True  # Offer the compact binary format to peers that support it
+        self.binary_peers = set()  # Peers we send binary datagrams to
+        self.dissemination = "mesh"  # "mesh" sends chat to every peer, "gossip" to a few that relay it,
+                                     # "multicast" once to the room's multicast group
+        self.gossip_fanout = None  # Peers each gossip hop sends to; None picks ln(room size) + 3
+        self.multicast_interface = None  # Local address to send and join multicast on; None uses our address
+        self.multicast_ttl = 1  # Keep multicast chat on the local network segment
+        self.multicast_tail_delay = 0.25  # Quiet seconds after a multicast burst before announcing its end
+        self.clock_snapshot_interval = 16  # Chat messages sent with clock deltas between full clocks
+        self.dispatcher = self.register_handlers()
 
         if auto_run_handler:
             self.main_handler()
@@ -76,6 +188,7 @@ class P2PClient(object):
                     return
                 
             elif user_input == "Q":
+                self.close_server_connection()
                 return
 
 
@@ -99,582 +212,1986 @@ class P2PClient(object):
         print(bcolors.CYAN + bcolors.BOLD + "> " + bcolors.ENDC, end="", flush=True)
 
         self.running = True
-
-        # Create the single UDP socket that will be used throughout the session
-        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        udp_socket.bind(('', self.port))
-
         try:
-            # Broadcast join message to all peers using the single UDP socket
-            join_msg = {
-                "status": "update",
-                "type": "join",
-                "room": self.room,
-                "member": self.user_id,
-                "address": self.address,
-                "port": self.port
-            }
-            
-            for peer in self.peers:
-                try:
-                    udp_socket.sendto(json.dumps(join_msg).encode('utf-8'), peer)
-                except Exception as e:
-                    print(f"Error announcing join to peer {peer}: {e}")
-
-            while self.running:
-                readable, _, _ = select.select([sys.stdin, udp_socket], [], [])
-
-                for source in readable:
-                    if source == udp_socket:
-                        data, addr = udp_socket.recvfrom(1024)
-                        msg = json.loads(data.decode('utf-8'))
-                        
-                        if "status" in msg and msg["status"] == "update":
-                            if "type" in msg and msg["type"] == "join":
-                                # Add the new peer to our list
-                                new_peer = (msg["address"], msg["port"])
-                                if new_peer not in self.peers:
-                                    self.peers.append(new_peer)
-                                print(f"{bcolors.WARNING}{msg['member']} has joined the room{bcolors.ENDC}")
-                                
-                            elif "type" in msg and msg["type"] == "leave":
-                                # Remove the peer that's leaving
-                                leaving_peer = (msg["address"], msg["port"])
-                                if leaving_peer in self.peers:
-                                    self.peers.remove(leaving_peer)
-                                # Also remove from clocks
-                                leaving_port = str(msg["port"])
-                                if leaving_port in self.message_clock:
-                                    del self.message_clock[leaving_port]
-                                if leaving_port in self.join_time_clock:
-                                    del self.join_time_clock[leaving_port]
-                                if leaving_port in self.recovery_in_progress:
-                                    self.recovery_in_progress.remove(leaving_port)
-                                print(f"{bcolors.WARNING}{msg['member']} has left the room{bcolors.ENDC}")
-                            print(bcolors.CYAN + bcolors.BOLD + "> " + bcolors.ENDC, end="", flush=True)
-
-                        elif msg.get("type") == "message_request":
-                            self.send_requested_messages(
-                                udp_socket, 
-                                msg["requesting_port"], 
-                                msg["count"],
-                                msg.get("from_count", 0)
-                            )
-
-                        elif msg.get("type") == "recovery":
-                            sender_port = str(addr[1])
-                            msg_id = msg["message_id"]
-                            
-                            if msg_id not in self.received_messages:
-                                self.received_messages.add(msg_id)
-                                sequence_number = msg["sequence_number"]
-                                
-                                # Only process if this is the next message we're expecting
-                                if sequence_number == self.message_clock.get(sender_port, 0) + 1:
-                                    self.message_clock[sender_port] = sequence_number
-                                    print(f'\n{bcolors.YELLOW}[RECOVERY] {msg["user"]}: {msg["body"]}{bcolors.ENDC}')
-                                    print(bcolors.CYAN + bcolors.BOLD + "> " + bcolors.ENDC, end="", flush=True)
-
-                        elif msg.get("type") == "ping":
-                            # Send 3 responses to ensure at least one gets through
-                            response = {
-                                "type": "ping_response",
-                                "responder_id": self.user_id,
-                                "timestamp": time.time()
-                            }
-                            for _ in range(3):
-                                try:
-                                    udp_socket.sendto(json.dumps(response).encode('utf-8'), addr)
-                                except Exception as e:
-                                    print(f"Error sending ping response: {e}")
-                                time.sleep(0.1)  # Small delay between responses
-
-                        elif msg.get("type") == "recovery_complete":
-                            sender_port = msg["sender_port"]
-                            if sender_port in self.recovery_in_progress:
-                                self.recovery_in_progress.remove(sender_port)
-                                self.message_clock.update(msg["final_clock"])
-                                print(f"\n{bcolors.YELLOW}[RECOVERY] Completed recovery from client {sender_port}{bcolors.ENDC}")
-                                print(bcolors.CYAN + bcolors.BOLD + "> " + bcolors.ENDC, end="", flush=True)
-
-                        elif msg.get("type") == "room_verify":
-                            # Server is verifying room state
-                            verify_response = {
-                                "type": "room_verify_response",
-                                "room": msg["room"],
-                                "active_clients": self.peers
-                            }
-                            udp_socket.sendto(json.dumps(verify_response).encode('utf-8'), addr)
-
-                        else:  # Regular chat message
-                            sender_port = str(addr[1])
-                            msg_id = msg.get("message_id", f"{sender_port}_{time.time()}")
-                            
-                            if msg_id not in self.received_messages:
-                                self.received_messages.add(msg_id)
-                                
-                                # Check for clock inconsistencies
-                                if "message_clock" in msg:
-                                    received_clock = msg["message_clock"]
-                                    needs_recovery = False
-                                    
-                                    # Only check clocks if we're not already recovering
-                                    if not self.recovery_in_progress:
-                                        for port, count in received_clock.items():
-                                            if port == sender_port:
-                                                # Only recover if we've seen messages from this client before
-                                                if port in self.join_time_clock:
-                                                    expected = self.message_clock.get(port, 0) + 1
-                                                    join_time_count = self.join_time_clock.get(port, 0)
-                                                    # Only recover if messages were lost after we joined
-                                                    if count > expected and count > join_time_count:
-                                                        needs_recovery = True
-                                            else:
-                                                local_count = self.message_clock.get(port, 0)
-                                                join_time_count = self.join_time_clock.get(port, 0)
-                                                # Only recover if messages were lost after we joined
-                                                if count > local_count and count > join_time_count:
-                                                    needs_recovery = True
-                                        
-                                        if needs_recovery:
-                                            self.request_missing_messages(
-                                                udp_socket, 
-                                                sender_port, 
-                                                received_clock[sender_port],
-                                                self.message_clock.get(sender_port, 0)
-                                            )
-                                    
-                                    # Update clock if message is in sequence or from new client
-                                    if not needs_recovery:
-                                        self.message_clock.update(received_clock)
-                                
-                                if msg.get("type") != "recovery":
-                                    print(f'\n{msg["user"]}: {msg["body"]}')
-                                    print(bcolors.CYAN + bcolors.BOLD + "> " + bcolors.ENDC, end="", flush=True)
-
-                    elif source == sys.stdin: 
-                        output = self.handle_user_input(udp_socket)
-                        if output == -1:
-                            # Handle leaving the room with the same socket
-                            if self.room:
-                                self.leave_room(self.room, udp_socket)
-                            break
+            asyncio.run(self.run_session())
         except KeyboardInterrupt:
             print("\nChatroom closed.")
-        finally:
-            udp_socket.close()
 
-    def request_missing_messages(self, udp_socket, peer_port, expected_count, current_count):
+    async def run_session(self):
         '''
-        Request missing messages from a peer when clock inconsistency is detected.
+        Run the chat session on an asyncio event loop until the user has left every room.
+        The loop reads the session's sockets and stdin, and fires every timer the session's
+        components schedule, so nothing polls or sleeps.
         '''
-        # Don't request if already in progress for this peer
-        if peer_port in self.recovery_in_progress:
-            return
-            
-        missing_count = expected_count - current_count
-        request_msg = {
-            "type": "message_request",
-            "requesting_port": str(self.port),
-            "count": missing_count,
-            "from_count": current_count  # Add starting point for recovery
-        }
-        
-        peer_address = None
-        for peer in self.peers:
-            if str(peer[1]) == peer_port:
-                peer_address = peer
-                break
-        
-        if peer_address:
-            self.recovery_in_progress.add(peer_port)
-            json_request = json.dumps(request_msg)
-            udp_socket.sendto(json_request.encode('utf-8'), peer_address)
+        loop = asyncio.get_running_loop()
+        self.session_closed = loop.create_future()
+        input_task = None
+        try:
+            udp_socket = await self.start()
+            input_task = self.watch_input(loop, udp_socket)
+            await self.session_closed
+        finally:
+            if input_task:
+                input_task.cancel()
+            else:
+                self.stop_watching_input(loop)
+            await self.stop()
 
-    def send_requested_messages(self, udp_socket, requesting_port, count, from_count):
+    async def start(self):
         '''
-        Send requested messages from our log to the requesting peer.
-        
-        args:
-            udp_socket (socket): The UDP socket for sending messages
-            requesting_port (str): Port of the requesting peer
-            count (int): Number of messages requested
-            from_count (int): Starting message count to sync from
+        Open the chat session on the running asyncio loop, without reading stdin: bind the
+        UDP socket, start the session's background work and announce ourselves in every
+        room already joined. Returns the session's UDP socket.
+
+        Together with join, leave, send_message, on_message and stop this lets a program
+        chat without the menu or the terminal.
         '''
-        # Find the messages that were sent after from_count
-        messages_to_send = []
-        current_messages = list(self.message_log)
-        current_count = self.message_clock[str(self.port)]
-        start_index = max(0, len(current_messages) - (current_count - from_count))
-        
-        if start_index < len(current_messages):
-            messages_to_send = current_messages[start_index:]
+        if self.port is None and not await self.call_server(self.get_server_connection):
+            raise ConnectionError(f"Could not reach {self.default_node()}")
+        self.timers = LoopTimers(asyncio.get_running_loop())
+        udp_socket = self.open_session()
+        await udp_socket.open_endpoint(self.receive_datagram)
+        for state in list(self.rooms.values()):
+            await self.start_room(state, udp_socket)
+        return udp_socket
+
+    async def stop(self):
+        '''
+        Close the chat session. Rooms not left beforehand are dropped without telling
+        their peers or the server.
+        '''
+        self.close_session()
+        # Let the server hear about rooms we left and peers we evicted
+        if self.server_updates:
+            await asyncio.wait(list(self.server_updates))
+        # Let the transports finish closing their sockets before the loop goes away
+        await asyncio.sleep(0)
+        self.timers = TimerQueue()
+
+    async def join(self, room, create=False):
+        '''
+        Join a room, or create it, and make it the current room. Returns True on success.
+        If the session is open the room starts at once; otherwise it starts with the session.
 
-        requester_address = None
-        for peer in self.peers:
-            if str(peer[1]) == requesting_port:
-                requester_address = peer
-                break
-        
-        if requester_address:
-            for idx, message in enumerate(messages_to_send):
-                msg_id = f"{self.port}_{from_count + idx + 1}"
-                send_msg = {
-                    "user": self.user_id,
-                    "body": message,
-                    "message_clock": self.message_clock.copy(),
-                    "type": "recovery",
-                    "message_id": msg_id,
-                    "sequence_number": from_count + idx + 1
-                }
-                json_send_msg = json.dumps(send_msg)
-                
-                # Send each message 5 times with small delays
-                for _ in range(5):
-                    try:
-                        udp_socket.sendto(json_send_msg.encode('utf-8'), requester_address)
-                        time.sleep(0.1)  # Small delay between retries
-                    except Exception as e:
-                        print(f"Error during recovery message send: {e}")
-            
-            # Send end of recovery message
-            end_msg = {
-                "type": "recovery_complete",
-                "final_clock": self.message_clock.copy(),
-                "sender_port": str(self.port)
-            }
-            json_end_msg = json.dumps(end_msg)
-            
-            # Send completion message 5 times as well
-            for _ in range(5):
-                try:
-                    udp_socket.sendto(json_end_msg.encode('utf-8'), requester_address)
-                    time.sleep(0.1)
-                except Exception as e:
-                    print(f"Error sending recovery completion: {e}")
+        The request to the name server is made on a worker thread, so the session's other
+        rooms keep running while it is answered.
 
-    
-    def handle_user_input(self, udp_socket):
+        args:
+            room (str): The room to join.
+            create (bool): Create the room rather than join an existing one.
         '''
-        Method that handles user input, such as:
-            1. Sending a chat to all peers
-            2. Handling special user input (commands)
-            3. Exiting the chatroom if necessary
+        if room in self.rooms:
+            return True
+        # Check before the server records us in a room we could not enter
+        if self.room_id_clashes(room):
+            return False
+        action = "create" if create else "join"
+        response = await self.call_server(self.request_room, action, room)
+        if not (self.room_created(room, response) if create else self.room_joined(room, response)):
+            return False
+        if self.udp_socket:
+            state = self.foreground
+            self.open_room(state, self.udp_socket)
+            await self.start_room(state, self.udp_socket)
+        return True
+
+    async def leave(self, room):
+        '''
+        Leave a room, telling its peers and the name server. Returns True on success.
 
         args:
-            udp_socket (socket): The UDP socket the client is listening on.
+            room (str): The room to leave.
         '''
-        message = sys.stdin.readline().strip()
-        
-        # special user command
-        if message.lower().startswith("/"):
-            if message.lower() == "/help":
-                print("\n=== Options ===\n")
-                print("/clock - shows clock of messages sent by each client")
-                print("/history - shows most recent sent messages")
-                print("/peers - shows current peers in client list")
-                print("/ping - check for inactive peers")
-                print("/exit - exits room and returns to menu")
-                print("\n====================\n")
+        if self.udp_socket is None:
+            return False
+        update = self.leave_room(room, self.udp_socket)
+        if update is None:
+            return False
+        # The leave notices go out while the server is told
+        await update
+        return True
 
-            elif message.lower() == "/exit":
-                print("Exiting chatroom...")
-                if self.room:
-                    self.leave_room(self.room, udp_socket=udp_socket)
-                self.running = False
-                return -1
-            
-            elif message.lower() == "/history":
-                print("\n=== Message History ===")
-                for idx, msg in enumerate(self.message_log, 1):
-                    print(f"{idx}. {msg}")
-                print("====================\n")
+    def send_message(self, body, room=None):
+        '''
+        Send a chat message. Returns its sequence number in our messages to the room.
 
-            elif message.lower() == "/clock":
-                print("\n=== Message Clock ===")
-                for port, count in self.message_clock.items():
-                    print(f"Client {port}: {count} messages")
-                print("====================\n")
+        args:
+            body (str): The message body.
+            room (str): The room to send to. Defaults to the current room.
+        '''
+        state = self.rooms[room] if room else self.foreground
+        if state is self.lobby:
+            raise ValueError("Not in any room")
+        with self.in_room(state):
+            return self.send_chat(self.udp_socket, body)
 
-            elif message.lower() == "/peers":
-                print("\n=== Peers ===")
-                for peer in self.peers:
-                    print(f"{peer}")
-                print("====================\n")
+    def on_message(self, callback):
+        '''
+        Register a callback for every chat message delivered, live or recovered, in any
+        room.
 
-            elif message.lower() == "/ping":
-                self.ping_peers(udp_socket)
+        args:
+            callback (callable): Called as callback(room, user, body).
+        '''
+        self.message_callbacks.append(callback)
 
-        
-        print(bcolors.CYAN + bcolors.BOLD + "> " + bcolors.ENDC, end="", flush=True)
+    def watch_input(self, loop, udp_socket):
+        '''
+        Handle each line typed on stdin as it arrives. The loop watches stdin when it can be
+        polled; when it cannot, such as a redirected regular file, lines are read on a worker
+        thread instead and the reading task is returned.
 
-        # Only add non-command messages to the log and update clock
-        if not message.startswith("/"):
-            self.message_log.append(message)
-            self.message_clock[str(self.port)] = self.message_clock.get(str(self.port), 0) + 1
+        args:
+            loop (asyncio.AbstractEventLoop): The session's event loop.
+            udp_socket (socket): The session's UDP socket.
+        '''
+        try:
+            loop.add_reader(sys.stdin.fileno(), self.read_input, udp_socket)
+            return None
+        except (OSError, ValueError):
+            return loop.create_task(self.read_input_in_thread(udp_socket))
 
-            for peer in self.peers:
-                if peer != (self.address, self.port):
-                    try:
-                        send_msg = {
-                            "user": self.user_id,
-                            "body": message,
-                            "message_clock": self.message_clock,
-                            "type": "chat"
-                        }
-                        json_send_msg = json.dumps(send_msg)
-                        udp_socket.sendto(json_send_msg.encode('utf-8'), tuple(peer))
+    def stop_watching_input(self, loop):
+        try:
+            loop.remove_reader(sys.stdin.fileno())
+        except (OSError, ValueError):
+            pass
 
-                    except Exception as e:
-                        print(f"Error sending message to {peer}: {e}")
+    async def read_input_in_thread(self, udp_socket):
+        loop = asyncio.get_running_loop()
+        while not self.session_closed.done():
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            self.read_input(udp_socket, line)
 
+    def read_input(self, udp_socket, line=None):
+        '''
+        Handle one line of user input, closing the session when the user leaves the room or
+        stdin runs out.
 
-    def display_menu(self):
+        args:
+            udp_socket (socket): The session's UDP socket.
+            line (str): The line read, or None to read it from stdin now.
         '''
-        Displays the initial menu and returns the user's response.
+        if line is None:
+            line = sys.stdin.readline()
+        if not line:
+            line = "/exit"
+        if self.handle_user_input(udp_socket, line.strip()) == -1 and not self.session_closed.done():
+            self.session_closed.set_result(None)
+
+    def open_session(self):
         '''
-        while True:
-            print("\tA. List public rooms")
-            print("\tB. Join a room")
-            print("\tC. Create a room")
-            print("\tQ. Quit this application\nInput: ", end="")
-
-            option = sys.stdin.readline().strip().upper()
-            if option in {"A", "B", "C", "Q"}:
-                return option
-            else:
-                print(f"'{option}' is not a valid option. Please try again.")
+        Create the single UDP socket used throughout a chat session, along with the
+        reliable transport and failure detector that run on it. Returns the socket.
+        '''
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.socket_receive_buffer:
+            try:
+                udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_receive_buffer)
+            except OSError as e:
+                print(f"Could not set the UDP receive buffer size: {e}")
+        udp_socket.bind(('', self.port))
+        udp_socket = BatchingSocket(udp_socket)
+        if self.simulated_drop or self.simulated_reorder:
+            udp_socket = LossySocket(
+                udp_socket, self.simulated_drop, self.simulated_reorder, timers=self.timers
+            )
+        udp_socket = FragmentingSocket(udp_socket, self.fragment_mtu)
+        self.reassembler = Reassembler(self.reassembly_timeout, self.reassembly_memory)
+        self.udp_socket = udp_socket
+        if self.reliable_delivery:
+            self.transport = ReliableTransport(
+                self.timers, udp_socket, self.dispatch, binary_peers=self.binary_peers
+            )
+        if self.failure_detection:
+            self.failure_detector = FailureDetector(
+                self.timers, udp_socket, (self.address, self.port),
+                self.probe_peers, self.handle_peer_failure
+            )
+            self.failure_detector.start()
+        for state in self.rooms.values():
+            self.open_room(state, udp_socket)
+        return udp_socket
+
+    def open_room(self, state, udp_socket):
+        '''
+        Set up what a room needs on the session socket beyond the socket itself, which is
+        the room's multicast group in multicast mode.
 
+        args:
+            state (RoomState): The room.
+            udp_socket (socket): The session's UDP socket.
+        '''
+        if self.dissemination == "multicast" and not state.multicast_socket:
+            with self.in_room(state):
+                self.open_multicast(udp_socket)
 
-    def connect_to_central_server(self, server_hostname=None, server_port=None):
+    async def start_room(self, state, udp_socket):
         '''
-        Connects the P2PClient object to the central server.
+        Start receiving a room's multicast chat, if it has any, and announce ourselves to
+        the room's peers.
 
         args:
-            hostname (str): IP address of the central server.
-            port (int): Port of the central server.
+            state (RoomState): The room.
+            udp_socket (socket): The session's UDP socket.
         '''
-        if not server_hostname:
-            server_hostname = self.server_hostname
-        if not server_port:
-            server_port = self.server_port
-        
-        try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.settimeout(5) 
-            client_socket.connect((server_hostname, server_port))
-            self.address, self.port = client_socket.getsockname()
-            return client_socket
-        except(socket.timeout, socket.error) as e:
-            print(f"Connection failed: {e}")
-            return None
-
-    
-    def handle_message(self):
-        # need to implement, basically consolidate the following functions to re-use code
-        pass
+        if state.multicast_socket:
+            await state.multicast_socket.open_endpoint(
+                lambda data, addr: self.receive_multicast(state, data, addr)
+            )
+        if state.room in self.rooms:
+            with self.in_room(state):
+                self.announce_join(udp_socket)
+
+    def all_peers(self):
+        '''
+        Returns every peer we share at least one room with.
+        '''
+        peers = {}
+        for state in self.rooms.values():
+            for peer in state.peers:
+                peers[tuple(peer)] = True
+        return list(peers)
 
-    def list_rooms(self):
+    def multicast_group_for(self, room):
         '''
-        Lists all available rooms from the central server.
-        
-        Returns:
-            bool: True if rooms were successfully listed, False otherwise
+        Returns the (group, port) a room's multicast chat uses. Rooms hash into the
+        organization-local scope 239.192.0.0/14 and a port from 40000 to 59999.
+
+        args:
+            room (str): The room name.
         '''
-        try:
-            self.server_socket = self.connect_to_central_server(self.server_hostname, self.server_port)
-            if not self.server_socket:
-                print(f"Error creating socket connection to {self.server_hostname}:{self.server_port}")
-                return False
-            
-            list_request = {
-                "action": "list"
-            }
-            
-            self.server_socket.sendall(json.dumps(list_request).encode("utf-8"))
-            
-            message = self.server_socket.recv(1024)
-            if message:
-                response = json.loads(message.decode("utf-8"))
-                
-                if response["status"] == "success":
-                    rooms = response.get("rooms", {})
-                    if not rooms:
-                        print(f"\n{bcolors.YELLOW}No active rooms available.{bcolors.ENDC}")
-                    else:
-                        print(f"\n{bcolors.GREEN}Available rooms:{bcolors.ENDC}")
-                        for room_name, info in rooms.items():
-                            member_count = info.get("member_count", 0)
-                            print(f"{bcolors.CYAN}• {room_name}: {member_count} member(s){bcolors.ENDC}")
-                    return True
-                else:
-                    print(f"{bcolors.RED}Failed to retrieve room list: {response.get('message', 'Unknown error')}{bcolors.ENDC}")
-                    return False
-                    
-        except (socket.timeout, socket.error) as e:
-            print(f"{bcolors.RED}Connection failed: {e}{bcolors.ENDC}")
-            return False
-        finally:
-            if self.server_socket:
-                self.server_socket.close()
+        digest = hashlib.md5(room.encode('utf-8')).digest()
+        group = f"239.{192 + (digest[0] & 3)}.{digest[1]}.{digest[2]}"
+        return group, 40000 + int.from_bytes(digest[3:5], "big") % 20000
 
-    def join_room(self, room):
+    def open_multicast(self, udp_socket):
         '''
-        Joins a specified room by getting initial peer list from server then broadcasting presence.
-        
+        Join the room's multicast group and point the session socket's multicast sends at
+        it. If the network does not allow it, chat stays unicast.
+
         args:
-            room (str): Identifier of the room the client wishes to join.
+            udp_socket (socket): The session's UDP socket, which multicast chat is sent from.
         '''
+        group, port = self.multicast_group_for(self.room)
+        interface = self.multicast_interface or self.address or "0.0.0.0"
+        multicast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
-            # First get initial room info from server
-            self.server_socket = self.connect_to_central_server(self.server_hostname, self.server_port)
-            if not self.server_socket:
-                print(f"Error creating socket connection to {self.server_hostname}:{self.server_port}")
-                return False
-            
-            # Store TCP connection details when joining
-            self.tcp_address, self.tcp_port = self.server_socket.getsockname()
-            
-            join_request = {
-                "action": "join",
-                "room": room
-            }
+            multicast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                multicast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            try:
+                # Binding to the group keeps out other groups' traffic on the same port
+                multicast_socket.bind((group, port))
+            except OSError:
+                multicast_socket.bind(('', port))
+            membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface))
+            multicast_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+
+            udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.multicast_ttl)
+            udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+        except OSError as e:
+            print(f"Could not join multicast group {group}:{port}, using unicast: {e}")
+            multicast_socket.close()
+            return
+        self.multicast_socket = BatchingSocket(multicast_socket)
+        self.multicast_group = (group, port)
 
-            self.server_socket.sendall(json.dumps(join_request).encode("utf-8"))
+    def close_multicast(self):
+        '''
+        Leave the room's multicast group and fall back to unicast.
+        '''
+        if self.multicast_socket:
+            self.multicast_socket.close()
+        if self.multicast_tail_timer is not None:
+            self.timers.cancel(self.multicast_tail_timer)
+        self.multicast_tail_timer = None
+        self.multicast_socket = None
+        self.multicast_group = None
+        self.multicast_peers.clear()
+
+    def announce_join(self, udp_socket, attempt=1):
+        '''
+        Broadcast a join message to all peers using the session's UDP socket, along with
+        the codecs and features we support.
 
-            message = self.server_socket.recv(1024)
-            if message:
-                response = json.loads(message.decode("utf-8"))
+        We do not know yet which peers support the reliable transport, so the join goes
+        out as a plain datagram. Peers that do answer with their own features; the join
+        is repeated, with a doubling interval, to peers that have not answered, since
+        either the join was lost or the peer predates features and will never answer.
 
-                if response["status"] == "success":
-                    print(f"Got initial room info for {room}")
-                    self.room = room
-                    self.peers = [tuple(peer) for peer in response["ips"]]
-                    
-                    # Initialize message tracking
-                    self.message_clock = {}
-                    self.join_time_clock = {}
-                    if str(self.port) not in self.message_clock:
-                        self.message_clock[str(self.port)] = 0
-                        self.join_time_clock[str(self.port)] = 0
-                        
-                    return True
-                else:
-                    print(f"Server failed to provide room info for {room}")
-                    return False
+        args:
+            udp_socket (socket): The UDP socket the client is listening on.
+            attempt (int): How many times the join has been sent, including this one.
+        '''
+        if attempt > 1 and self.rooms.get(self.room) is not self.room_state:
+            return  # We left the room meanwhile
+        join_msg = {
+            "status": "update",
+            "type": "join",
+            "room": self.room,
+            "member": self.user_id,
+            "address": self.address,
+            "port": self.port,
+            "features": self.features(),
+            "attempt": attempt
+        }
+        if self.binary_wire:
+            join_msg["codecs"] = [wire.CODEC]
+        if self.multicast_group:
+            join_msg["multicast"] = list(self.multicast_group)
 
-        except (socket.timeout, socket.error) as e:
-            print(f"Connection failed: {e}")
-            return False
-        
+        json_join_msg = json.dumps(join_msg).encode('utf-8')
+        unanswered = 0
+        for peer in self.peers:
+            if tuple(peer) == (self.address, self.port) or tuple(peer) in self.peer_features:
+                continue
+            unanswered += 1
+            try:
+                udp_socket.sendto(json_join_msg, peer)
+            except Exception as e:
+                print(f"Error announcing join to peer {peer}: {e}")
 
-    def create_room(self, room):
+        if unanswered and attempt < self.join_attempts:
+            self.room_state.timers.call_later(
+                self.join_retry_interval * 2 ** (attempt - 1), self.announce_join, udp_socket, attempt + 1
+            )
+
+    def close_session(self):
         '''
-        Create a room for client-to-client interaction.
+        Stop everything running on the session's UDP socket and close it.
+        '''
+        if self.failure_detector:
+            self.failure_detector.stop()
+            self.failure_detector = None
+        if self.transport:
+            self.transport.stop()
+            self.transport = None
+        # The rooms go with the socket; the user joins afresh from the menu
+        for state in list(self.rooms.values()):
+            self.drop_room(state)
+        if self.udp_socket:
+            self.udp_socket.close()
+        self.udp_socket = None
+        self.timers.clear()
+        self.reassembler = None
+
+    def register_handlers(self):
+        '''
+        Build the dispatch table mapping each peer datagram type to its handler.
+        Datagrams without a known type are treated as chat messages.
+        '''
+        dispatcher = MessageDispatcher(default_type="chat")
+        dispatcher.register("join", self.handle_join)
+        dispatcher.register("leave", self.handle_leave)
+        dispatcher.register("message_request", self.handle_message_request)
+        dispatcher.register("recovery", self.handle_recovery)
+        dispatcher.register("recovery_batch", self.handle_recovery_batch)
+        dispatcher.register("recovery_complete", self.handle_recovery_complete)
+        dispatcher.register("recovery_ack", self.handle_recovery_ack)
+        dispatcher.register("ping", self.handle_ping)
+        dispatcher.register("ping_response", self.handle_ping_response)
+        dispatcher.register("room_verify", self.handle_room_verify)
+        dispatcher.register("swim_ping", self.handle_failure_detector)
+        dispatcher.register("swim_ping_req", self.handle_failure_detector)
+        dispatcher.register("swim_ack", self.handle_failure_detector)
+        dispatcher.register("rel_data", self.handle_reliable)
+        dispatcher.register("rel_ack", self.handle_reliable)
+        dispatcher.register("features", self.handle_features)
+        dispatcher.register("gossip", self.handle_gossip)
+        dispatcher.register("multicast_member", self.handle_multicast_member)
+        dispatcher.register("multicast_tail", self.handle_multicast_tail)
+        dispatcher.register("chat", self.handle_chat)
+        return dispatcher
+
+    def receive_datagram(self, data, addr, multicast=False):
+        '''
+        Decode one datagram and dispatch it to its handler.
 
         args:
-            room (str): Identifier of the room the client wishes to create.
+            data (bytes): The datagram.
+            addr (tuple): The (address, port) it came from.
+            multicast (bool): True if it arrived on the room's multicast socket.
         '''
-        print(f"Attempting to create room {room}...")
+        if multicast:
+            # The group also carries our own chat, and possibly strangers'
+            if tuple(addr) == (self.address, self.port) or tuple(addr) not in self.peers:
+                return
+            self.multicast_peers.add(tuple(addr))
+        if is_fragment(data):
+            data = self.reassembler.add(addr, data)
+            if data is None:
+                return
         try:
-            self.server_socket = self.connect_to_central_server(self.server_hostname, self.server_port)
-            if not self.server_socket:
-                print(f"Error creating socket connection to {self.server_hostname}:{self.server_port}")
-                return False
-            
-            # Store TCP connection details when creating
-            self.tcp_address, self.tcp_port = self.server_socket.getsockname()
-            
-            join_request = {
-                "action": "create",
-                "room": room,
-            }
-            self.server_socket.sendall(json.dumps(join_request).encode("utf-8"))
+            msg = wire.decode(data)
+        except ValueError:
+            print(f"Dropping malformed datagram from {addr}")
+            return
+        if self.binary_wire and wire.is_binary(data):
+            self.binary_peers.add(tuple(addr))
+        feature = FEATURE_TYPES.get(msg.get("type"))
+        if feature:
+            # Only a peer that has the feature sends its datagrams
+            self.peer_features.setdefault(tuple(addr), set()).add(feature)
+        if self.failure_detector:
+            self.failure_detector.heard_from(addr)
+        self.dispatch(msg, addr)
+
+    def receive_multicast(self, state, data, addr):
+        '''
+        Handle a datagram that arrived on a room's multicast socket.
 
-            message = self.server_socket.recv(1024)
-            if message:
-                response = json.loads(message.decode("utf-8"))
+        args:
+            state (RoomState): The room whose group the datagram was sent to.
+            data (bytes): The datagram.
+            addr (tuple): The (address, port) it came from.
+        '''
+        with self.in_room(state):
+            self.receive_datagram(data, addr, multicast=True)
 
-                if response["status"] == "success":
-                    print(f"Server successfully created room {room}")
-                    self.room = room
-                    self.peers = [(self.address, self.port)]
-                    return True
-                
-                else:
-                    print(f"Server failed to create room {room}")
-                    return False
-        
-        except (socket.timeout, socket.error) as e:
-            print(f"Connection failed: {e}")
+    def dispatch(self, msg, addr):
+        '''
+        Hand a decoded message to its handler, acting in the room it belongs to. Messages
+        for a room we are not in are dropped. A message that names no room comes from a
+        peer that does not tag them, and belongs to our only room if we are in just one.
 
+        args:
+            msg (dict): The decoded datagram.
+            addr (tuple): The (address, port) it came from.
+        '''
+        if msg.get("type") in ROOMLESS_TYPES:
+            return self.dispatcher.dispatch(msg, addr)
+        if "room" in msg:
+            state = self.rooms.get(msg["room"])
+        elif "room_id" in msg:
+            state = self.room_ids.get(msg["room_id"])
+        elif len(self.rooms) == 1:
+            state = next(iter(self.rooms.values()))
+        else:
+            state = None
+        if state is None:
+            return None
+        with self.in_room(state):
+            return self.dispatcher.dispatch(msg, addr)
 
-    def leave_room(self, room, udp_socket):
+    @contextlib.contextmanager
+    def in_room(self, state):
         '''
-        Leave a room and notify peers directly.
-        
+        Act in a room other than the foreground one for the duration of a with block.
+
         args:
-            room (str): Identifier of the room to leave
-            udp_socket (socket): The UDP socket for sending the leave notification
+            state (RoomState): The room to act in.
         '''
+        previous, self.room_state = self.room_state, state
         try:
-            # Prepare leave notification
-            leave_notification = {
-                "status": "update",
-                "type": "leave",
-                "room": room,
-                "member": self.user_id,
-                "address": self.address,
-                "port": self.port
+            yield state
+        finally:
+            # Fall back to the foreground if the room we were acting in was left meanwhile
+            if previous is self.lobby or self.rooms.get(previous.room) is previous:
+                self.room_state = previous
+            else:
+                self.room_state = self.foreground
+
+    def print_prompt(self):
+        '''
+        Print the chat input prompt, naming the current room when we are in several.
+        '''
+        if not self.echo:
+            return
+        room = f"{self.foreground.room} " if len(self.rooms) > 1 else ""
+        print(bcolors.CYAN + bcolors.BOLD + room + "> " + bcolors.ENDC, end="", flush=True)
+
+    def show_message(self, user, body, recovered=False):
+        '''
+        Deliver a chat message: print it if echo is on and pass it to every on_message
+        callback.
+
+        args:
+            user (str): The user ID it was sent as.
+            body (str): The message body.
+            recovered (bool): True if it arrived through loss recovery.
+        '''
+        if self.echo:
+            if recovered:
+                print(f'\n{bcolors.YELLOW}{self.room_label()}[RECOVERY] {user}: {body}{bcolors.ENDC}')
+            else:
+                print(f'\n{self.room_label()}{user}: {body}')
+            self.print_prompt()
+        for callback in self.message_callbacks:
+            callback(self.room, user, body)
+
+    def room_label(self):
+        '''
+        Returns the prefix that tells which room a notice is about, when we are in several.
+        '''
+        return f"[{self.room}] " if len(self.rooms) > 1 else ""
+
+    def probe_peers(self):
+        '''
+        Returns the peers the failure detector may probe: those that advertised it.
+        '''
+        return [peer for peer in self.all_peers() if self.supports(peer, "swim")]
+
+    def features(self):
+        '''
+        Returns the optional datagram types we understand, to advertise to peers.
+        '''
+        features = ["gossip"]
+        if self.reliable_delivery:
+            features.append("reliable")
+        if self.failure_detection:
+            features.append("swim")
+        return features
+
+    def supports(self, peer, feature):
+        '''
+        Returns True if a peer advertised a feature.
+
+        args:
+            peer (tuple): The (address, port) of the peer.
+            feature (str): The feature, such as "reliable" or "swim".
+        '''
+        return feature in self.peer_features.get(tuple(peer), ())
+
+    def reliable_to(self, peer):
+        '''
+        Returns True if messages to a peer go through the reliable transport: we run one
+        and the peer advertised it.
+
+        args:
+            peer (tuple): The (address, port) of the peer.
+        '''
+        return self.transport is not None and self.supports(peer, "reliable")
+
+    def remove_peer(self, peer):
+        '''
+        Forget a peer and its clock state.
+
+        args:
+            peer (tuple): The (address, port) of the peer.
+        '''
+        if peer in self.peers:
+            self.peers.remove(peer)
+        leaving_port = str(peer[1])
+        if leaving_port in self.message_clock:
+            del self.message_clock[leaving_port]
+        if leaving_port in self.join_time_clock:
+            del self.join_time_clock[leaving_port]
+        if leaving_port in self.recovery_in_progress:
+            self.recovery_in_progress.remove(leaving_port)
+        self.recovery_buffers.pop(leaving_port, None)
+        self.received_messages.forget(leaving_port)
+        self.clock_baselines.pop(tuple(peer), None)
+        self.multicast_peers.discard(tuple(peer))
+        sender = self.recovery_senders.pop(leaving_port, None)
+        if sender:
+            sender.stop()
+        self.forget_connection(peer)
+
+    def forget_connection(self, peer):
+        '''
+        Drop the transport and codec state for a peer, unless we still share a room with it.
+
+        args:
+            peer (tuple): The (address, port) of the peer.
+        '''
+        if tuple(peer) in self.all_peers():
+            return
+        self.binary_peers.discard(tuple(peer))
+        self.peer_features.pop(tuple(peer), None)
+        if self.transport:
+            self.transport.forget(peer)
+
+    def handle_join(self, msg, addr):
+        '''
+        A peer announced that it joined the room.
+        '''
+        # Add the new peer to our list
+        new_peer = (msg["address"], msg["port"])
+        repeated = new_peer in self.peers and msg.get("attempt", 1) > 1
+        if new_peer not in self.peers:
+            self.peers.append(new_peer)
+        if self.binary_wire and wire.CODEC in msg.get("codecs", []):
+            self.binary_peers.add(new_peer)
+        if "features" in msg:
+            # Tell the new peer what we support, which also tells it its join arrived
+            self.peer_features[new_peer] = set(msg["features"])
+            features_msg = {
+                "type": "features",
+                "features": self.features(),
+                "codecs": [wire.CODEC] if self.binary_wire else [],
+                "address": self.address,
+                "port": self.port
             }
+            self.send_to_peer(new_peer, json.dumps(features_msg).encode('utf-8'))
+        if self.multicast_group and msg.get("multicast") == list(self.multicast_group):
+            # Tell the new peer we listen on the group too, so it stops unicasting to us
+            self.multicast_peers.add(new_peer)
+            member_msg = {
+                "type": "multicast_member",
+                "room_id": self.room_id,
+                "multicast": list(self.multicast_group),
+                "address": self.address,
+                "port": self.port
+            }
+            self.send_to_peer(new_peer, json.dumps(member_msg).encode('utf-8'))
+        if self.echo and not repeated:
+            print(f"\n{bcolors.WARNING}{self.room_label()}{msg['member']} has joined the room{bcolors.ENDC}")
+            self.print_prompt()
+
+    def handle_features(self, msg, addr):
+        '''
+        A peer answered our join with the codecs and features it supports.
+        '''
+        peer = (msg["address"], msg["port"])
+        self.peer_features[peer] = set(msg.get("features", []))
+        if self.binary_wire and wire.CODEC in msg.get("codecs", []):
+            self.binary_peers.add(peer)
+
+    def send_to_peer(self, peer, data):
+        '''
+        Send an encoded message to a peer, through the reliable transport if the peer
+        supports it and as a plain datagram otherwise.
+
+        args:
+            peer (tuple): The (address, port) of the peer.
+            data (bytes): The encoded message.
+        '''
+        if self.reliable_to(peer):
+            self.transport.send(peer, data)
+            return
+        try:
+            self.udp_socket.sendto(data, peer)
+        except Exception as e:
+            print(f"Error sending message to {peer}: {e}")
+
+    def handle_leave(self, msg, addr):
+        '''
+        A peer announced that it, or a peer that stopped responding, left the room.
+        '''
+        # Remove the peer that's leaving, along with its clocks
+        self.remove_peer((msg["address"], msg["port"]))
+        if self.echo:
+            print(f"\n{bcolors.WARNING}{self.room_label()}{msg['member']} has left the room{bcolors.ENDC}")
+            self.print_prompt()
+
+    def handle_message_request(self, msg, addr):
+        '''
+        A peer asked us to resend messages it missed.
+        '''
+        self.send_requested_messages(
+            self.udp_socket, 
+            msg["requesting_port"], 
+            msg["count"],
+            msg.get("from_count", 0),
+            msg.get("mtu")
+        )
+
+    def handle_recovery(self, msg, addr):
+        '''
+        A peer resent one of its messages that we missed.
+        '''
+        self.accept_recovered(str(addr[1]), msg["sequence_number"], msg)
+
+    def handle_recovery_batch(self, msg, addr):
+        '''
+        A peer resent a run of consecutive messages that we missed in one datagram.
+        '''
+        sender_port = str(addr[1])
+        for offset, body in enumerate(msg["messages"]):
+            sequence_number = msg["first_sequence"] + offset
+            self.accept_recovered(sender_port, sequence_number, {"user": msg["user"], "body": body})
+
+    def accept_recovered(self, sender_port, sequence_number, msg):
+        '''
+        Deliver a recovered message once every message before it has been delivered.
+
+        args:
+            sender_port (str): Port of the peer that sent the message.
+            sequence_number (int): The message's position in the sender's message clock.
+            msg (dict): The message, with "user" and "body".
+        '''
+        if sequence_number <= self.message_clock.get(sender_port, 0):
+            return
+
+        # Hold messages that arrive ahead of a gap until the gap is filled. One that was
+        # already shown live still fills its place in the sequence, but is not shown again.
+        buffer = self.recovery_buffers.setdefault(sender_port, {})
+        if self.received_messages.seen(sender_port, sequence_number):
+            buffer[sequence_number] = None
+        else:
+            buffer[sequence_number] = msg
+
+        next_number = self.message_clock.get(sender_port, 0) + 1
+        while next_number in buffer:
+            recovered = buffer.pop(next_number)
+            self.received_messages.add(sender_port, next_number)
+            self.message_clock[sender_port] = next_number
+            if recovered is not None:
+                self.show_message(recovered["user"], recovered["body"], recovered=True)
+            next_number += 1
+
+    def handle_recovery_complete(self, msg, addr):
+        '''
+        A peer finished resending the messages we asked for.
+        '''
+        sender_port = msg["sender_port"]
+        if "last_sequence" in msg:
+            # Tell the sender which of the resent messages arrived so it only resends the rest
+            delivered = self.message_clock.get(sender_port, 0)
+            buffered = self.recovery_buffers.get(sender_port, {})
+            received = [
+                number for number in range(msg["first_sequence"], msg["last_sequence"] + 1)
+                if number <= delivered or number in buffered
+            ]
+            done = len(received) == msg["last_sequence"] - msg["first_sequence"] + 1
+            ack = {
+                "type": "recovery_ack",
+                "room_id": self.room_id,
+                "requesting_port": str(self.port),
+                "received": to_ranges(received),
+                "done": done
+            }
+            try:
+                self.udp_socket.sendto(json.dumps(ack).encode('utf-8'), addr)
+            except Exception as e:
+                print(f"Error acknowledging recovery: {e}")
+            if not done and sender_port in self.recovery_in_progress:
+                return
+
+        if sender_port in self.recovery_in_progress:
+            self.recovery_in_progress.remove(sender_port)
+            # Messages the sender no longer had leave a gap; show what came after it
+            buffer = self.recovery_buffers.pop(sender_port, {})
+            for sequence_number in sorted(buffer):
+                recovered = buffer[sequence_number]
+                self.received_messages.add(sender_port, sequence_number)
+                if recovered is not None:
+                    self.show_message(recovered["user"], recovered["body"], recovered=True)
+                self.message_clock[sender_port] = max(self.message_clock.get(sender_port, 0), sequence_number)
+            final_clock = dict(msg["final_clock"])
+            if self.multicast_group:
+                # Skip past the sender's messages that arrived live during recovery, but
+                # not past any that were lost, so the next one reveals the gap
+                final_clock.pop(sender_port, None)
+                delivered = self.message_clock.get(sender_port, 0)
+                while self.received_messages.seen(sender_port, delivered + 1):
+                    delivered += 1
+                self.message_clock[sender_port] = delivered
+            self.message_clock.update(final_clock)
+            if self.echo:
+                print(f"\n{bcolors.YELLOW}{self.room_label()}[RECOVERY] Completed recovery from client {sender_port}{bcolors.ENDC}")
+                self.print_prompt()
+
+    def handle_ping(self, msg, addr):
+        '''
+        A peer is checking whether we are still alive.
+        '''
+        # Send 3 responses 0.1s apart to ensure at least one gets through
+        response = {
+            "type": "ping_response",
+            "room_id": self.room_id,
+            "responder_id": self.user_id,
+            "timestamp": time.time()
+        }
+        response_data = json.dumps(response).encode('utf-8')
+        for attempt in range(3):
+            self.timers.call_later(attempt * 0.1, self.send_ping_response, response_data, addr)
+
+    def send_ping_response(self, response_data, addr):
+        '''
+        Send one ping response, if the chat session is still open.
+
+        args:
+            response_data (bytes): The encoded ping response.
+            addr (tuple): The (address, port) of the peer that pinged us.
+        '''
+        if self.udp_socket is None:
+            return
+        try:
+            self.udp_socket.sendto(response_data, addr)
+        except Exception as e:
+            print(f"Error sending ping response: {e}")
+
+    def handle_ping_response(self, msg, addr):
+        '''
+        A peer answered one of our pings.
+        '''
+        if self.ping_responses is not None and (addr[0], addr[1]) in self.ping_responses:
+            self.ping_responses[(addr[0], addr[1])] += 1
+
+    def handle_room_verify(self, msg, addr):
+        '''
+        The name server is verifying that the room is still alive.
+        '''
+        verify_response = {
+            "type": "room_verify_response",
+            "room": msg["room"],
+            "active_clients": self.peers
+        }
+        if "request_id" in msg:
+            verify_response["request_id"] = msg["request_id"]
+        self.udp_socket.sendto(json.dumps(verify_response).encode('utf-8'), addr)
+
+    def handle_failure_detector(self, msg, addr):
+        '''
+        A probe, indirect probe request or ack from another peer's failure detector.
+        '''
+        if self.failure_detector:
+            self.failure_detector.handle(msg, addr)
+
+    def handle_reliable(self, msg, addr):
+        '''
+        A sequenced message or an acknowledgement from another peer's reliable transport.
+        Sequenced messages are dispatched again, in order, once everything before them arrived.
+        '''
+        if not self.transport:
+            return
+        if msg["type"] == "rel_data":
+            self.transport.handle_data(msg, addr)
+        else:
+            self.transport.handle_ack(msg, addr)
+
+    def handle_multicast_member(self, msg, addr):
+        '''
+        A peer that was already in the room listens on the room's multicast group.
+        '''
+        if self.multicast_group and msg.get("multicast") == list(self.multicast_group):
+            self.multicast_peers.add((msg["address"], msg["port"]))
+
+    def handle_peer_failure(self, peer):
+        '''
+        The failure detector declared a peer dead.
+
+        args:
+            peer (tuple): The (address, port) of the dead peer.
+        '''
+        evicted = False
+        for state in list(self.rooms.values()):
+            if peer in state.peers:
+                with self.in_room(state):
+                    print(f"\n{bcolors.RED}{self.room_label()}{peer} stopped responding{bcolors.ENDC}")
+                    self.evict_peers(self.udp_socket, [peer], "failure_detector")
+                evicted = True
+        if evicted:
+            self.print_prompt()
+
+    def handle_chat(self, msg, addr):
+        '''
+        A peer sent a chat message. Gaps in its message clock trigger recovery.
+
+        The message carries either the sender's full clock or only the entries that
+        changed since its previous message to us. Either way only the entries present
+        are checked and merged, since the rest are unchanged from what we already saw.
+        '''
+        sender_port = str(addr[1])
+        sequence_number = msg.get("sequence_number")
+
+        # Messages from peers that do not number them cannot be deduplicated
+        if sequence_number is None or self.received_messages.add(sender_port, sequence_number):
             
-            # Notify all peers using the provided socket
-            for peer in self.peers:
-                if peer != (self.address, self.port):
-                    try:
-                        json_notification = json.dumps(leave_notification)
-                        udp_socket.sendto(json_notification.encode('utf-8'), peer)
-                    except Exception as e:
-                        print(f"Error notifying peer {peer} of leave: {e}")
+            # Check for clock inconsistencies
+            received_clock = msg.get("message_clock")
+            if received_clock is None:
+                received_clock = msg.get("clock_delta")
+            if received_clock is not None:
+                needs_recovery = False
+                
+                # Only check clocks if we're not already recovering
+                if not self.recovery_in_progress:
+                    for port, count in received_clock.items():
+                        if port == sender_port:
+                            # Only recover if we've seen messages from this client before.
+                            # Multicast chat can be lost, so a gap in a known sender's
+                            # sequence numbers means messages went missing.
+                            multicast_gap = self.multicast_group is not None and port in self.message_clock
+                            if port in self.join_time_clock or multicast_gap:
+                                expected = self.message_clock.get(port, 0) + 1
+                                join_time_count = self.join_time_clock.get(port, 0)
+                                # Only recover if messages were lost after we joined
+                                if count > expected and count > join_time_count:
+                                    needs_recovery = True
+                        else:
+                            local_count = self.message_clock.get(port, 0)
+                            join_time_count = self.join_time_clock.get(port, 0)
+                            # Only recover if messages were lost after we joined
+                            if count > local_count and count > join_time_count:
+                                needs_recovery = True
+                    
+                    if needs_recovery:
+                        self.request_missing_messages(
+                            self.udp_socket, 
+                            sender_port, 
+                            received_clock.get(sender_port, sequence_number or 0),
+                            self.message_clock.get(sender_port, 0)
+                        )
+                
+                # Update clock if message is in sequence or from new client. While its
+                # messages are being recovered, the sender's own entry only advances as
+                # they are delivered, so nothing lost meanwhile is skipped.
+                if not needs_recovery:
+                    if sender_port in self.recovery_in_progress:
+                        received_clock = {
+                            port: count for port, count in received_clock.items() if port != sender_port
+                        }
+                    self.message_clock.update(received_clock)
+            
+            self.show_message(msg["user"], msg["body"])
+
+    def request_missing_messages(self, udp_socket, peer_port, expected_count, current_count):
+        '''
+        Request missing messages from a peer when clock inconsistency is detected.
+        '''
+        # Don't request if already in progress for this peer
+        if peer_port in self.recovery_in_progress:
+            return
+            
+        missing_count = expected_count - current_count
+        request_msg = {
+            "type": "message_request",
+            "room_id": self.room_id,
+            "requesting_port": str(self.port),
+            "count": missing_count,
+            "from_count": current_count,  # Add starting point for recovery
+            "mtu": self.recovery_mtu  # Ask for recovery_batch datagrams no larger than this
+        }
+        
+        peer_address = None
+        for peer in self.peers:
+            if str(peer[1]) == peer_port:
+                peer_address = peer
+                break
+        
+        if peer_address:
+            self.recovery_in_progress.add(peer_port)
+            json_request = json.dumps(request_msg).encode('utf-8')
+            if self.reliable_to(peer_address):
+                self.transport.send(peer_address, json_request)
+            else:
+                udp_socket.sendto(json_request, peer_address)
+
+    def send_requested_messages(self, udp_socket, requesting_port, count, from_count, mtu=None):
+        '''
+        Send requested messages from our log to the requesting peer.
+        
+        args:
+            udp_socket (socket): The UDP socket for sending messages
+            requesting_port (str): Port of the requesting peer
+            count (int): Number of messages requested
+            from_count (int): Starting message count to sync from
+            mtu (int): Largest datagram the peer accepts. Peers that send one get
+                recovery_batch datagrams; older peers get one recovery datagram per message.
+        '''
+        # Find the messages that were sent after from_count. Without a log file only the
+        # newest ones are kept, so the oldest requested ones may be gone.
+        current_count = self.message_log.last_sequence
+        first_sequence, messages_to_send = self.message_log.range(from_count + 1, current_count)
+
+        requester_address = None
+        for peer in self.peers:
+            if str(peer[1]) == requesting_port:
+                requester_address = peer
+                break
+        
+        if requester_address:
+            datagrams = []
+            if mtu:
+                datagrams = pack_batches(
+                    self.user_id, first_sequence, messages_to_send, min(mtu, self.recovery_mtu), self.room_id
+                )
+            else:
+                for idx, message in enumerate(messages_to_send):
+                    sequence_number = first_sequence + idx
+                    send_msg = {
+                        "user": self.user_id,
+                        "body": message,
+                        "message_clock": self.message_clock.copy(),
+                        "type": "recovery",
+                        "room_id": self.room_id,
+                        "message_id": f"{self.port}_{sequence_number}",
+                        "sequence_number": sequence_number
+                    }
+                    datagrams.append(
+                        ((sequence_number, sequence_number), json.dumps(send_msg).encode('utf-8'))
+                    )
+
+            state = self.room_state
+
+            def make_complete():
+                end_msg = {
+                    "type": "recovery_complete",
+                    "room_id": state.room_id,
+                    "final_clock": state.message_clock.copy(),
+                    "sender_port": str(self.port),
+                    "first_sequence": first_sequence,
+                    "last_sequence": current_count
+                }
+                return json.dumps(end_msg).encode('utf-8')
+
+            def finished():
+                if state.recovery_senders.get(requesting_port) is sender:
+                    del state.recovery_senders[requesting_port]
+
+            # A newer request from the same peer supersedes the transfer in flight
+            previous = self.recovery_senders.pop(requesting_port, None)
+            if previous:
+                previous.stop()
+
+            # Paced by the event loop; only messages the peer does not acknowledge are resent
+            sender = RecoverySender(
+                state.timers, udp_socket, requester_address, datagrams, make_complete, finished
+            )
+            self.recovery_senders[requesting_port] = sender
+            sender.start()
+
+    def handle_recovery_ack(self, msg, addr):
+        '''
+        A peer we are resending messages to reported which ones it received.
+        '''
+        sender = self.recovery_senders.get(msg["requesting_port"])
+        if sender:
+            sender.handle_ack(msg.get("received", []), msg.get("done", False))
+
+    def stop_recovery_senders(self):
+        '''
+        Abandon every outgoing recovery transfer.
+        '''
+        for sender in self.recovery_senders.values():
+            sender.stop()
+        self.recovery_senders.clear()
+
+    def handle_user_input(self, udp_socket, message):
+        '''
+        Method that handles user input, such as:
+            1. Sending a chat to all peers
+            2. Handling special user input (commands)
+            3. Exiting the chatroom if necessary
+
+        args:
+            udp_socket (socket): The UDP socket the client is listening on.
+            message (str): The line the user typed.
+        '''
+        
+        # special user command
+        if message.lower().startswith("/"):
+            if message.lower() == "/help":
+                print("\n=== Options ===\n")
+                print("/clock - shows clock of messages sent by each client")
+                print("/history - shows most recent sent messages")
+                print("/peers - shows current peers in client list")
+                print("/ping - check for inactive peers")
+                print("/stats - shows how often and how long each message type was handled")
+                print("/join <room> - joins another room without leaving this one")
+                print("/create <room> - creates another room without leaving this one")
+                print("/rooms - lists the rooms you are in")
+                print("/switch <room> - sends your messages to another room you are in")
+                print("/exit - exits the current room; returns to menu after the last one")
+                print("\n====================\n")
+
+            elif message.lower() == "/exit":
+                print("Exiting chatroom...")
+                if self.room:
+                    self.leave_room(self.room, udp_socket=udp_socket)
+                if self.rooms:
+                    print(f"{bcolors.CYAN}Now chatting in {self.room}.{bcolors.ENDC}")
+                else:
+                    self.running = False
+                    return -1
+
+            elif message.lower().startswith("/join "):
+                room = message[len("/join "):].strip()
+                asyncio.get_running_loop().create_task(self.join_another_room(room))
+
+            elif message.lower().startswith("/create "):
+                room = message[len("/create "):].strip()
+                asyncio.get_running_loop().create_task(self.join_another_room(room, create=True))
+
+            elif message.lower() == "/rooms":
+                print("\n=== Rooms ===")
+                for room, state in self.rooms.items():
+                    marker = " (current)" if state is self.foreground else ""
+                    print(f"{room}: {len(state.peers)} peers{marker}")
+                print("====================\n")
+
+            elif message.lower().startswith("/switch "):
+                room = message[len("/switch "):].strip()
+                if room in self.rooms:
+                    self.foreground = self.room_state = self.rooms[room]
+                    print(f"{bcolors.CYAN}Now chatting in {room}.{bcolors.ENDC}")
+                else:
+                    print(f"You are not in room {room}.")
+            
+            elif message.lower() == "/history":
+                print("\n=== Message History ===")
+                last = self.message_log.last_sequence
+                first, messages = self.message_log.range(last - 19, last)
+                for idx, msg in enumerate(messages, first):
+                    print(f"{idx}. {msg}")
+                print("====================\n")
+
+            elif message.lower() == "/clock":
+                print("\n=== Message Clock ===")
+                for port, count in self.message_clock.items():
+                    print(f"Client {port}: {count} messages")
+                print("====================\n")
+
+            elif message.lower() == "/peers":
+                print("\n=== Peers ===")
+                for peer in self.peers:
+                    print(f"{peer}")
+                print("====================\n")
+
+            elif message.lower() == "/ping":
+                self.ping_peers(udp_socket)
+
+            elif message.lower() == "/stats":
+                print("\n=== Message Handling ===")
+                for message_type, (count, total, longest) in sorted(self.dispatcher.stats().items()):
+                    print(f"{message_type}: {count} handled, {total / count * 1000:.3f} ms avg, {longest * 1000:.3f} ms max")
+                print("====================\n")
+
+        
+        self.print_prompt()
+
+        # Only add non-command messages to the log and update clock
+        if not message.startswith("/"):
+            self.send_chat(udp_socket, message)
+
+
+    async def join_another_room(self, room, create=False):
+        '''
+        Join a room during a chat session, over the session's socket, and make it the
+        current room. Rooms already joined stay open, and keep chatting while the server
+        answers.
+
+        args:
+            room (str): The room to join.
+            create (bool): Create the room rather than join an existing one.
+        '''
+        if room in self.rooms:
+            print(f"You are already in room {room}.")
+            return
+        if create:
+            print(f"Attempting to create room {room}...")
+        if not await self.join(room, create) or room not in self.rooms:
+            return
+        state = self.rooms[room]
+        print(f"{bcolors.GREEN}{bcolors.BOLD}Chatroom {room} opened!{bcolors.ENDC}")
+        print(f"{bcolors.CYAN}{len(state.peers)} peers are here now.{bcolors.ENDC}")
+
+    def send_chat(self, udp_socket, message):
+        '''
+        Log a chat message, advance our own clock and send the message to every peer.
+        Returns the message's sequence number.
+
+        Over the reliable transport each peer gets only the clock entries that changed
+        since the last message sent to it, with a full snapshot on its first message and
+        every clock_snapshot_interval messages after that. Without the transport, where
+        messages can be lost, every message carries the full clock.
+
+        args:
+            udp_socket (socket): The UDP socket the client is listening on.
+            message (str): The message body.
+        '''
+        sequence_number = self.message_log.append(message)
+        self.message_clock[str(self.port)] = sequence_number
+        targets = self.peers
+        if self.dissemination == "gossip":
+            self.send_gossip(message, sequence_number)
+            # Peers that cannot take part in gossip still need their own copy
+            targets = [peer for peer in self.peers if not self.supports(peer, "gossip")]
+        elif self.multicast_group and self.send_multicast(udp_socket, message, sequence_number):
+            # Only peers not known to be on the group still need their own copy
+            targets = [peer for peer in self.peers if tuple(peer) not in self.multicast_peers]
+        sent_clock = dict(self.message_clock)
+
+        # Peers that were sent the same clock last time get the same delta, so group them
+        # and encode each group's message once
+        groups = {}
+        for peer in targets:
+            if peer == (self.address, self.port):
+                continue
+            peer = tuple(peer)
+            baseline = self.clock_baselines.get(peer)
+            if not self.reliable_to(peer) or baseline is None or baseline[1] >= self.clock_snapshot_interval:
+                baseline = None
+                key = None
+            else:
+                key = (id(baseline[0]), baseline[1])
+            groups.setdefault(key, (baseline, []))[1].append(peer)
+
+        for baseline, peers in groups.values():
+            send_msg = {
+                "user": self.user_id,
+                "body": message,
+                "type": "chat",
+                "room_id": self.room_id,
+                "message_id": f"{self.port}_{sequence_number}",
+                "sequence_number": sequence_number
+            }
+            if baseline is None:
+                send_msg["message_clock"] = sent_clock
+            else:
+                send_msg["clock_delta"] = {
+                    port: count for port, count in sent_clock.items() if baseline[0].get(port) != count
+                }
+
+            # Encode each format at most once, and only if some peer needs it
+            json_send_msg = None
+            binary_send_msg = None
+            if self.binary_peers:
+                binary_send_msg = wire.encode_chat(send_msg, self.port)
+
+            for peer in peers:
+                self.clock_baselines[peer] = (sent_clock, 0 if baseline is None else baseline[1] + 1)
+                if binary_send_msg and peer in self.binary_peers:
+                    data = binary_send_msg
+                else:
+                    if json_send_msg is None:
+                        json_send_msg = json.dumps(send_msg).encode('utf-8')
+                    data = json_send_msg
+                if self.reliable_to(peer):
+                    self.transport.send(peer, data)
+                    continue
+                try:
+                    udp_socket.sendto(data, peer)
+                except Exception as e:
+                    print(f"Error sending message to {peer}: {e}")
+        return sequence_number
+
+
+    def send_multicast(self, udp_socket, message, sequence_number):
+        '''
+        Send a chat message once to the room's multicast group. Multicast is unreliable,
+        so receivers that notice a gap in our sequence numbers recover the missing
+        messages from us over unicast. A gap at the end of a burst has no later message
+        to reveal it, so once we have been quiet for multicast_tail_delay the last
+        sequence number is announced reliably. Returns False, after falling back to
+        unicast for the rest of the session, if the send fails.
+
+        args:
+            udp_socket (socket): The UDP socket the client is listening on.
+            message (str): The message body.
+            sequence_number (int): The message's sequence number.
+        '''
+        send_msg = {
+            "user": self.user_id,
+            "body": message,
+            "type": "chat",
+            "room_id": self.room_id,
+            "message_id": f"{self.port}_{sequence_number}",
+            "sequence_number": sequence_number,
+            "clock_delta": {str(self.port): sequence_number}
+        }
+        data = self.binary_wire and wire.encode_chat(send_msg, self.port)
+        if not data:
+            data = json.dumps(send_msg).encode('utf-8')
+        try:
+            udp_socket.sendto(data, self.multicast_group)
+        except OSError as e:
+            print(f"Multicast send failed, using unicast: {e}")
+            self.close_multicast()
+            return False
+        if self.multicast_tail_timer is not None:
+            self.timers.cancel(self.multicast_tail_timer)
+        self.multicast_tail_timer = self.room_state.timers.call_later(
+            self.multicast_tail_delay, self.send_multicast_tail, sequence_number
+        )
+        return True
+
+    def send_multicast_tail(self, sequence_number):
+        '''
+        Tell the peers on the multicast group the sequence number of our last message.
+        '''
+        self.multicast_tail_timer = None
+        tail_msg = {"type": "multicast_tail", "room_id": self.room_id, "sequence_number": sequence_number}
+        data = json.dumps(tail_msg).encode('utf-8')
+        for peer in self.multicast_peers:
+            self.send_to_peer(peer, data)
+
+    def handle_multicast_tail(self, msg, addr):
+        '''
+        A peer's multicast burst ended. Recover anything from it that never arrived.
+        '''
+        sender_port = str(addr[1])
+        current = self.message_clock.get(sender_port)
+        if current is not None and msg.get("sequence_number", 0) > current:
+            self.request_missing_messages(self.udp_socket, sender_port, msg["sequence_number"], current)
+
+    def send_gossip(self, message, sequence_number):
+        '''
+        Start spreading a chat message epidemically: it goes to a few random peers, and
+        every peer that receives it for the first time passes it on to a few more. The
+        message only carries our own clock entry, since it reaches most peers indirectly.
+
+        args:
+            message (str): The message body.
+            sequence_number (int): The message's sequence number.
+        '''
+        gossip_msg = {
+            "type": "gossip",
+            "room_id": self.room_id,
+            "origin": [self.address, self.port],
+            "payload": {
+                "user": self.user_id,
+                "body": message,
+                "type": "chat",
+                "message_id": f"{self.port}_{sequence_number}",
+                "sequence_number": sequence_number,
+                "clock_delta": {str(self.port): sequence_number}
+            }
+        }
+        self.relay_gossip(gossip_msg, {(self.address, self.port)})
+
+    def relay_gossip(self, gossip_msg, exclude):
+        '''
+        Send a gossip message to gossip_fanout random peers.
+
+        args:
+            gossip_msg (dict): The gossip message.
+            exclude (set): Peers that already have the message.
+        '''
+        candidates = [
+            tuple(peer) for peer in self.peers
+            if tuple(peer) not in exclude and self.supports(peer, "gossip")
+        ]
+        fanout = self.gossip_fanout or math.ceil(math.log(max(len(self.peers), 1))) + 3
+        data = json.dumps(gossip_msg).encode('utf-8')
+        for peer in random.sample(candidates, min(fanout, len(candidates))):
+            self.send_to_peer(peer, data)
+
+    def handle_gossip(self, msg, addr):
+        '''
+        A peer passed on a chat message. The first copy is relayed and shown; later
+        copies are dropped.
+        '''
+        origin = tuple(msg["origin"])
+        payload = msg["payload"]
+        if origin == (self.address, self.port):
+            return
+        if (str(origin[1]), payload["sequence_number"]) in self.received_messages:
+            return
+        self.relay_gossip(msg, {origin, tuple(addr), (self.address, self.port)})
+        self.dispatcher.dispatch(payload, origin)
+
+    def display_menu(self):
+        '''
+        Displays the initial menu and returns the user's response.
+        '''
+        while True:
+            print("\tA. List public rooms")
+            print("\tB. Join a room")
+            print("\tC. Create a room")
+            print("\tQ. Quit this application\nInput: ", end="")
+
+            option = sys.stdin.readline().strip().upper()
+            if option in {"A", "B", "C", "Q"}:
+                return option
+            else:
+                print(f"'{option}' is not a valid option. Please try again.")
+
+
+    def connect_to_central_server(self, server_hostname=None, server_port=None):
+        '''
+        Connects the P2PClient object to the central server. The local end of the first
+        connection also becomes this client's peer address for the rest of its life.
+
+        args:
+            hostname (str): IP address of the central server.
+            port (int): Port of the central server.
+        '''
+        if not server_hostname:
+            server_hostname = self.server_hostname
+        if not server_port:
+            server_port = self.server_port
+        
+        try:
+            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client_socket.settimeout(5) 
+            client_socket.connect((server_hostname, server_port))
+            if self.port is None:
+                self.address, self.port = client_socket.getsockname()
+            return client_socket
+        except(socket.timeout, socket.error) as e:
+            print(f"Connection failed: {e}")
+            return None
+
+
+    def default_node(self):
+        '''
+        Returns the "host:port" name of the central server requests go to by default: the
+        server this client was started with, or the current primary among its endpoints.
+        '''
+        if self.endpoints:
+            return self.endpoints[self.endpoint_index]
+        return f"{self.server_hostname}:{self.server_port}"
+
+
+    def node_for(self, request):
+        '''
+        Returns the server node a request should be sent to. In a sharded cluster, requests
+        about a room go to the node that owns it; everything else goes to the default node.
+
+        args:
+            request (dict): The request to route.
+        '''
+        if self.ring and isinstance(request.get("room"), str):
+            return self.ring.node_for(request["room"])
+        return self.default_node()
+
+
+    def discover_cluster(self):
+        '''
+        Asks the central server whether it is one shard of a cluster and, if so, routes
+        later requests straight to the shard that owns each room.
+        '''
+        self.cluster_discovered = True
+        response = self.send_request({"action": "cluster"})
+        if response and response["status"] == "success" and len(response.get("nodes", [])) > 1:
+            self.ring = HashRing(response["nodes"])
+
+
+    def fail_over(self, primary=None):
+        '''
+        Point the client at another replicated central server: the named primary if one
+        is known, otherwise the next endpoint in the list.
+
+        args:
+            primary (str): The "host:port" of the primary a replica reported, if any.
+        '''
+        if primary:
+            if primary not in self.endpoints:
+                self.endpoints.append(primary)
+            self.endpoint_index = self.endpoints.index(primary)
+        else:
+            self.endpoint_index = (self.endpoint_index + 1) % len(self.endpoints)
+
+
+    def get_server_connection(self, node=None):
+        '''
+        Returns the long-lived, framed connection to a server node, opening it if needed.
+        With replicated endpoints and no node given, each endpoint is tried in turn and the
+        first that accepts becomes the default, so a client whose first endpoint is down
+        can still reach a standby. Returns None if no server could be reached.
+
+        args:
+            node (str): The "host:port" node to connect to, or None for the default node.
+        '''
+        with self.server_lock:
+            if node is None and self.endpoints:
+                for attempt in range(len(self.endpoints)):
+                    server_socket = self.get_server_connection(self.default_node())
+                    if server_socket:
+                        return server_socket
+                    self.fail_over()
+                return None
+            node = node or self.default_node()
+            if node in self.server_sockets and self.connection_closed(self.server_sockets[node]):
+                self.close_server_connection(node)
+            if node not in self.server_sockets:
+                server_socket = self.connect_to_central_server(*parse_node(node))
+                if not server_socket:
+                    return None
+                self.server_sockets[node] = server_socket
+            return self.server_sockets[node]
+
+
+    def connection_closed(self, server_socket):
+        '''
+        Returns True if the server has already closed a cached connection, for example
+        after it sat idle, so that requests are not written to a dead connection.
+
+        args:
+            server_socket (socket): The cached connection to check.
+        '''
+        try:
+            readable, _, _ = select.select([server_socket], [], [], 0)
+            return bool(readable) and server_socket.recv(1, socket.MSG_PEEK) == b""
+        except (OSError, ValueError):
+            return True
+
+
+    def close_server_connection(self, node=None):
+        '''
+        Closes the long-lived connection to a server node, or to every node if none is given.
 
-            # Then notify server with original connection details
-            client_socket = self.connect_to_central_server()
-            if client_socket:
+        args:
+            node (str): The "host:port" node whose connection to close.
+        '''
+        nodes = [node] if node else list(self.server_sockets)
+        for name in nodes:
+            server_socket = self.server_sockets.pop(name, None)
+            if server_socket:
                 try:
-                    leave_request = {
-                        "action": "leave",
-                        "room": room,
-                        "original_address": self.tcp_address,
-                        "original_port": self.tcp_port
-                    }
-                    client_socket.sendall(json.dumps(leave_request).encode("utf-8"))
-                    # Wait for server response
-                    response = json.loads(client_socket.recv(1024).decode("utf-8"))
-                    if response["status"] != "success":
-                        print(f"Server failed to process leave request: {response.get('message', 'Unknown error')}")
-                finally:
-                    client_socket.close()
-
-            # Clear local state
-            print(f"Left room {room}")
-            self.room = None
-            self.peers = []
-            self.message_log.clear()
-            self.message_clock.clear()
-            self.join_time_clock.clear()
-            self.recovery_in_progress.clear()
-            self.received_messages.clear()
+                    server_socket.close()
+                except OSError:
+                    pass
+
+
+    def send_requests(self, requests, node=None):
+        '''
+        Pipelines several requests over the long-lived connection to one server node and
+        returns their responses in order. If the server drops the connection, the
+        unanswered requests are resent on a new one, as long as all of them are safe to
+        repeat; otherwise the server may already have applied them, so None is returned
+        rather than applying them twice. Returns None if the server could not be reached.
+
+        args:
+            requests (list): The request dicts to send.
+            node (str): The "host:port" node to send them to, or None for the default node.
+        '''
+        with self.server_lock:
+            node = node or self.default_node()
+            tagged = []
+            for request in requests:
+                self.next_request_id += 1
+                tagged.append(dict(request, request_id=self.next_request_id))
+
+            responses = []
+            failures = 0
+            while len(responses) < len(tagged):
+                server_socket = self.get_server_connection(node)
+                if not server_socket:
+                    return None
+
+                pending = tagged[len(responses):]
+                answered = len(responses)
+                try:
+                    server_socket.sendall(b"".join(framing.encode_frame(request) for request in pending))
+                    for request in pending:
+                        response = framing.recv_frame(server_socket)
+                        if response is None:
+                            raise ConnectionError("Server closed the connection")
+                        if response.get("request_id") != request["request_id"]:
+                            raise framing.FrameError("Response does not match the request it answers")
+                        responses.append(response)
+                except (socket.timeout, OSError, framing.FrameError) as e:
+                    self.close_server_connection(node)
+                    unanswered = [request["action"] for request in tagged[len(responses):]]
+                    if not REPLAYABLE_ACTIONS.issuperset(unanswered):
+                        print(f"Connection failed: {e}")
+                        return None
+                    failures = 0 if len(responses) > answered else failures + 1
+                    if failures > 1:
+                        print(f"Connection failed: {e}")
+                        return None
+            return responses
+
+
+    def send_request(self, request, node=None):
+        '''
+        Sends one request to the server node responsible for it and returns the response,
+        or None if the server could not be reached. With replicated endpoints, requests
+        that fail or reach a replica that is not the primary are retried on the primary.
+
+        args:
+            request (dict): The request to send.
+            node (str): The "host:port" node to send it to, or None to route it automatically.
+        '''
+        with self.server_lock:
+            if not self.cluster_discovered:
+                self.discover_cluster()
+            node = node or self.node_for(request)
+
+            for attempt in range(2 * len(self.endpoints) + 1):
+                responses = self.send_requests([request], node)
+                if not self.endpoints or node != self.default_node():
+                    break
+                if responses is None:
+                    self.fail_over()
+                elif responses[0]["status"] == "error" and "primary" in responses[0]:
+                    if not responses[0]["primary"]:
+                        time.sleep(0.05)  # The replicas are still electing a primary
+                    self.fail_over(responses[0]["primary"])
+                else:
+                    break
+                node = self.default_node()
+
+            return responses[0] if responses else None
+
+
+    async def call_server(self, function, *args):
+        '''
+        Runs a blocking name server call, such as send_request, on a worker thread and
+        returns its result, so the event loop keeps running the session while the server
+        answers. Calls run one at a time, in the order they were made.
+
+        args:
+            function (callable): The blocking call.
+            args: Its arguments.
+        '''
+        if self.server_executor is None:
+            self.server_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="nameserver"
+            )
+        return await asyncio.get_running_loop().run_in_executor(self.server_executor, function, *args)
+
+
+    async def update_server(self, request, failure):
+        '''
+        Sends a request that changes the server's state and reports a rejection back on the
+        event loop. Returns the response, or None if the server could not be reached.
+
+        args:
+            request (dict): The request to send.
+            failure (str): What to tell the user if the server rejects it.
+        '''
+        response = await self.call_server(self.send_request, request)
+        if response and response["status"] != "success":
+            print(f"{failure}: {response.get('message', 'Unknown error')}")
+        return response
+
+
+    def schedule_update(self, request, failure):
+        '''
+        Sends a request that changes the server's state in the background, from the event
+        loop. Returns the task sending it; the session waits for it before it closes.
+
+        args:
+            request (dict): The request to send.
+            failure (str): What to tell the user if the server rejects it.
+        '''
+        update = asyncio.get_running_loop().create_task(self.update_server(request, failure))
+        self.server_updates.add(update)
+        update.add_done_callback(self.server_updates.discard)
+        return update
+
+
+    def iter_rooms(self, page_size=50, prefix=None, contains=None, sort="name"):
+        '''
+        Lazily yields (room_name, info) pairs from the central server, fetching one page
+        at a time. In a sharded cluster every shard is paged through and the results are
+        merged in the requested order. Raises ConnectionError if a server cannot be
+        reached, and ValueError if it rejects the request.
+
+        args:
+            page_size (int): Number of rooms to request per page.
+            prefix (str): Only list rooms whose name starts with this.
+            contains (str): Only list rooms whose name contains this.
+            sort (str): "name" for alphabetical order, or "members" for largest rooms first.
+        '''
+        list_request = {
+            "action": "list",
+            "limit": page_size,
+            "sort": sort
+        }
+        if prefix:
+            list_request["prefix"] = prefix
+        if contains:
+            list_request["contains"] = contains
+
+        if not self.cluster_discovered:
+            self.discover_cluster()
+        if not self.ring:
+            yield from self.iter_node_rooms(None, list_request)
+            return
+
+        if sort == "members":
+            key = lambda item: (-item[1].get("member_count", 0), item[0])
+        else:
+            key = lambda item: item[0]
+        yield from heapq.merge(*(self.iter_node_rooms(node, dict(list_request)) for node in self.ring.nodes), key=key)
+
+    def iter_node_rooms(self, node, list_request):
+        '''
+        Lazily yields (room_name, info) pairs from a single server node, one page at a time.
+
+        args:
+            node (str): The "host:port" node to list, or None for the default node.
+            list_request (dict): The first page's list request; its cursor is advanced in place.
+        '''
+        while True:
+            response = self.send_request(list_request, node)
+            if response is None:
+                raise ConnectionError(f"Could not reach {node or self.default_node()}")
+            if response["status"] != "success":
+                raise ValueError(response.get("message", "Unknown error"))
+
+            for room_name, info in response.get("rooms", {}).items():
+                yield room_name, info
+
+            if not response.get("next_cursor"):
+                return
+            list_request["cursor"] = response["next_cursor"]
+
+    def list_rooms(self, prefix=None, contains=None, sort="name"):
+        '''
+        Lists all available rooms from the central server, one page at a time.
+
+        args:
+            prefix (str): Only list rooms whose name starts with this.
+            contains (str): Only list rooms whose name contains this.
+            sort (str): "name" for alphabetical order, or "members" for largest rooms first.
+        
+        Returns:
+            bool: True if rooms were successfully listed, False otherwise
+        '''
+        try:
+            listed = 0
+            for room_name, info in self.iter_rooms(prefix=prefix, contains=contains, sort=sort):
+                if not listed:
+                    print(f"\n{bcolors.GREEN}Available rooms:{bcolors.ENDC}")
+                listed += 1
+                member_count = info.get("member_count", 0)
+                status = "" if info.get("verified", True) else " (unverified)"
+                print(f"{bcolors.CYAN}• {room_name}: {member_count} member(s){status}{bcolors.ENDC}")
+
+            if not listed:
+                print(f"\n{bcolors.YELLOW}No active rooms available.{bcolors.ENDC}")
             return True
-                
-        except Exception as e:
-            print(f"Error during room exit: {e}")
+
+        except ConnectionError as e:
+            print(f"{bcolors.RED}Error creating socket connection: {e}{bcolors.ENDC}")
+            return False
+        except ValueError as e:
+            print(f"{bcolors.RED}Failed to retrieve room list: {e}{bcolors.ENDC}")
+            return False
+
+    def join_room(self, room):
+        '''
+        Joins a specified room by getting initial peer list from server then broadcasting presence.
+        
+        args:
+            room (str): Identifier of the room the client wishes to join.
+        '''
+        # Check before the server records us in a room we could not enter
+        if self.room_id_clashes(room):
+            return False
+        return self.room_joined(room, self.request_room("join", room))
+
+    def request_room(self, action, room):
+        '''
+        Asks the server to let us join or create a room. Returns its response, or None if
+        it could not be reached. This blocks, so the event loop runs it through call_server.
+
+        args:
+            action (str): "join" or "create".
+            room (str): Identifier of the room.
+        '''
+        if not self.get_server_connection():
+            print(f"Error creating socket connection to {self.default_node()}")
+            return None
+
+        # Store the address the server records us under
+        self.tcp_address, self.tcp_port = self.address, self.port
+
+        room_request = {
+            "action": action,
+            "room": room,
+            "address": self.address,
+            "port": self.port
+        }
+        return self.send_request(room_request)
+
+    def room_joined(self, room, response):
+        '''
+        Enter a room with the peer list the server answered a join with. Returns True on
+        success.
+
+        args:
+            room (str): Identifier of the room.
+            response (dict): The server's response, or None if it could not be reached.
+        '''
+        if response is None:
+            return False
+
+        if response["status"] == "success":
+            print(f"Got initial room info for {room}")
+            if not self.enter_room(room, [tuple(peer) for peer in response["ips"]]):
+                return False
+
+            # Initialize message tracking, continuing our numbering from any saved history
+            if str(self.port) not in self.message_clock:
+                self.message_clock[str(self.port)] = self.message_log.last_sequence
+                self.join_time_clock[str(self.port)] = self.message_log.last_sequence
+
+            return True
+        else:
+            print(f"Server failed to provide room info for {room}")
+            return False
+        
+
+    def create_room(self, room):
+        '''
+        Create a room for client-to-client interaction.
+
+        args:
+            room (str): Identifier of the room the client wishes to create.
+        '''
+        print(f"Attempting to create room {room}...")
+        # Check before the server records us in a room we could not enter
+        if self.room_id_clashes(room):
+            return False
+        return self.room_created(room, self.request_room("create", room))
+
+    def room_created(self, room, response):
+        '''
+        Enter a room the server answered a create for. Returns True on success.
+
+        args:
+            room (str): Identifier of the room.
+            response (dict): The server's response, or None if it could not be reached.
+        '''
+        if response is None:
             return False
+
+        if response["status"] == "success":
+            print(f"Server successfully created room {room}")
+            if not self.enter_room(room, [(self.address, self.port)]):
+                return False
+            self.message_clock[str(self.port)] = self.message_log.last_sequence
+            return True
+
+        else:
+            print(f"Server failed to create room {room}")
+            return False
+
+
+    def room_id_clashes(self, room):
+        '''
+        Returns True, after telling the user, if a room's id is already taken by another
+        room we are in. Datagrams could not be routed to both, so the room cannot be joined.
+
+        args:
+            room (str): The room's name.
+        '''
+        clash = self.room_ids.get(wire.room_id(room))
+        if clash and clash.room != room:
+            print(f"{bcolors.RED}Rooms {clash.room} and {room} share a room id; leave {clash.room} first.{bcolors.ENDC}")
+            return True
+        return False
+
+    def enter_room(self, room, peers):
+        '''
+        Start tracking a room we joined and bring it to the foreground. Returns its
+        RoomState, or None if its room id clashes with another room we are in.
+
+        args:
+            room (str): The room's name.
+            peers (list): The (address, port) of every member, including us.
+        '''
+        if self.room_id_clashes(room):
+            return None
+        previous = self.rooms.get(room)
+        if previous:
+            self.drop_room(previous)
+        state = RoomState(room, self.message_log_size)
+        state.peers = list(peers)
+        state.timers = ScopedTimers(lambda: self.timers, lambda: self.in_room(state))
+        self.rooms[room] = state
+        self.room_ids[state.room_id] = state
+        self.foreground = self.room_state = state
+        self.open_message_log(room)
+        return state
+
+    def drop_room(self, state):
+        '''
+        Stop tracking a room: abandon its recovery transfers, leave its multicast group and
+        close its message log. If it was in the foreground, another room we are in takes
+        its place.
+
+        args:
+            state (RoomState): The room.
+        '''
+        with self.in_room(state):
+            self.stop_recovery_senders()
+            self.close_multicast()
+            self.ping_responses = None
+        state.message_log.close()
+        if self.rooms.get(state.room) is state:
+            del self.rooms[state.room]
+            del self.room_ids[state.room_id]
+        for peer in state.peers:
+            self.forget_connection(peer)
+        if self.foreground is state:
+            self.foreground = next(iter(self.rooms.values()), self.lobby)
+        if self.room_state is state:
+            self.room_state = self.foreground
+
+    def open_message_log(self, room):
+        '''
+        Switch to the message log for a room. If message_log_dir is set the log is kept in
+        a file there, so a later session in the same room continues where this one stopped.
+
+        args:
+            room (str): The room being entered.
+        '''
+        self.message_log.close()
+        path = None
+        if self.message_log_dir:
+            name = "".join(c if c.isalnum() or c in "-_" else "_" for c in f"{self.user_id}_{room}")
+            path = os.path.join(self.message_log_dir, f"{name}.log")
+        try:
+            self.message_log = MessageStore(self.message_log_size, path)
+        except OSError as e:
+            print(f"Could not open message log {path}, keeping messages in memory only: {e}")
+            self.message_log = MessageStore(self.message_log_size)
+
+    def leave_room(self, room, udp_socket):
+        '''
+        Leave a room and notify peers directly. The server is told from a worker thread, so
+        this must be called on the session's event loop. Returns the task that finishes
+        once the server answered, or None if the room could not be left.
         
+        args:
+            room (str): Identifier of the room to leave
+            udp_socket (socket): The UDP socket for sending the leave notification
+        '''
+        state = self.rooms.get(room)
+        if state is None:
+            print(f"Not in room {room}")
+            return None
+
+        with self.in_room(state):
+            try:
+                # Prepare leave notification
+                leave_notification = {
+                    "status": "update",
+                    "type": "leave",
+                    "room": room,
+                    "member": self.user_id,
+                    "address": self.address,
+                    "port": self.port
+                }
+            
+                # Notify all peers using the provided socket
+                for peer in self.peers:
+                    if peer != (self.address, self.port):
+                        try:
+                            json_notification = json.dumps(leave_notification)
+                            udp_socket.sendto(json_notification.encode('utf-8'), peer)
+                        except Exception as e:
+                            print(f"Error notifying peer {peer} of leave: {e}")
+
+                # Then notify server with original connection details
+                leave_request = {
+                    "action": "leave",
+                    "room": room,
+                    "original_address": self.tcp_address,
+                    "original_port": self.tcp_port
+                }
+                update = self.schedule_update(leave_request, "Server failed to process leave request")
+
+                # Clear local state
+                print(f"Left room {room}")
+                self.drop_room(self.room_state)
+                return update
+                
+            except Exception as e:
+                print(f"Error during room exit: {e}")
+                return None
+
     def ping_peers(self, udp_socket):
         '''
-        Ping all peers to check for inactive clients while still receiving messages.
-        Sends 3 pings and waits for responses.
+        Ping all peers to check for inactive clients. The three ping rounds and the
+        response deadline are scheduled on the event loop's timers, so messages keep
+        being received and sent while the ping is outstanding.
         '''
+        if self.ping_responses is not None:
+            print("A ping is already in progress.")
+            return
+
         if not self.peers:
             print("No peers to ping.")
             return
@@ -690,210 +2207,103 @@ class P2PClient(object):
 
         ping_msg = {
             "type": "ping",
+            "room_id": self.room_id,
             "sender_id": self.user_id,
             "address": self.address,
             "port": self.port,
             "timestamp": time.time()
         }
+        ping_data = json.dumps(ping_msg).encode('utf-8')
+
+        # Track the probe, then send 3 ping rounds 0.5s apart and give peers 5s more to answer
+        self.ping_responses = responses
+        for ping_round in range(3):
+            self.room_state.timers.call_later(ping_round * 0.5, self.send_ping_round, udp_socket, ping_data)
+        self.room_state.timers.call_later(1.0 + self.ping_timeout, self.finish_ping, udp_socket)
+
+    def evict_peers(self, udp_socket, inactive_peers, reason):
+        '''
+        Remove unresponsive peers locally, announce their departure to the remaining
+        peers and push the new member list to the server. Must be called on the session's
+        event loop; the server is updated from a worker thread.
 
-        # Send 3 pings (excluding self)
-        for _ in range(3):
+        args:
+            udp_socket (socket): The UDP socket the client is listening on.
+            inactive_peers (list): The (address, port) tuples of the peers to remove.
+            reason (str): Why the peers are being removed.
+        '''
+        for inactive_peer in inactive_peers:
+            remove_msg = {
+                "status": "update",
+                "type": "leave",
+                "room": self.room,
+                "member": "Unknown (timeout)",
+                "address": inactive_peer[0],
+                "port": inactive_peer[1],
+                "reason": reason
+            }
+            
+            # Remove locally
+            self.remove_peer(inactive_peer)
+            
+            # Broadcast to remaining peers
             for peer in self.peers:
-                if peer != own_address:  # Don't ping self
+                if peer != (self.address, self.port):
                     try:
-                        udp_socket.sendto(json.dumps(ping_msg).encode('utf-8'), peer)
+                        udp_socket.sendto(json.dumps(remove_msg).encode('utf-8'), peer)
                     except Exception as e:
-                        print(f"Error sending ping to {peer}: {e}")
-            time.sleep(0.5)  # Small delay between ping
+                        print(f"Error notifying peer {peer} of removal: {e}")
 
-        # Wait for responses while still handling other messages
-        timeout = time.time() + 5  # 5 second timeout
-        
-        while time.time() < timeout:
+        # Update server in the background, so the session keeps running while it answers
+        update_request = {
+            "action": "update_room",
+            "room": self.room,
+            "active_clients": list(self.peers)
+        }
+        self.schedule_update(update_request, "Server failed to update room list")
+
+    def send_ping_round(self, udp_socket, ping_data):
+        '''
+        Send one ping to every peer still being probed.
+
+        args:
+            udp_socket (socket): The UDP socket the client is listening on.
+            ping_data (bytes): The encoded ping message.
+        '''
+        if self.ping_responses is None:
+            return
+        for peer in self.ping_responses:
             try:
-                # Use select with a short timeout to check for messages
-                readable, _, _ = select.select([udp_socket, sys.stdin], [], [], 0.5)
-                
-                for source in readable:
-                    if source == udp_socket:
-                        data, addr = udp_socket.recvfrom(1024)
-                        msg = json.loads(data.decode('utf-8'))
-                        
-                        if msg.get("type") == "ping_response":
-                            # Handle ping response
-                            responses[(addr[0], addr[1])] += 1
-                        
-                        elif "status" in msg and msg["status"] == "update":
-                            # Handle join/leave updates
-                            if msg["type"] == "join":
-                                new_peer = (msg["address"], msg["port"])
-                                if new_peer not in self.peers:
-                                    self.peers.append(new_peer)
-                                print(f"\n{bcolors.WARNING}{msg['member']} has joined the room{bcolors.ENDC}")
-                            
-                            elif msg["type"] == "leave":
-                                leaving_peer = (msg["address"], msg["port"])
-                                if leaving_peer in self.peers:
-                                    self.peers.remove(leaving_peer)
-                                leaving_port = str(msg["port"])
-                                if leaving_port in self.message_clock:
-                                    del self.message_clock[leaving_port]
-                                if leaving_port in self.join_time_clock:
-                                    del self.join_time_clock[leaving_port]
-                                if leaving_port in self.recovery_in_progress:
-                                    self.recovery_in_progress.remove(leaving_port)
-                                print(f"\n{bcolors.WARNING}{msg['member']} has left the room{bcolors.ENDC}")
-                        
-                        elif msg.get("type") == "message_request":
-                            # Handle recovery requests
-                            self.send_requested_messages(
-                                udp_socket, 
-                                msg["requesting_port"], 
-                                msg["count"],
-                                msg.get("from_count", 0)
-                            )
-                        
-                        elif msg.get("type") == "recovery":
-                            # Handle recovery messages
-                            sender_port = str(addr[1])
-                            msg_id = msg["message_id"]
-                            
-                            if msg_id not in self.received_messages:
-                                self.received_messages.add(msg_id)
-                                sequence_number = msg["sequence_number"]
-                                
-                                if sequence_number == self.message_clock.get(sender_port, 0) + 1:
-                                    self.message_clock[sender_port] = sequence_number
-                                    print(f'\n{bcolors.YELLOW}[RECOVERY] {msg["user"]}: {msg["body"]}{bcolors.ENDC}')
-                        
-                        elif msg.get("type") == "recovery_complete":
-                            # Handle recovery completion
-                            sender_port = msg["sender_port"]
-                            if sender_port in self.recovery_in_progress:
-                                self.recovery_in_progress.remove(sender_port)
-                                self.message_clock.update(msg["final_clock"])
-                                print(f"\n{bcolors.YELLOW}[RECOVERY] Completed recovery from client {sender_port}{bcolors.ENDC}")
-                        
-                        else:  # Regular chat message
-                            sender_port = str(addr[1])
-                            msg_id = msg.get("message_id", f"{sender_port}_{time.time()}")
-                            
-                            if msg_id not in self.received_messages:
-                                self.received_messages.add(msg_id)
-                                
-                                if "message_clock" in msg:
-                                    received_clock = msg["message_clock"]
-                                    needs_recovery = False
-                                    
-                                    if not self.recovery_in_progress:
-                                        for port, count in received_clock.items():
-                                            if port == sender_port:
-                                                if port in self.join_time_clock:
-                                                    expected = self.message_clock.get(port, 0) + 1
-                                                    join_time_count = self.join_time_clock.get(port, 0)
-                                                    if count > expected and count > join_time_count:
-                                                        needs_recovery = True
-                                            else:
-                                                local_count = self.message_clock.get(port, 0)
-                                                join_time_count = self.join_time_clock.get(port, 0)
-                                                if count > local_count and count > join_time_count:
-                                                    needs_recovery = True
-                                        
-                                        if needs_recovery:
-                                            self.request_missing_messages(
-                                                udp_socket, 
-                                                sender_port, 
-                                                received_clock[sender_port],
-                                                self.message_clock.get(sender_port, 0)
-                                            )
-                                    
-                                    if not needs_recovery:
-                                        self.message_clock.update(received_clock)
-                                
-                                if msg.get("type") != "recovery":
-                                    print(f'\n{msg["user"]}: {msg["body"]}')
-                        
-                        print(bcolors.CYAN + bcolors.BOLD + "> " + bcolors.ENDC, end="", flush=True)
-                    
-                    elif source == sys.stdin:
-                        # Handle user input during ping
-                        user_input = sys.stdin.readline().strip()
-                        if user_input and not user_input.startswith('/'):
-                            self.message_log.append(user_input)
-                            self.message_clock[str(self.port)] = self.message_clock.get(str(self.port), 0) + 1
-                            
-                            for peer in self.peers:
-                                try:
-                                    send_msg = {
-                                        "user": self.user_id,
-                                        "body": user_input,
-                                        "message_clock": self.message_clock,
-                                        "type": "chat"
-                                    }
-                                    udp_socket.sendto(json.dumps(send_msg).encode('utf-8'), peer)
-                                except Exception as e:
-                                    print(f"Error sending message to {peer}: {e}")
-                            
-                            print(bcolors.CYAN + bcolors.BOLD + "> " + bcolors.ENDC, end="", flush=True)
-                            
+                udp_socket.sendto(ping_data, peer)
             except Exception as e:
-                print(f"Error during ping: {e}")
+                print(f"Error sending ping to {peer}: {e}")
+
+    def finish_ping(self, udp_socket):
+        '''
+        Called once the ping deadline passes. Peers that never answered are removed
+        locally, announced as gone to the other peers and dropped on the server.
+
+        args:
+            udp_socket (socket): The UDP socket the client is listening on.
+        '''
+        responses = self.ping_responses
+        self.ping_responses = None
+        if responses is None:
+            return
 
         # Process results
         inactive_peers = []
         for peer, response_count in responses.items():
-            if response_count == 0:
+            if response_count == 0 and peer in self.peers:
                 inactive_peers.append(peer)
-                print(f"{bcolors.RED}No response from {peer}{bcolors.ENDC}")
+                print(f"\n{bcolors.RED}No response from {peer}{bcolors.ENDC}")
 
         # Handle inactive peers
         if inactive_peers:
-            for inactive_peer in inactive_peers:
-                remove_msg = {
-                    "status": "update",
-                    "type": "leave",
-                    "room": self.room,
-                    "member": "Unknown (timeout)",
-                    "address": inactive_peer[0],
-                    "port": inactive_peer[1],
-                    "reason": "ping_timeout"
-                }
-                
-                # Remove locally
-                if inactive_peer in self.peers:
-                    self.peers.remove(inactive_peer)
-                    leaving_port = str(inactive_peer[1])
-                    if leaving_port in self.message_clock:
-                        del self.message_clock[leaving_port]
-                    if leaving_port in self.join_time_clock:
-                        del self.join_time_clock[leaving_port]
-                    if leaving_port in self.recovery_in_progress:
-                        self.recovery_in_progress.remove(leaving_port)
-                
-                # Broadcast to remaining peers
-                for peer in self.peers:
-                    try:
-                        udp_socket.sendto(json.dumps(remove_msg).encode('utf-8'), peer)
-                    except Exception as e:
-                        print(f"Error notifying peer {peer} of removal: {e}")
-
-            # Update server
-            client_socket = self.connect_to_central_server()
-            if client_socket:
-                try:
-                    update_request = {
-                        "action": "update_room",
-                        "room": self.room,
-                        "active_clients": self.peers
-                    }
-                    client_socket.sendall(json.dumps(update_request).encode("utf-8"))
-                    response = json.loads(client_socket.recv(1024).decode("utf-8"))
-                    if response["status"] != "success":
-                        print(f"Server failed to update room list: {response.get('message', 'Unknown error')}")
-                finally:
-                    client_socket.close()
+            self.evict_peers(udp_socket, inactive_peers, "ping_timeout")
         else:
-            print(f"{bcolors.GREEN}All peers responded!{bcolors.ENDC}")
+            print(f"\n{bcolors.GREEN}All peers responded!{bcolors.ENDC}")
+        self.print_prompt()
 
 if __name__ == "__main__":
     target_hostname = "127.0.0.1"
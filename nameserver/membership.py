@@ -0,0 +1,280 @@
+from bisect import bisect_left, bisect_right, insort
+
+SORT_ORDERS = ("name", "members")
+
+
+class RoomDirectory(object):
+    def __init__(self):
+        '''
+        Create an indexed store of room membership.
+
+        Each room keeps its members in an insertion-ordered dict used as an ordered set,
+        so join, leave and lookup are O(1) and a client can be in a room only once. A
+        reverse index maps every member to the rooms it is in, and member counts are
+        kept up to date on every change instead of being recomputed for each listing.
+
+        Two sorted indexes back paginated listings: room names in lexical order, and
+        (-member_count, name) keys for listing the biggest rooms first.
+        '''
+        self.rooms = {}
+        self.member_rooms = {}
+        self.counts = {}
+        self.sorted_names = []
+        self.by_members = []
+
+    def __contains__(self, room_name):
+        return room_name in self.rooms
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def __iter__(self):
+        return iter(self.rooms)
+
+    def members(self, room_name):
+        '''
+        Returns the members of a room in join order, or an empty list if it does not exist.
+
+        args:
+            room_name (str): The room to look up.
+        '''
+        return list(self.rooms.get(room_name, ()))
+
+    def has_member(self, room_name, member):
+        '''
+        Returns True if member is in the room.
+
+        args:
+            room_name (str): The room to look up.
+            member (tuple): The (address, port) of the member.
+        '''
+        return member in self.rooms.get(room_name, ())
+
+    def rooms_of(self, member):
+        '''
+        Returns the set of rooms a member is in.
+
+        args:
+            member (tuple): The (address, port) of the member.
+        '''
+        return set(self.member_rooms.get(member, ()))
+
+    def count(self, room_name):
+        '''
+        Returns the number of members in a room.
+
+        args:
+            room_name (str): The room to look up.
+        '''
+        return self.counts.get(room_name, 0)
+
+    def member_counts(self):
+        '''
+        Returns the live mapping of room names to member counts. Callers must not modify it.
+        '''
+        return self.counts
+
+    def create(self, room_name, member):
+        '''
+        Create a room whose only member is its creator, replacing any room of the same name.
+
+        args:
+            room_name (str): The room to create.
+            member (tuple): The (address, port) of the creator.
+        '''
+        self.replace(room_name, [member])
+
+    def join(self, room_name, member):
+        '''
+        Add a member to an existing room. Returns False if it was already a member.
+
+        args:
+            room_name (str): The room to join.
+            member (tuple): The (address, port) of the member.
+        '''
+        members = self.rooms[room_name]
+        if member in members:
+            return False
+        members[member] = None
+        self.member_rooms.setdefault(member, set()).add(room_name)
+        self.set_count(room_name, len(members))
+        return True
+
+    def leave(self, room_name, member):
+        '''
+        Remove a member from a room, deleting the room once it is empty. Returns False if
+        the member was not in the room.
+
+        args:
+            room_name (str): The room to leave.
+            member (tuple): The (address, port) of the member.
+        '''
+        members = self.rooms.get(room_name)
+        if members is None or member not in members:
+            return False
+        del members[member]
+        self.unindex(room_name, member)
+        if not members:
+            self.delete(room_name)
+        else:
+            self.set_count(room_name, len(members))
+        return True
+
+    def replace(self, room_name, new_members):
+        '''
+        Replace a room's member list, creating the room if needed and deleting it if the
+        new list is empty.
+
+        args:
+            room_name (str): The room to update.
+            new_members (list): The (address, port) tuples of the new members.
+        '''
+        self.delete(room_name)
+        if not new_members:
+            return
+        members = dict.fromkeys(tuple(member) for member in new_members)
+        self.rooms[room_name] = members
+        for member in members:
+            self.member_rooms.setdefault(member, set()).add(room_name)
+        insort(self.sorted_names, room_name)
+        self.set_count(room_name, len(members))
+
+    def delete(self, room_name):
+        '''
+        Delete a room and drop it from its members' reverse index entries.
+
+        args:
+            room_name (str): The room to delete.
+        '''
+        members = self.rooms.pop(room_name, None)
+        if members is None:
+            return
+        count = self.counts.pop(room_name)
+        del self.sorted_names[bisect_left(self.sorted_names, room_name)]
+        del self.by_members[bisect_left(self.by_members, (-count, room_name))]
+        for member in members:
+            self.unindex(room_name, member)
+
+    def set_count(self, room_name, count):
+        '''
+        Record a room's new member count and move it within the member-count index.
+
+        args:
+            room_name (str): The room whose size changed.
+            count (int): The room's new member count.
+        '''
+        old_count = self.counts.get(room_name)
+        if old_count == count:
+            return
+        if old_count is not None:
+            del self.by_members[bisect_left(self.by_members, (-old_count, room_name))]
+        self.counts[room_name] = count
+        insort(self.by_members, (-count, room_name))
+
+    def unindex(self, room_name, member):
+        '''
+        Remove room_name from a member's reverse index entry.
+
+        args:
+            room_name (str): The room the member left.
+            member (tuple): The (address, port) of the member.
+        '''
+        rooms = self.member_rooms.get(member)
+        if rooms is not None:
+            rooms.discard(room_name)
+            if not rooms:
+                del self.member_rooms[member]
+
+    def snapshot(self):
+        '''
+        Returns a plain dict of room names to member lists, suitable for JSON.
+        '''
+        return {room_name: list(members) for room_name, members in self.rooms.items()}
+
+    def load(self, rooms):
+        '''
+        Replace the whole directory with the contents of a plain room dict.
+
+        args:
+            rooms (dict): Room names mapped to lists of (address, port) tuples.
+        '''
+        self.rooms = {}
+        self.member_rooms = {}
+        self.counts = {}
+        self.sorted_names = []
+        self.by_members = []
+        for room_name, members in rooms.items():
+            self.replace(room_name, members)
+
+    def apply(self, record):
+        '''
+        Apply one write-ahead log record, such as one replicated from a primary.
+
+        args:
+            record (dict): The mutation record to apply.
+        '''
+        op = record["op"]
+        room_name = record["room"]
+
+        if op == "create":
+            self.create(room_name, tuple(record["member"]))
+        elif op == "join":
+            if room_name in self.rooms:
+                self.join(room_name, tuple(record["member"]))
+            else:
+                self.replace(room_name, [record["member"]])
+        elif op == "leave":
+            self.leave(room_name, tuple(record["member"]))
+        elif op == "update":
+            self.replace(room_name, record["members"])
+        elif op == "delete":
+            self.delete(room_name)
+
+    def page(self, limit, cursor=None, prefix=None, contains=None, sort="name"):
+        '''
+        Returns one page of (room_name, member_count) pairs and the cursor for the next
+        page, which is None once the listing is exhausted. Rooms sort by name, or by
+        member count (largest first, ties by name). Cursors are opaque strings that stay
+        valid while rooms are created and deleted between requests.
+
+        args:
+            limit (int): Maximum number of rooms to return.
+            cursor (str): The next_cursor of the previous page, or None to start over.
+            prefix (str): Only list rooms whose name starts with this.
+            contains (str): Only list rooms whose name contains this.
+            sort (str): "name" or "members".
+        '''
+        if sort not in SORT_ORDERS:
+            raise ValueError(f"sort must be one of {SORT_ORDERS}, got {sort!r}")
+
+        def matches(room_name):
+            return (not prefix or room_name.startswith(prefix)) and (not contains or contains in room_name)
+
+        page = []
+        if sort == "name":
+            start = bisect_right(self.sorted_names, cursor) if cursor is not None else 0
+            if prefix:
+                start = max(start, bisect_left(self.sorted_names, prefix))
+            for index in range(start, len(self.sorted_names)):
+                room_name = self.sorted_names[index]
+                if prefix and not room_name.startswith(prefix):
+                    break
+                if matches(room_name):
+                    page.append((room_name, self.counts[room_name]))
+                    if len(page) == limit:
+                        break
+            next_cursor = page[-1][0] if len(page) == limit else None
+        else:
+            start = 0
+            if cursor is not None:
+                count, _, room_name = cursor.partition(":")
+                start = bisect_right(self.by_members, (-int(count), room_name))
+            for index in range(start, len(self.by_members)):
+                negative_count, room_name = self.by_members[index]
+                if matches(room_name):
+                    page.append((room_name, -negative_count))
+                    if len(page) == limit:
+                        break
+            next_cursor = f"{page[-1][1]}:{page[-1][0]}" if len(page) == limit else None
+
+        return page, next_cursor
@@ -0,0 +1,190 @@
+import asyncio
+
+from protocol import framing
+from protocol.hashring import parse_node
+
+
+class ReplicationManager(object):
+    def __init__(self, server, replicas, node_id, heartbeat_interval=0.1, failure_timeout=0.5):
+        '''
+        Keep a set of NameServer replicas in sync with one primary and fail over between them.
+
+        The primary streams every write-ahead log record to its followers over a framed
+        connection, starting with a snapshot of its full state, and sends heartbeats while
+        idle. A follower applies the stream to its own room directory and log, so it is
+        hot and can take over at once. Replicas are ranked by their order in the replica
+        list: a follower that loses its primary promotes itself only when every replica
+        ranked above it is unreachable, and otherwise follows whichever of them is primary.
+
+        args:
+            server (NameServer): The server whose state is replicated.
+            replicas (list): "host:port" names of every replica, in priority order.
+            node_id (str): This replica's own "host:port" name.
+            heartbeat_interval (float): Seconds between heartbeats sent to idle followers.
+            failure_timeout (float): Seconds of silence after which a primary is presumed dead.
+        '''
+        if node_id not in replicas:
+            raise ValueError(f"Node {node_id} is not one of the replicas {replicas}")
+
+        self.server = server
+        self.replicas = list(replicas)
+        self.node_id = node_id
+        self.heartbeat_interval = heartbeat_interval
+        self.failure_timeout = failure_timeout
+        self.max_follower_buffer = 16 << 20
+
+        self.role = "follower"
+        self.primary = None
+        self.followers = set()
+
+    def is_primary(self):
+        '''
+        Returns True if this replica currently accepts writes.
+        '''
+        return self.role == "primary"
+
+    async def run(self):
+        '''
+        Follow the current primary, electing a new one whenever it is lost, until this
+        replica becomes the primary itself. Then keep its followers alive with heartbeats.
+        '''
+        rank = self.replicas.index(self.node_id)
+        starting = True
+
+        while self.role == "follower":
+            higher_alive = False
+            for node in self.replicas:
+                if node == self.node_id:
+                    continue
+                outcome = await self.follow(node)
+                if outcome == "lost":
+                    print(f"Lost primary {node} - electing a new one")
+                    starting = False
+                    break
+                if outcome == "not_primary" and self.replicas.index(node) < rank:
+                    higher_alive = True
+            else:
+                if higher_alive:
+                    # A higher-ranked replica is up and about to take over; give it a moment
+                    await asyncio.sleep(self.heartbeat_interval)
+                elif starting:
+                    # Replicas started together may not be listening yet; look once more
+                    starting = False
+                    await asyncio.sleep(self.failure_timeout)
+                else:
+                    self.promote()
+
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self.broadcast({"type": "heartbeat", "seq": self.server.wal.seq})
+
+    def promote(self):
+        '''
+        Make this replica the primary.
+        '''
+        self.role = "primary"
+        self.primary = self.node_id
+        print(f"{self.node_id} is now the primary")
+        self.server.on_promoted()
+
+    async def follow(self, node):
+        '''
+        Subscribe to a replica's log stream and apply it until the stream ends. Returns
+        "unreachable" if the replica could not be contacted, "not_primary" if it is not
+        the primary, or "lost" once a primary that was being followed goes away.
+
+        args:
+            node (str): The "host:port" replica to follow.
+        '''
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(*parse_node(node)), timeout=self.failure_timeout
+            )
+        except (OSError, asyncio.TimeoutError):
+            return "unreachable"
+
+        try:
+            writer.write(framing.encode_frame({"action": "replicate", "node": self.node_id}))
+            await writer.drain()
+            snapshot = await asyncio.wait_for(framing.read_frame(reader), timeout=self.failure_timeout)
+            if not snapshot or snapshot.get("type") != "snapshot":
+                return "not_primary"
+
+            self.primary = node
+            self.server.load_replicated_snapshot(snapshot)
+            print(f"Following primary {node} from seq {snapshot['seq']}")
+
+            while True:
+                frame = await asyncio.wait_for(framing.read_frame(reader), timeout=self.failure_timeout)
+                if frame is None:
+                    break
+                if frame.get("type") == "record":
+                    self.server.apply_replicated(frame["record"])
+            return "lost"
+
+        except (OSError, ConnectionError, framing.FrameError, asyncio.TimeoutError):
+            return "lost" if self.primary == node else "unreachable"
+        finally:
+            if self.primary == node:
+                self.primary = None
+            writer.close()
+
+    async def serve_follower(self, reader, writer, request):
+        '''
+        Stream this primary's state to a follower until it disconnects. Replicas that are
+        not the primary answer with an error naming the primary they know of.
+
+        args:
+            reader (asyncio.StreamReader): Stream from the follower.
+            writer (asyncio.StreamWriter): Stream to the follower.
+            request (dict): The follower's replicate request.
+        '''
+        if not self.is_primary():
+            writer.write(framing.encode_frame({
+                "status": "error",
+                "message": "Not the primary",
+                "primary": self.primary
+            }))
+            await writer.drain()
+            return
+
+        print(f"Replica {request.get('node')} is following")
+        writer.write(framing.encode_frame({
+            "type": "snapshot",
+            "seq": self.server.wal.seq,
+            "rooms": self.server.rooms.snapshot()
+        }))
+        self.followers.add(writer)
+        try:
+            await writer.drain()
+            # Followers never send anything else; this returns when they disconnect
+            while await reader.read(4096):
+                pass
+        finally:
+            self.followers.discard(writer)
+
+    def replicate(self, record):
+        '''
+        Stream one write-ahead log record to every follower.
+
+        args:
+            record (dict): The record that was just logged.
+        '''
+        if self.followers:
+            self.broadcast({"type": "record", "record": record})
+
+    def broadcast(self, frame):
+        '''
+        Queue a frame on every follower connection, dropping followers that have fallen
+        too far behind. A dropped follower reconnects and resyncs from a fresh snapshot.
+
+        args:
+            frame (dict): The frame to send.
+        '''
+        data = framing.encode_frame(frame)
+        for writer in list(self.followers):
+            if writer.is_closing() or writer.transport.get_write_buffer_size() > self.max_follower_buffer:
+                self.followers.discard(writer)
+                writer.close()
+                continue
+            writer.write(data)
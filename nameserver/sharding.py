@@ -0,0 +1,75 @@
+import asyncio
+import socket
+
+from protocol import framing
+from protocol.hashring import parse_node
+
+
+class ShardForwarder(object):
+    def __init__(self, timeout=5.0):
+        '''
+        Forward requests to the NameServer nodes that own them, keeping one framed
+        connection open per node.
+
+        args:
+            timeout (float): Seconds to wait for the owning node to answer.
+        '''
+        self.timeout = timeout
+        self.connections = {}
+        self.locks = {}
+        self.sockets = {}
+
+    async def forward(self, node, request):
+        '''
+        Send a request to a node on the asyncio event loop and return its response.
+        The connection is reopened once if the node has dropped it.
+
+        args:
+            node (str): The owning node in "host:port" form.
+            request (dict): The request to forward.
+        '''
+        lock = self.locks.setdefault(node, asyncio.Lock())
+        async with lock:
+            for attempt in range(2):
+                if node not in self.connections:
+                    self.connections[node] = await asyncio.wait_for(
+                        asyncio.open_connection(*parse_node(node)), timeout=self.timeout
+                    )
+                reader, writer = self.connections[node]
+                try:
+                    writer.write(framing.encode_frame(request))
+                    await writer.drain()
+                    response = await asyncio.wait_for(framing.read_frame(reader), timeout=self.timeout)
+                    if response is None:
+                        raise ConnectionError(f"Node {node} closed the connection")
+                    return response
+                except (OSError, ConnectionError, framing.FrameError, asyncio.TimeoutError):
+                    writer.close()
+                    del self.connections[node]
+                    if attempt:
+                        raise
+
+    def forward_blocking(self, node, request):
+        '''
+        Send a request to a node over a blocking socket and return its response.
+        The connection is reopened once if the node has dropped it.
+
+        args:
+            node (str): The owning node in "host:port" form.
+            request (dict): The request to forward.
+        '''
+        for attempt in range(2):
+            if node not in self.sockets:
+                self.sockets[node] = socket.create_connection(parse_node(node), timeout=self.timeout)
+            node_socket = self.sockets[node]
+            try:
+                framing.send_frame(node_socket, request)
+                response = framing.recv_frame(node_socket)
+                if response is None:
+                    raise ConnectionError(f"Node {node} closed the connection")
+                return response
+            except (OSError, framing.FrameError):
+                node_socket.close()
+                del self.sockets[node]
+                if attempt:
+                    raise
@@ -0,0 +1,136 @@
+import asyncio
+import json
+
+
+class VerifyProtocol(asyncio.DatagramProtocol):
+    def __init__(self, verifier):
+        '''
+        Datagram protocol that hands every verification response to the RoomVerifier.
+
+        args:
+            verifier (RoomVerifier): The verifier waiting on responses.
+        '''
+        self.verifier = verifier
+
+    def datagram_received(self, data, addr):
+        self.verifier.handle_response(data, addr)
+
+    def error_received(self, exc):
+        # ICMP errors for dead clients surface here; the probe simply times out
+        pass
+
+
+class RoomVerifier(object):
+    def __init__(self, timeout=2.0, attempts=2, max_in_flight=256):
+        '''
+        Verify many rooms concurrently over one shared UDP socket.
+
+        Each room gets its own request ID. Its verification probe is sent to every
+        stored client at once, and the first matching response wins. At most
+        max_in_flight rooms are probed at the same time.
+
+        args:
+            timeout (float): Seconds to wait for a response before resending the probe.
+            attempts (int): Number of probe rounds before a room is declared inactive.
+            max_in_flight (int): Maximum number of rooms being probed at once.
+        '''
+        self.timeout = timeout
+        self.attempts = attempts
+        self.max_in_flight = max_in_flight
+        self.transport = None
+        self.pending = {}
+        self.next_request_id = 0
+
+    async def verify_all(self, rooms, on_result):
+        '''
+        Probe every room and report each outcome as soon as it is known.
+
+        args:
+            rooms (dict): Room names mapped to the client addresses to probe.
+            on_result (callable): Called as on_result(room_name, active_clients), where
+                active_clients is None if no client answered.
+        '''
+        if not rooms:
+            return
+
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: VerifyProtocol(self), local_addr=("0.0.0.0", 0)
+        )
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async def verify_and_report(room_name, clients):
+            async with semaphore:
+                active_clients = await self.verify_room(room_name, clients)
+            on_result(room_name, active_clients)
+
+        try:
+            await asyncio.gather(*(verify_and_report(room_name, clients)
+                                   for room_name, clients in rooms.items()))
+        finally:
+            self.transport.close()
+            self.transport = None
+
+    async def verify_room(self, room_name, clients):
+        '''
+        Probe all of a room's clients and return the peer list of the first to answer,
+        or None if none of them do.
+
+        args:
+            room_name (str): Name of the room to verify.
+            clients (list): List of (address, port) tuples for all clients in the room.
+        '''
+        self.next_request_id += 1
+        request_id = self.next_request_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (room_name, future)
+
+        verify_msg = json.dumps({
+            "type": "room_verify",
+            "room": room_name,
+            "request_id": request_id
+        }).encode("utf-8")
+
+        try:
+            for _ in range(self.attempts):
+                for client in clients:
+                    try:
+                        self.transport.sendto(verify_msg, tuple(client))
+                    except Exception as e:
+                        print(f"Error verifying with client {client}: {e}")
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    continue
+            return None
+        finally:
+            self.pending.pop(request_id, None)
+
+    def handle_response(self, data, addr):
+        '''
+        Resolve the probe a verification response answers. Responses from older clients
+        carry no request ID and are matched by room name instead.
+
+        args:
+            data (bytes): The datagram received.
+            addr (tuple): The (address, port) it came from.
+        '''
+        try:
+            response = json.loads(data.decode("utf-8"))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return
+        if not isinstance(response, dict) or response.get("type") != "room_verify_response":
+            return
+        if "active_clients" not in response:
+            return
+
+        request_id = response.get("request_id")
+        if request_id in self.pending:
+            candidates = [self.pending[request_id]]
+        else:
+            candidates = [entry for entry in self.pending.values() if entry[0] == response.get("room")]
+
+        for room_name, future in candidates:
+            if room_name == response.get("room") and not future.done():
+                future.set_result([tuple(client) for client in response["active_clients"]])
+                return
@@ -0,0 +1,233 @@
+import json
+import os
+import time
+from datetime import datetime
+
+FSYNC_POLICIES = ("always", "batch", "never")
+
+
+class WriteAheadLog(object):
+    def __init__(self, log_file="server_log.json", snapshot_file="server_snapshot.json",
+                 fsync_policy="batch", batch_size=64, batch_interval=0.05, snapshot_every=1000):
+        '''
+        Create a write-ahead log of room mutations backed by a periodic snapshot.
+
+        Every mutation is appended to log_file as one JSON line. After snapshot_every
+        records the full room state is written to snapshot_file and the log is truncated,
+        so recovery only has to read the latest snapshot and replay the short tail.
+
+        args:
+            log_file (str): Path of the append-only mutation log.
+            snapshot_file (str): Path of the latest full snapshot.
+            fsync_policy (str): "always" fsyncs every record, "batch" flushes and fsyncs once
+                batch_size records are pending or batch_interval seconds have passed, and
+                "never" flushes to the OS without fsyncing.
+            batch_size (int): Records to group per fsync under the "batch" policy.
+            batch_interval (float): Longest time in seconds a record may wait for its fsync.
+            snapshot_every (int): Records to append before compacting into a new snapshot.
+        '''
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync_policy must be one of {FSYNC_POLICIES}, got {fsync_policy!r}")
+
+        self.log_file = log_file
+        self.snapshot_file = snapshot_file
+        self.fsync_policy = fsync_policy
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.snapshot_every = snapshot_every
+
+        self.seq = 0
+        self.records_since_snapshot = 0
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        self.handle = None
+
+    def recover(self):
+        '''
+        Rebuild the room state from the latest snapshot plus the log records written after it.
+        Lines in the older full-state format ({"timestamp", "rooms"}) are treated as snapshots.
+        Returns a dict mapping room names to lists of (address, port) tuples.
+        '''
+        rooms = {}
+        snapshot_seq = 0
+
+        if os.path.exists(self.snapshot_file):
+            try:
+                with open(self.snapshot_file, "r") as f:
+                    snapshot = json.load(f)
+                rooms = {name: [tuple(member) for member in members]
+                         for name, members in snapshot.get("rooms", {}).items()}
+                snapshot_seq = snapshot.get("seq", 0)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Error reading snapshot {self.snapshot_file}: {e}")
+
+        self.seq = snapshot_seq
+        replayed = 0
+
+        if os.path.exists(self.log_file):
+            with open(self.log_file, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final write from a crash; everything before it is intact
+                        print(f"Skipping unreadable log record: {line.strip()[:80]}")
+                        continue
+
+                    if "op" not in record:
+                        rooms = {name: [tuple(member) for member in members]
+                                 for name, members in record.get("rooms", {}).items()}
+                        replayed += 1
+                        continue
+
+                    if record.get("seq", 0) <= snapshot_seq:
+                        continue
+                    apply_record(rooms, record)
+                    self.seq = max(self.seq, record["seq"])
+                    replayed += 1
+
+        self.records_since_snapshot = replayed
+        print(f"Recovered {len(rooms)} room(s) from snapshot at seq {snapshot_seq} plus {replayed} log record(s)")
+        return rooms
+
+    def open(self):
+        '''
+        Open the log for appending, if it is not already open.
+        '''
+        if self.handle is None:
+            self.handle = open(self.log_file, "a")
+
+    def append(self, op, room, **fields):
+        '''
+        Append one mutation record to the log, syncing according to the fsync policy.
+
+        args:
+            op (str): The mutation type ("create", "join", "leave", "update" or "delete").
+            room (str): The room the mutation applies to.
+            fields: Mutation-specific fields, such as member or members.
+        '''
+        record = {"seq": self.seq + 1, "op": op, "room": room}
+        record.update(fields)
+        return self.write(record)
+
+    def write(self, record):
+        '''
+        Append a record that already carries its sequence number, such as one streamed
+        from a primary to its replicas, syncing according to the fsync policy.
+
+        args:
+            record (dict): The mutation record to append.
+        '''
+        self.open()
+        self.seq = max(self.seq, record["seq"])
+        self.handle.write(json.dumps(record) + "\n")
+        self.records_since_snapshot += 1
+        self.pending += 1
+
+        if self.fsync_policy == "always":
+            self.sync()
+        elif self.fsync_policy == "never":
+            self.handle.flush()
+            self.pending = 0
+        else:
+            self.sync_if_due()
+        return record
+
+    def sync_if_due(self):
+        '''
+        Flush and fsync the pending batch if it is full or has waited long enough.
+        '''
+        if not self.pending:
+            return
+        if self.pending >= self.batch_size or time.monotonic() - self.last_sync >= self.batch_interval:
+            self.sync()
+
+    def sync(self):
+        '''
+        Flush buffered records to the OS and fsync them to disk.
+        '''
+        if self.handle is None:
+            return
+        self.handle.flush()
+        if self.fsync_policy != "never":
+            os.fsync(self.handle.fileno())
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def needs_compaction(self):
+        '''
+        Returns True once enough records have been appended since the last snapshot.
+        '''
+        return self.records_since_snapshot >= self.snapshot_every
+
+    def compact(self, rooms):
+        '''
+        Write rooms as the new snapshot and truncate the log. The snapshot is written to a
+        temporary file and renamed into place, and it records the last sequence number it
+        covers, so a crash at any point leaves a state that recovers correctly.
+
+        args:
+            rooms (dict): The full current room state.
+        '''
+        self.sync()
+        snapshot = {
+            "timestamp": datetime.now().isoformat(),
+            "seq": self.seq,
+            "rooms": rooms
+        }
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        with open(self.log_file, "w") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.records_since_snapshot = 0
+
+    def close(self):
+        '''
+        Sync and close the log.
+        '''
+        if self.handle is not None:
+            self.sync()
+            self.handle.close()
+            self.handle = None
+
+
+def apply_record(rooms, record):
+    '''
+    Apply one log record to a room state dict.
+
+    args:
+        rooms (dict): Room names mapped to lists of (address, port) tuples.
+        record (dict): The mutation record to apply.
+    '''
+    op = record["op"]
+    room = record["room"]
+
+    if op == "create":
+        rooms[room] = [tuple(record["member"])]
+    elif op == "join":
+        rooms.setdefault(room, []).append(tuple(record["member"]))
+    elif op == "leave":
+        member = tuple(record["member"])
+        if member in rooms.get(room, []):
+            rooms[room].remove(member)
+        if room in rooms and not rooms[room]:
+            del rooms[room]
+    elif op == "update":
+        members = [tuple(member) for member in record["members"]]
+        if members:
+            rooms[room] = members
+        else:
+            rooms.pop(room, None)
+    elif op == "delete":
+        rooms.pop(room, None)
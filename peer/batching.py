@@ -0,0 +1,97 @@
+import asyncio
+
+
+# Python's socket module has no sendmmsg, so the batching here happens a level up:
+# datagrams sent while handling what the event loop read are queued and written out in one
+# flush per pass of the loop. The flush is scheduled with call_soon, so it runs after the
+# rest of the current pass's callbacks.
+
+
+class BatchingSocket(object):
+    def __init__(self, sock, max_queued=256):
+        '''
+        Wrap a UDP socket so that writes are queued until the next flush. Everything other
+        than sendto is passed through to the wrapped socket.
+
+        args:
+            sock (socket): The UDP socket to wrap.
+            max_queued (int): Queued datagrams that force a flush without waiting for
+                the event loop.
+        '''
+        self.sock = sock
+        self.max_queued = max_queued
+        self.queue = []  # (data, address) waiting for the next flush
+        self.loop = None
+        self.transport = None
+
+    async def open_endpoint(self, on_datagram):
+        '''
+        Hand the wrapped socket to the running asyncio loop as a datagram endpoint. From
+        then on the loop reads it, passing each datagram to on_datagram(data, addr), sends
+        go through the endpoint's transport, and the queue is flushed automatically at the
+        end of each pass of the loop.
+
+        args:
+            on_datagram (callable): Called as on_datagram(data, addr) for each datagram.
+        '''
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: PeerProtocol(on_datagram), sock=self.sock
+        )
+        self.loop = loop
+        self.transport = transport
+
+    def sendto(self, data, address):
+        self.queue.append((data, address))
+        if len(self.queue) >= self.max_queued:
+            self.flush()
+        elif self.loop and len(self.queue) == 1:
+            self.loop.call_soon(self.flush)
+        return len(data)
+
+    def flush(self):
+        '''
+        Send every queued datagram, in the order they were queued. A datagram that
+        cannot be sent is reported and dropped, as UDP would have dropped it anyway.
+        '''
+        queue, self.queue = self.queue, []
+        sendto = self.transport.sendto if self.transport else self.sock.sendto
+        for data, address in queue:
+            try:
+                sendto(data, address)
+            except OSError as e:
+                print(f"Error sending message to {address}: {e}")
+
+    def close(self):
+        '''
+        Send whatever is still queued, then close the socket.
+        '''
+        self.flush()
+        if self.transport:
+            # The transport closes the socket once its own buffer has drained
+            self.transport.close()
+            self.transport = None
+            self.loop = None
+        else:
+            self.sock.close()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class PeerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, on_datagram):
+        '''
+        Pass the datagrams an asyncio endpoint receives to a callback. An exception in the
+        callback is reported rather than allowed to close the endpoint.
+
+        args:
+            on_datagram (callable): Called as on_datagram(data, addr) for each datagram.
+        '''
+        self.on_datagram = on_datagram
+
+    def datagram_received(self, data, addr):
+        try:
+            self.on_datagram(data, addr)
+        except Exception as e:
+            print(f"Error handling datagram from {addr}: {e}")
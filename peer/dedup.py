@@ -0,0 +1,83 @@
+class DedupWindow(object):
+    def __init__(self, window=1024):
+        '''
+        Remember which sequence numbers have been received from each sender, in constant
+        memory per sender.
+
+        Each sender has a high-water mark (the highest sequence number seen) and a bitmap
+        of which of the window sequence numbers below it have been seen. Live traffic
+        older than the window is assumed to be a duplicate; recovery, which can reach
+        arbitrarily far back, asks with seen() instead, which only reports what the
+        window actually recorded.
+
+        args:
+            window (int): How many sequence numbers below the high-water mark are tracked.
+        '''
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.senders = {}  # sender -> [high-water mark, bitmap with bit i for mark - i]
+
+    def __contains__(self, key):
+        sender, sequence_number = key
+        state = self.senders.get(sender)
+        if state is None:
+            return False
+        high_water_mark, bitmap = state
+        if sequence_number > high_water_mark:
+            return False
+        offset = high_water_mark - sequence_number
+        if offset >= self.window:
+            return True
+        return bool(bitmap >> offset & 1)
+
+    def seen(self, sender, sequence_number):
+        '''
+        Returns True only if the sequence number is inside the sender's window and was
+        recorded there. Numbers older than the window are not assumed to be duplicates,
+        so recovered messages from far back are still delivered.
+
+        args:
+            sender (str): The sender's port.
+            sequence_number (int): The message's sequence number from that sender.
+        '''
+        state = self.senders.get(sender)
+        if state is None or sequence_number > state[0]:
+            return False
+        offset = state[0] - sequence_number
+        return offset < self.window and bool(state[1] >> offset & 1)
+
+    def add(self, sender, sequence_number):
+        '''
+        Record a sequence number. Returns True if it had not been seen before.
+
+        args:
+            sender (str): The sender's port.
+            sequence_number (int): The message's sequence number from that sender.
+        '''
+        if (sender, sequence_number) in self:
+            return False
+        state = self.senders.setdefault(sender, [0, 0])
+        if sequence_number > state[0]:
+            gap = sequence_number - state[0]
+            if gap >= self.window:
+                # Everything tracked falls out of the window, so start a fresh bitmap
+                # rather than shifting by a gap a peer could make arbitrarily large
+                state[1] = 1
+            else:
+                state[1] = (state[1] << gap | 1) & self.mask
+            state[0] = sequence_number
+        else:
+            state[1] |= 1 << (state[0] - sequence_number)
+        return True
+
+    def forget(self, sender):
+        '''
+        Drop a sender that left, so it can start a new sequence if it comes back.
+
+        args:
+            sender (str): The sender's port.
+        '''
+        self.senders.pop(sender, None)
+
+    def clear(self):
+        self.senders.clear()
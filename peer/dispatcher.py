@@ -0,0 +1,74 @@
+import time
+
+
+class MessageDispatcher(object):
+    def __init__(self, default_type=None):
+        '''
+        Route decoded peer datagrams to the handler registered for their type with a
+        single dict lookup, and keep per-type counters and timings for profiling.
+
+        args:
+            default_type (str): Type whose handler receives messages with no "type" field
+                or with a type nobody registered.
+        '''
+        self.handlers = {}
+        self.default_type = default_type
+        self.counts = {}
+        self.total_time = {}
+        self.max_time = {}
+
+    def register(self, message_type, handler):
+        '''
+        Register the handler for a message type, replacing any previous one.
+
+        args:
+            message_type (str): The value of the datagram's "type" field.
+            handler (callable): Called as handler(msg, addr).
+        '''
+        self.handlers[message_type] = handler
+        self.counts.setdefault(message_type, 0)
+        self.total_time.setdefault(message_type, 0.0)
+        self.max_time.setdefault(message_type, 0.0)
+
+    def dispatch(self, msg, addr):
+        '''
+        Hand a decoded message to its handler and record how long the handler took.
+        Returns the handler's return value.
+
+        args:
+            msg (dict): The decoded datagram.
+            addr (tuple): The (address, port) it came from.
+        '''
+        message_type = msg.get("type", self.default_type)
+        handler = self.handlers.get(message_type)
+        if handler is None:
+            message_type = self.default_type
+            handler = self.handlers[message_type]
+
+        start = time.perf_counter()
+        try:
+            return handler(msg, addr)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.counts[message_type] += 1
+            self.total_time[message_type] += elapsed
+            if elapsed > self.max_time[message_type]:
+                self.max_time[message_type] = elapsed
+
+    def stats(self):
+        '''
+        Returns {message_type: (count, total_seconds, max_seconds)} for every type seen.
+        '''
+        return {
+            message_type: (count, self.total_time[message_type], self.max_time[message_type])
+            for message_type, count in self.counts.items() if count
+        }
+
+    def reset_stats(self):
+        '''
+        Zero all counters and timings.
+        '''
+        for message_type in self.counts:
+            self.counts[message_type] = 0
+            self.total_time[message_type] = 0.0
+            self.max_time[message_type] = 0.0
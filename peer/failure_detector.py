@@ -0,0 +1,180 @@
+import itertools
+import json
+import random
+
+
+class FailureDetector(object):
+    def __init__(self, timers, udp_socket, own_address, get_peers, on_dead,
+                 protocol_period=1.0, ack_timeout=0.3, indirect_probes=2, suspicion_timeout=3.0):
+        '''
+        Create a SWIM-style failure detector for the peers of a room.
+
+        Every protocol period one peer is probed, in a shuffled round-robin order, so
+        each client sends O(1) probes per period regardless of room size. A peer that
+        does not ack in time is probed indirectly through a few other peers; if that
+        also fails it becomes suspect, and it is declared dead only if nothing at all is
+        heard from it before the suspicion timeout.
+
+        args:
+            timers (TimerQueue): The event loop's timer queue.
+            udp_socket (socket): The UDP socket used for probes.
+            own_address (tuple): This client's (address, port), which is never probed.
+            get_peers (callable): Returns the current list of peer addresses.
+            on_dead (callable): Called as on_dead(peer) when a peer is declared dead.
+            protocol_period (float): Seconds between probes.
+            ack_timeout (float): Seconds to wait for a direct ack before probing indirectly.
+            indirect_probes (int): Number of peers asked to probe an unresponsive peer.
+            suspicion_timeout (float): Seconds a suspect peer has to show signs of life.
+        '''
+        self.timers = timers
+        self.udp_socket = udp_socket
+        self.own_address = own_address
+        self.get_peers = get_peers
+        self.on_dead = on_dead
+        self.protocol_period = protocol_period
+        self.ack_timeout = ack_timeout
+        self.indirect_probes = indirect_probes
+        self.suspicion_timeout = suspicion_timeout
+
+        self.seq = itertools.count(1)
+        self.probe_order = []
+        self.pending = {}   # seq -> peer we are waiting to hear an ack for
+        self.relays = {}    # seq -> (requester, requester's seq) for indirect probes we run
+        self.suspects = {}  # peer -> timer handle of its suspicion timeout
+        self.tick_handle = None
+
+    def start(self):
+        '''
+        Begin probing peers every protocol period.
+        '''
+        if self.tick_handle is None:
+            self.tick_handle = self.timers.call_later(self.protocol_period, self.tick)
+
+    def stop(self):
+        '''
+        Stop probing and forget all outstanding probes and suspicions.
+        '''
+        if self.tick_handle is not None:
+            self.timers.cancel(self.tick_handle)
+            self.tick_handle = None
+        for handle in self.suspects.values():
+            self.timers.cancel(handle)
+        self.pending.clear()
+        self.relays.clear()
+        self.suspects.clear()
+
+    def other_peers(self):
+        '''
+        Returns the peers that can be probed, i.e. everyone but this client.
+        '''
+        return [tuple(peer) for peer in self.get_peers() if tuple(peer) != self.own_address]
+
+    def send(self, msg, peer):
+        '''
+        Send one failure detector message to a peer.
+        '''
+        try:
+            self.udp_socket.sendto(json.dumps(msg).encode("utf-8"), peer)
+        except Exception as e:
+            print(f"Error sending {msg['type']} to {peer}: {e}")
+
+    def tick(self):
+        '''
+        Probe the next peer in the round-robin order and schedule the next period.
+        '''
+        self.tick_handle = self.timers.call_later(self.protocol_period, self.tick)
+
+        peers = self.other_peers()
+        if not peers:
+            return
+        if not self.probe_order:
+            self.probe_order = list(peers)
+            random.shuffle(self.probe_order)
+        target = self.probe_order.pop()
+        if target not in peers:
+            return
+
+        seq = next(self.seq)
+        self.pending[seq] = target
+        self.send({"type": "swim_ping", "seq": seq}, target)
+        self.timers.call_later(self.ack_timeout, self.direct_timeout, seq, target)
+
+    def direct_timeout(self, seq, target):
+        '''
+        The target did not ack a direct probe in time; ask other peers to probe it.
+        '''
+        if seq not in self.pending:
+            return
+        helpers = [peer for peer in self.other_peers() if peer != target]
+        for helper in random.sample(helpers, min(self.indirect_probes, len(helpers))):
+            self.send({"type": "swim_ping_req", "seq": seq, "target": list(target)}, helper)
+        self.timers.call_later(max(self.protocol_period - self.ack_timeout, self.ack_timeout),
+                               self.indirect_timeout, seq, target)
+
+    def indirect_timeout(self, seq, target):
+        '''
+        Neither direct nor indirect probes reached the target; start suspecting it.
+        '''
+        if self.pending.pop(seq, None) is None:
+            return
+        if target not in self.suspects and target in self.other_peers():
+            self.suspects[target] = self.timers.call_later(self.suspicion_timeout, self.confirm_dead, target)
+
+    def confirm_dead(self, target):
+        '''
+        A suspect stayed silent for the whole suspicion timeout.
+        '''
+        if self.suspects.pop(target, None) is not None:
+            self.on_dead(target)
+
+    def heard_from(self, peer):
+        '''
+        Any datagram from a peer proves it is alive and clears suspicion of it.
+
+        args:
+            peer (tuple): The (address, port) a datagram arrived from.
+        '''
+        handle = self.suspects.pop(tuple(peer), None)
+        if handle is not None:
+            self.timers.cancel(handle)
+
+    def handle(self, msg, addr):
+        '''
+        Handle a swim_ping, swim_ping_req or swim_ack datagram.
+
+        args:
+            msg (dict): The decoded datagram.
+            addr (tuple): The (address, port) it came from.
+        '''
+        if msg["type"] == "swim_ping":
+            self.handle_ping(msg, addr)
+        elif msg["type"] == "swim_ping_req":
+            self.handle_ping_req(msg, addr)
+        elif msg["type"] == "swim_ack":
+            self.handle_ack(msg, addr)
+
+    def handle_ping(self, msg, addr):
+        '''
+        Ack a probe.
+        '''
+        self.send({"type": "swim_ack", "seq": msg["seq"]}, addr)
+
+    def handle_ping_req(self, msg, addr):
+        '''
+        Probe a peer on behalf of another peer, relaying the ack if one arrives.
+        '''
+        seq = next(self.seq)
+        self.relays[seq] = (addr, msg["seq"])
+        self.send({"type": "swim_ping", "seq": seq}, tuple(msg["target"]))
+        self.timers.call_later(self.protocol_period, self.relays.pop, seq, None)
+
+    def handle_ack(self, msg, addr):
+        '''
+        Resolve the probe an ack answers, or relay it to the peer that asked us to probe.
+        '''
+        seq = msg["seq"]
+        if seq in self.pending:
+            self.heard_from(self.pending.pop(seq))
+        elif seq in self.relays:
+            requester, requester_seq = self.relays.pop(seq)
+            self.send({"type": "swim_ack", "seq": requester_seq}, requester)
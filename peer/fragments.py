@@ -0,0 +1,141 @@
+import itertools
+import os
+import struct
+import time
+from collections import OrderedDict
+
+
+# A datagram larger than the MTU is split into fragments, each starting with FRAGMENT_MAGIC
+# (which can begin neither a JSON object nor a binary wire datagram), the fragment set's
+# id, the fragment's index and the number of fragments in the set. The receiver collects
+# the fragments of a set, from the same sender, and hands on the original datagram once
+# all of them are in.
+FRAGMENT_MAGIC = 0xB2
+HEADER = struct.Struct("!BIHH")  # magic, set id, index, count
+
+
+def is_fragment(data):
+    '''
+    Returns True if a datagram is a fragment of a larger one.
+
+    args:
+        data (bytes): The datagram.
+    '''
+    return len(data) > 0 and data[0] == FRAGMENT_MAGIC
+
+
+class FragmentingSocket(object):
+    def __init__(self, sock, mtu=1200):
+        '''
+        Wrap a UDP socket so that datagrams larger than the MTU are sent as fragments.
+        Everything other than sendto is passed through to the wrapped socket, so the
+        wrapper can be used with select().
+
+        args:
+            sock (socket): The UDP socket to wrap.
+            mtu (int): The largest datagram to put on the wire, in bytes.
+        '''
+        self.sock = sock
+        self.mtu = mtu
+        self.chunk_size = mtu - HEADER.size
+        self.set_ids = itertools.count(int.from_bytes(os.urandom(4), "big"))
+
+    def sendto(self, data, address):
+        if len(data) <= self.mtu:
+            return self.sock.sendto(data, address)
+
+        count = -(-len(data) // self.chunk_size)
+        if count > 0xFFFF:
+            raise ValueError(f"Datagram of {len(data)} bytes is too large to fragment")
+        set_id = next(self.set_ids) & 0xFFFFFFFF
+        for index in range(count):
+            chunk = data[index * self.chunk_size:(index + 1) * self.chunk_size]
+            self.sock.sendto(HEADER.pack(FRAGMENT_MAGIC, set_id, index, count) + chunk, address)
+        return len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class Reassembler(object):
+    def __init__(self, timeout=5.0, max_bytes=4 << 20):
+        '''
+        Rebuild fragmented datagrams.
+
+        A set whose fragments do not all arrive within the timeout is discarded, and if the
+        fragments being held exceed max_bytes the oldest sets are discarded until they fit.
+
+        args:
+            timeout (float): Seconds a set may take to complete.
+            max_bytes (int): Bytes of fragments held across all incomplete sets.
+        '''
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.pending = OrderedDict()  # (sender, set id) -> [started, count, {index: chunk}, bytes]
+        self.buffered = 0
+        self.discarded = 0
+
+    def add(self, sender, data):
+        '''
+        Store a fragment. Returns the original datagram once its last fragment arrives,
+        otherwise None.
+
+        args:
+            sender (tuple): The (address, port) the fragment came from.
+            data (bytes): The fragment.
+        '''
+        now = time.monotonic()
+        self.expire(now)
+
+        if len(data) < HEADER.size:
+            return None
+        _, set_id, index, count = HEADER.unpack_from(data)
+        chunk = data[HEADER.size:]
+        if index >= count:
+            return None
+        if count == 1:
+            return chunk
+
+        key = (tuple(sender), set_id)
+        entry = self.pending.get(key)
+        if entry is not None and entry[1] != count:
+            self.discard(key)
+            entry = None
+        if entry is None:
+            entry = self.pending[key] = [now, count, {}, 0]
+        if index in entry[2]:
+            return None
+
+        entry[2][index] = chunk
+        entry[3] += len(chunk)
+        self.buffered += len(chunk)
+
+        while self.buffered > self.max_bytes and self.pending:
+            self.discard(next(iter(self.pending)))
+        if key not in self.pending:
+            return None
+
+        if len(entry[2]) < count:
+            return None
+        del self.pending[key]
+        self.buffered -= entry[3]
+        return b"".join(entry[2][i] for i in range(count))
+
+    def discard(self, key):
+        entry = self.pending.pop(key)
+        self.buffered -= entry[3]
+        self.discarded += 1
+
+    def expire(self, now):
+        '''
+        Discard sets that have been incomplete for longer than the timeout.
+        '''
+        while self.pending:
+            key, entry = next(iter(self.pending.items()))
+            if now - entry[0] < self.timeout:
+                break
+            self.discard(key)
+
+    def clear(self):
+        self.pending.clear()
+        self.buffered = 0
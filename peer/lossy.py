@@ -0,0 +1,47 @@
+import random
+
+
+class LossySocket(object):
+    def __init__(self, sock, drop=0.0, reorder=0.0, delay=0.05, timers=None, seed=None):
+        '''
+        Wrap a UDP socket so that outgoing datagrams are dropped or reordered, for
+        exercising loss recovery locally. Everything other than sendto is passed
+        through to the wrapped socket, so the wrapper can be used with select().
+
+        args:
+            sock (socket): The UDP socket to wrap.
+            drop (float): Fraction of datagrams silently discarded.
+            reorder (float): Fraction of datagrams held back so later ones overtake them.
+            delay (float): Seconds a held datagram waits when timers are given.
+            timers (TimerQueue): Timer queue used to release held datagrams. Without one,
+                a held datagram goes out right after the next datagram sent.
+            seed (int): Seed for the random choices, for repeatable runs.
+        '''
+        self.sock = sock
+        self.drop = drop
+        self.reorder = reorder
+        self.delay = delay
+        self.timers = timers
+        self.random = random.Random(seed)
+        self.held = []
+        self.dropped = 0
+        self.reordered = 0
+
+    def sendto(self, data, address):
+        held, self.held = self.held, []
+        if self.random.random() < self.drop:
+            self.dropped += 1
+        elif self.random.random() < self.reorder:
+            self.reordered += 1
+            if self.timers:
+                self.timers.call_later(self.delay, self.sock.sendto, data, address)
+            else:
+                self.held.append((data, address))
+        else:
+            self.sock.sendto(data, address)
+        for held_data, held_address in held:
+            self.sock.sendto(held_data, held_address)
+        return len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
@@ -0,0 +1,158 @@
+import mmap
+import os
+import struct
+from array import array
+
+
+RECORD_HEADER = struct.Struct("!I")  # One more than the length of the UTF-8 message that follows
+GROWTH = 1 << 20  # Bytes added to a segment file each time it fills up
+
+
+class MessageStore(object):
+    def __init__(self, capacity=1024, path=None):
+        '''
+        An append-only log of the messages this client sent, indexed by sequence number.
+
+        The newest capacity messages are kept in an in-memory ring. If a path is given,
+        every message is also appended to a memory-mapped segment file, so older
+        messages can still be served and the history survives a restart. Records in the
+        file are a 4-byte big-endian header and the UTF-8 message. The header holds the
+        message's length plus one, so that an empty message is never mistaken for the zero
+        that marks the end of the written data. Sequence numbers start at 1 and the nth
+        record in the file is message n.
+
+        args:
+            capacity (int): Messages kept in memory.
+            path (str): Segment file to persist messages to, or None to keep them in memory only.
+        '''
+        self.capacity = capacity
+        self.ring = [None] * capacity
+        self.path = path
+        self.offsets = array("Q")  # offsets[n - 1] is where message n starts in the segment
+        self.last_sequence = 0
+        self.file = None
+        self.map = None
+        self.end = 0
+
+        if path:
+            self.open_segment()
+
+    def open_segment(self):
+        '''
+        Open or create the segment file and index the messages already in it.
+        '''
+        exists = os.path.exists(self.path)
+        self.file = open(self.path, "r+b" if exists else "w+b")
+        size = os.fstat(self.file.fileno()).st_size
+        if size == 0:
+            self.file.truncate(GROWTH)
+            size = GROWTH
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+        while self.end + RECORD_HEADER.size <= size:
+            (header,) = RECORD_HEADER.unpack_from(self.map, self.end)
+            length = header - 1
+            if header == 0 or self.end + RECORD_HEADER.size + length > size:
+                break
+            self.offsets.append(self.end)
+            self.end += RECORD_HEADER.size + length
+
+        self.last_sequence = len(self.offsets)
+        for sequence_number in range(max(1, self.last_sequence - self.capacity + 1), self.last_sequence + 1):
+            self.ring[sequence_number % self.capacity] = self.read(sequence_number)
+
+    def read(self, sequence_number):
+        offset = self.offsets[sequence_number - 1]
+        (header,) = RECORD_HEADER.unpack_from(self.map, offset)
+        length = header - 1
+        start = offset + RECORD_HEADER.size
+        return self.map[start:start + length].decode('utf-8')
+
+    def write(self, message):
+        data = message.encode('utf-8')
+        needed = self.end + RECORD_HEADER.size + len(data) + RECORD_HEADER.size
+        if needed > len(self.map):
+            size = len(self.map) + max(GROWTH, needed - len(self.map))
+            self.map.close()
+            self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), size)
+        # The header goes in last, so a record torn by a crash is never indexed
+        start = self.end + RECORD_HEADER.size
+        self.map[start:start + len(data)] = data
+        RECORD_HEADER.pack_into(self.map, self.end, len(data) + 1)
+        self.offsets.append(self.end)
+        self.end += RECORD_HEADER.size + len(data)
+
+    def append(self, message):
+        '''
+        Store a message and return its sequence number.
+
+        args:
+            message (str): The message body.
+        '''
+        if self.map is not None:
+            self.write(message)
+        self.last_sequence += 1
+        self.ring[self.last_sequence % self.capacity] = message
+        return self.last_sequence
+
+    @property
+    def first_sequence(self):
+        '''
+        The oldest sequence number that can still be looked up.
+        '''
+        if self.map is not None:
+            return 1
+        return max(1, self.last_sequence - self.capacity + 1)
+
+    def get(self, sequence_number):
+        '''
+        Returns the message with the given sequence number, or None if it is not stored.
+
+        args:
+            sequence_number (int): The message's sequence number.
+        '''
+        if not self.first_sequence <= sequence_number <= self.last_sequence:
+            return None
+        if sequence_number > self.last_sequence - self.capacity:
+            return self.ring[sequence_number % self.capacity]
+        return self.read(sequence_number)
+
+    def range(self, first, last):
+        '''
+        Returns the sequence number of the first stored message in [first, last] and the
+        stored messages from there to last, in order.
+
+        args:
+            first (int): The first sequence number wanted.
+            last (int): The last sequence number wanted.
+        '''
+        first = max(first, self.first_sequence)
+        last = min(last, self.last_sequence)
+        return first, [self.get(sequence_number) for sequence_number in range(first, last + 1)]
+
+    def __len__(self):
+        return self.last_sequence - self.first_sequence + 1
+
+    def __iter__(self):
+        '''
+        Iterate over the messages kept in memory, oldest first.
+        '''
+        first = max(1, self.last_sequence - self.capacity + 1)
+        for sequence_number in range(first, self.last_sequence + 1):
+            yield self.ring[sequence_number % self.capacity]
+
+    def flush(self):
+        if self.map is not None:
+            self.map.flush()
+
+    def close(self):
+        '''
+        Flush the segment file to disk and close it.
+        '''
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+            self.file = None
@@ -0,0 +1,211 @@
+import json
+import time
+from collections import deque
+
+
+def to_ranges(sequence_numbers):
+    '''
+    Collapse sequence numbers into a sorted list of inclusive [first, last] ranges.
+
+    args:
+        sequence_numbers (iterable): The sequence numbers to collapse.
+    '''
+    ranges = []
+    for number in sorted(set(sequence_numbers)):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ranges
+
+
+def from_ranges(ranges):
+    '''
+    Expand inclusive [first, last] ranges back into a set of sequence numbers.
+
+    args:
+        ranges (list): The ranges to expand.
+    '''
+    return {number for first, last in ranges for number in range(first, last + 1)}
+
+
+def pack_batches(user, first_sequence, messages, mtu, room_id=None):
+    '''
+    Pack consecutive log entries into as few recovery_batch datagrams as fit under the MTU.
+    An entry too large to share a datagram is sent on its own.
+
+    args:
+        user (str): The user ID the messages were sent as.
+        first_sequence (int): The sequence number of the first message.
+        messages (list): The message bodies, in sequence order.
+        mtu (int): The largest datagram to build, in bytes.
+        room_id (int): The room the messages were sent in, for clients in several rooms.
+    returns:
+        list: ((first, last), encoded datagram) pairs covering every message.
+    '''
+    def encode(first, bodies):
+        batch = {
+            "type": "recovery_batch",
+            "user": user,
+            "first_sequence": first,
+            "messages": bodies
+        }
+        if room_id is not None:
+            batch["room_id"] = room_id
+        return json.dumps(batch).encode('utf-8')
+
+    batches = []
+    first = first_sequence
+    bodies = []
+    size = len(encode(first_sequence + len(messages), []))
+    for body in messages:
+        # Each entry costs its encoding plus the ", " separating it from the previous one
+        cost = len(json.dumps(body).encode('utf-8')) + (2 if bodies else 0)
+        if bodies and size + cost > mtu:
+            batches.append(((first, first + len(bodies) - 1), encode(first, bodies)))
+            first += len(bodies)
+            bodies = []
+            cost -= 2
+            size = len(encode(first_sequence + len(messages), []))
+        bodies.append(body)
+        size += cost
+    if bodies:
+        batches.append(((first, first + len(bodies) - 1), encode(first, bodies)))
+    return batches
+
+
+class RecoverySender(object):
+    def __init__(self, timers, udp_socket, address, datagrams, make_complete, on_finished,
+                 rate=200.0, burst=20, ack_timeout=0.5, max_rounds=5):
+        '''
+        Send recovered messages to one peer without blocking the event loop.
+
+        Datagrams are paced by a token bucket driven by the event loop's timers. Once
+        they are all out, a recovery_complete message asks the peer which sequence
+        numbers arrived; its recovery_ack lists them as ranges and only datagrams
+        carrying missing ones are resent. The exchange gives up after max_rounds
+        unanswered rounds.
+
+        args:
+            timers (TimerQueue): The event loop's timer queue.
+            udp_socket (socket): The UDP socket to send on.
+            address (tuple): The (address, port) of the recovering peer.
+            datagrams (list): ((first, last), encoded datagram) pairs, in order, where
+                first and last are the sequence numbers the datagram carries.
+            make_complete (callable): Returns the encoded recovery_complete datagram.
+            on_finished (callable): Called with no arguments once the peer has everything
+                or the sender gives up.
+            rate (float): Datagrams per second the bucket refills at.
+            burst (int): Datagrams that may be sent back to back.
+            ack_timeout (float): Seconds to wait for a recovery_ack before asking again.
+            max_rounds (int): Resend rounds before giving up.
+        '''
+        self.timers = timers
+        self.udp_socket = udp_socket
+        self.address = address
+        self.unacked = dict(datagrams)
+        self.queue = deque(self.unacked)
+        self.make_complete = make_complete
+        self.on_finished = on_finished
+        self.rate = rate
+        self.burst = burst
+        self.ack_timeout = ack_timeout
+        self.max_rounds = max_rounds
+
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.round = 0
+        self.finished = False
+        self.handle = None
+
+    def start(self):
+        '''
+        Begin sending.
+        '''
+        self.pump()
+
+    def stop(self):
+        '''
+        Abandon the transfer without calling on_finished.
+        '''
+        self.finished = True
+        if self.handle is not None:
+            self.timers.cancel(self.handle)
+            self.handle = None
+
+    def send(self, data):
+        try:
+            self.udp_socket.sendto(data, self.address)
+        except Exception as e:
+            print(f"Error during recovery message send: {e}")
+
+    def pump(self):
+        '''
+        Send as many queued datagrams as the token bucket allows, then either wait for
+        more tokens or, once the queue is empty, ask the peer what it received.
+        '''
+        self.handle = None
+        if self.finished:
+            return
+
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+        while self.queue and self.tokens >= 1:
+            sequence_range = self.queue.popleft()
+            if sequence_range in self.unacked:
+                self.send(self.unacked[sequence_range])
+                self.tokens -= 1
+
+        if self.queue:
+            self.handle = self.timers.call_later((1 - self.tokens) / self.rate, self.pump)
+        else:
+            self.send(self.make_complete())
+            self.handle = self.timers.call_later(self.ack_timeout, self.ack_timed_out, self.round)
+
+    def ack_timed_out(self, sent_round):
+        '''
+        No recovery_ack arrived for the last round; ask again, or give up.
+        '''
+        self.handle = None
+        if self.finished or sent_round != self.round:
+            return
+        self.round += 1
+        if self.round > self.max_rounds:
+            self.finish()
+            return
+        self.send(self.make_complete())
+        self.handle = self.timers.call_later(self.ack_timeout, self.ack_timed_out, self.round)
+
+    def handle_ack(self, received_ranges, done):
+        '''
+        The peer reported which sequence numbers it has; resend the rest.
+
+        args:
+            received_ranges (list): Inclusive [first, last] ranges the peer received.
+            done (bool): True if the peer needs nothing more.
+        '''
+        if self.finished:
+            return
+        received = from_ranges(received_ranges)
+        for first, last in list(self.unacked):
+            if all(number in received for number in range(first, last + 1)):
+                del self.unacked[(first, last)]
+
+        if done or not self.unacked:
+            self.finish()
+            return
+
+        self.round += 1
+        if self.round > self.max_rounds:
+            self.finish()
+            return
+        if self.handle is not None:
+            self.timers.cancel(self.handle)
+        self.queue = deque(self.unacked)
+        self.pump()
+
+    def finish(self):
+        self.stop()
+        self.on_finished()
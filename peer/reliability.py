@@ -0,0 +1,238 @@
+import json
+import os
+import time
+
+from peer import wire
+from peer.recovery import to_ranges
+
+
+class SendState(object):
+    def __init__(self, initial_rto):
+        '''
+        What a ReliableTransport knows about the datagrams it sent one peer.
+        '''
+        self.next_seq = 1
+        self.unacked = {}  # seq -> [frame, sent_at, retransmitted, timer handle, attempts]
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+
+
+class ReceiveState(object):
+    def __init__(self, epoch, expected):
+        '''
+        What a ReliableTransport knows about the datagrams one peer sent it.
+        '''
+        self.epoch = epoch
+        self.expected = expected
+        self.buffer = {}  # seq -> payload that arrived ahead of a gap
+
+
+class ReliableTransport(object):
+    def __init__(self, timers, udp_socket, on_deliver, initial_rto=0.2, min_rto=0.05,
+                 max_rto=2.0, max_attempts=8, window=256, max_nacks=32, binary_peers=()):
+        '''
+        Reliable, ordered delivery to each peer over the client's UDP socket.
+
+        Every payload sent to a peer is numbered in a per-peer sequence and wrapped in a
+        rel_data frame. The receiver answers each frame with a rel_ack carrying its
+        cumulative ack, the ranges it holds beyond a gap (selective acks) and the
+        sequence numbers it is missing (NACKs). NACKed frames are retransmitted at once;
+        unacknowledged ones are retransmitted when their timer, derived from the measured
+        round-trip time, expires. The receiver buffers frames that arrive ahead of a gap
+        and hands payloads to on_deliver strictly in order.
+
+        Sequences are scoped to a random epoch chosen when the transport is created, so
+        a restarted peer starts a fresh sequence. Each frame also carries the lowest
+        sequence its sender may still retransmit, so a receiver never waits on a frame
+        the sender has given up on.
+
+        args:
+            timers (TimerQueue): The event loop's timer queue.
+            udp_socket (socket): The UDP socket to send on.
+            on_deliver (callable): Called as on_deliver(payload, addr) for each payload,
+                in the order the peer sent them.
+            initial_rto (float): Retransmit timeout in seconds before any RTT is measured.
+            min_rto (float): Lower bound on the retransmit timeout.
+            max_rto (float): Upper bound on the retransmit timeout.
+            max_attempts (int): Transmissions of a frame before giving up on it.
+            window (int): Frames a receiver buffers ahead of the next one it expects.
+            max_nacks (int): Missing sequence numbers reported in one rel_ack.
+            binary_peers (set): Peers that accept the binary wire format. Frames and acks
+                for them are binary encoded; everyone else gets JSON.
+        '''
+        self.timers = timers
+        self.udp_socket = udp_socket
+        self.on_deliver = on_deliver
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_nacks = max_nacks
+        self.binary_peers = binary_peers
+
+        self.epoch = os.urandom(4).hex()
+        self.sending = {}    # peer -> SendState
+        self.receiving = {}  # peer -> ReceiveState
+
+    def send(self, peer, payload):
+        '''
+        Send an encoded message to a peer, retransmitting it until it is acknowledged.
+
+        args:
+            peer (tuple): The (address, port) of the peer.
+            payload (bytes): The encoded message to deliver. It must be JSON unless the
+                peer is in binary_peers.
+        '''
+        peer = tuple(peer)
+        state = self.sending.get(peer)
+        if state is None:
+            state = self.sending[peer] = SendState(self.initial_rto)
+
+        seq = state.next_seq
+        state.next_seq += 1
+        base = min(state.unacked, default=seq)
+        frame = None
+        if peer in self.binary_peers:
+            frame = wire.encode_rel_data(self.epoch, seq, base, payload)
+        if frame is None:
+            # The payload is already encoded, so splice it in rather than decoding it again
+            header = f'{{"type": "rel_data", "epoch": "{self.epoch}", "seq": {seq}, "base": {base}, "payload": '
+            frame = header.encode('utf-8') + payload + b'}'
+
+        handle = self.timers.call_later(state.rto, self.retransmit_timeout, peer, seq)
+        state.unacked[seq] = [frame, time.monotonic(), False, handle, 1]
+        self.transmit(peer, frame)
+
+    def transmit(self, peer, data):
+        try:
+            self.udp_socket.sendto(data, peer)
+        except Exception as e:
+            print(f"Error sending message to {peer}: {e}")
+
+    def retransmit(self, peer, state, seq):
+        entry = state.unacked[seq]
+        self.timers.cancel(entry[3])
+        entry[1] = time.monotonic()
+        entry[2] = True
+        entry[3] = self.timers.call_later(state.rto, self.retransmit_timeout, peer, seq)
+        entry[4] += 1
+        self.transmit(peer, entry[0])
+
+    def retransmit_timeout(self, peer, seq):
+        '''
+        A frame went unacknowledged for a full retransmit timeout.
+        '''
+        state = self.sending.get(peer)
+        if state is None or seq not in state.unacked:
+            return
+        if state.unacked[seq][4] >= self.max_attempts:
+            del state.unacked[seq]
+            return
+        state.rto = min(self.max_rto, state.rto * 2)
+        self.retransmit(peer, state, seq)
+
+    def measure(self, state, sample):
+        '''
+        Fold a round-trip sample into the retransmit timeout, as in RFC 6298.
+        '''
+        if state.srtt is None:
+            state.srtt = sample
+            state.rttvar = sample / 2
+        else:
+            state.rttvar = 0.75 * state.rttvar + 0.25 * abs(state.srtt - sample)
+            state.srtt = 0.875 * state.srtt + 0.125 * sample
+        state.rto = min(self.max_rto, max(self.min_rto, state.srtt + 4 * state.rttvar))
+
+    def handle_ack(self, msg, addr):
+        '''
+        A peer acknowledged frames we sent it and listed the ones it is missing.
+        '''
+        peer = tuple(addr)
+        state = self.sending.get(peer)
+        if state is None or msg.get("epoch") != self.epoch:
+            return
+
+        now = time.monotonic()
+        cumulative = msg.get("cum", 0)
+        selected = {seq for first, last in msg.get("sack", []) for seq in range(first, last + 1)}
+        for seq in [seq for seq in state.unacked if seq <= cumulative or seq in selected]:
+            frame, sent_at, retransmitted, handle, attempts = state.unacked.pop(seq)
+            self.timers.cancel(handle)
+            # Karn's algorithm: a retransmitted frame's ack could be for either copy
+            if not retransmitted:
+                self.measure(state, now - sent_at)
+
+        # Resend what the peer reported missing, unless it was resent within the last RTT
+        for seq in msg.get("nack", []):
+            entry = state.unacked.get(seq)
+            if entry and now - entry[1] >= (state.srtt or self.min_rto):
+                self.retransmit(peer, state, seq)
+
+    def handle_data(self, msg, addr):
+        '''
+        A peer sent a frame. Deliver whatever is now in order and acknowledge it.
+        '''
+        peer = tuple(addr)
+        state = self.receiving.get(peer)
+        if state is None or state.epoch != msg["epoch"]:
+            state = self.receiving[peer] = ReceiveState(msg["epoch"], 1)
+
+        # Frames below the sender's base will never be resent, so stop waiting for them
+        if msg.get("base", 1) > state.expected:
+            state.expected = msg["base"]
+            for seq in [seq for seq in state.buffer if seq < state.expected]:
+                del state.buffer[seq]
+
+        seq = msg["seq"]
+        if state.expected <= seq < state.expected + self.window:
+            state.buffer[seq] = msg["payload"]
+
+        delivered = []
+        while state.expected in state.buffer:
+            delivered.append(state.buffer.pop(state.expected))
+            state.expected += 1
+
+        self.acknowledge(peer, state)
+        for payload in delivered:
+            self.on_deliver(payload, addr)
+
+    def acknowledge(self, peer, state):
+        held = sorted(state.buffer)
+        missing = []
+        if held:
+            missing = [seq for seq in range(state.expected, held[-1]) if seq not in state.buffer]
+        ack = {
+            "type": "rel_ack",
+            "epoch": state.epoch,
+            "cum": state.expected - 1,
+            "sack": to_ranges(held),
+            "nack": missing[:self.max_nacks]
+        }
+        data = None
+        if peer in self.binary_peers:
+            data = wire.encode_rel_ack(ack)
+        self.transmit(peer, data or json.dumps(ack).encode('utf-8'))
+
+    def forget(self, peer):
+        '''
+        Drop all state for a peer that left, cancelling its retransmissions.
+
+        args:
+            peer (tuple): The (address, port) of the peer.
+        '''
+        peer = tuple(peer)
+        state = self.sending.pop(peer, None)
+        if state:
+            for entry in state.unacked.values():
+                self.timers.cancel(entry[3])
+        self.receiving.pop(peer, None)
+
+    def stop(self):
+        '''
+        Cancel every retransmission and forget all peers.
+        '''
+        for peer in list(self.sending):
+            self.forget(peer)
+        self.receiving.clear()
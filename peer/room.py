@@ -0,0 +1,34 @@
+from peer import wire
+from peer.dedup import DedupWindow
+from peer.message_store import MessageStore
+
+
+class RoomState(object):
+    def __init__(self, room=None, message_log_size=1024):
+        '''
+        Everything a client tracks about one room it is in: the peers, clocks, message
+        log, duplicate window, recovery transfers and multicast membership. A client in
+        several rooms keeps one of these per room, and every datagram about a room names
+        it by room_id, so one UDP socket can serve them all.
+
+        args:
+            room (str): The room's name, or None for the placeholder used outside any room.
+            message_log_size (int): Sent messages kept in memory for recovery.
+        '''
+        self.room = room
+        self.room_id = wire.room_id(room) if room else None
+        self.peers = []
+        self.message_log = MessageStore(message_log_size)
+        self.message_clock = {}
+        self.join_time_clock = {}  # Track clock values at join time
+        self.recovery_in_progress = set()
+        self.recovery_buffers = {}  # Out-of-order recovered messages, per sender port
+        self.recovery_senders = {}  # Outgoing recovery transfers, per requesting port
+        self.received_messages = DedupWindow()  # (sender port, sequence number) pairs seen
+        self.clock_baselines = {}  # Peer -> (clock last sent to it, messages since its last full clock)
+        self.ping_responses = None  # Responses per peer while a /ping is outstanding
+        self.multicast_socket = None
+        self.multicast_group = None  # The room's (group, port) while the multicast socket is open
+        self.multicast_peers = set()  # Peers known to be listening on the room's group
+        self.multicast_tail_timer = None
+        self.timers = None  # Timers whose callbacks run inside this room
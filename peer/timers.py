@@ -0,0 +1,143 @@
+import heapq
+import itertools
+import time
+
+
+class TimerQueue(object):
+    def __init__(self):
+        '''
+        Create a queue of callbacks scheduled to run at a later time. The client's event
+        loop uses next_timeout as its select timeout and calls run_due after every wakeup,
+        so delayed work never blocks the loop with sleep().
+        '''
+        self.heap = []
+        self.counter = itertools.count()
+
+    def call_later(self, delay, callback, *args):
+        '''
+        Schedule callback(*args) to run after delay seconds. Returns a handle for cancel.
+
+        args:
+            delay (float): Seconds from now.
+            callback (callable): The function to run.
+        '''
+        entry = [time.monotonic() + delay, next(self.counter), callback, args, True]
+        heapq.heappush(self.heap, entry)
+        return entry
+
+    def cancel(self, handle):
+        '''
+        Prevent a scheduled callback from running.
+
+        args:
+            handle (list): The handle returned by call_later.
+        '''
+        handle[4] = False
+
+    def next_timeout(self):
+        '''
+        Returns the seconds until the next scheduled callback, or None if nothing is scheduled.
+        '''
+        while self.heap and not self.heap[0][4]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(0.0, self.heap[0][0] - time.monotonic())
+
+    def run_due(self):
+        '''
+        Run every callback whose time has come, in the order they were due.
+        '''
+        now = time.monotonic()
+        while self.heap and self.heap[0][0] <= now:
+            _, _, callback, args, active = heapq.heappop(self.heap)
+            if active:
+                callback(*args)
+
+    def clear(self):
+        '''
+        Drop every scheduled callback.
+        '''
+        self.heap = []
+
+
+class LoopTimers(object):
+    def __init__(self, loop):
+        '''
+        The TimerQueue interface backed by an asyncio event loop, so the components that
+        schedule work through the client's timers run unchanged on asyncio. The loop fires
+        the callbacks itself, so there is no next_timeout or run_due.
+
+        args:
+            loop (asyncio.AbstractEventLoop): The loop to schedule callbacks on.
+        '''
+        self.loop = loop
+        self.handles = {}  # key -> asyncio.TimerHandle, for every callback still pending
+        self.counter = itertools.count()
+
+    def call_later(self, delay, callback, *args):
+        '''
+        Schedule callback(*args) to run after delay seconds. Returns a handle for cancel.
+
+        args:
+            delay (float): Seconds from now.
+            callback (callable): The function to run.
+        '''
+        key = next(self.counter)
+        self.handles[key] = self.loop.call_later(delay, self.run, key, callback, args)
+        return key
+
+    def run(self, key, callback, args):
+        if self.handles.pop(key, None) is not None:
+            callback(*args)
+
+    def cancel(self, handle):
+        '''
+        Prevent a scheduled callback from running.
+
+        args:
+            handle (int): The handle returned by call_later.
+        '''
+        timer = self.handles.pop(handle, None)
+        if timer is not None:
+            timer.cancel()
+
+    def clear(self):
+        '''
+        Cancel every scheduled callback.
+        '''
+        for timer in self.handles.values():
+            timer.cancel()
+        self.handles.clear()
+
+
+class ScopedTimers(object):
+    def __init__(self, timers, scope):
+        '''
+        Schedule callbacks on the client's timers so that each one runs inside a scope,
+        such as the room it was scheduled for.
+
+        args:
+            timers (callable): Returns the timer queue to schedule on. It is looked up on
+                every call, since the client swaps queues when a session starts and ends.
+            scope (callable): Returns the context manager each callback runs in.
+        '''
+        self.timers = timers
+        self.scope = scope
+
+    def call_later(self, delay, callback, *args):
+        '''
+        Schedule callback(*args) to run after delay seconds. Returns a handle for cancel.
+
+        args:
+            delay (float): Seconds from now.
+            callback (callable): The function to run.
+        '''
+        return self.timers().call_later(delay, self.run, callback, args)
+
+    def run(self, callback, args):
+        with self.scope():
+            callback(*args)
+
+    def cancel(self, handle):
+        self.timers().cancel(handle)
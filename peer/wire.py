@@ -0,0 +1,203 @@
+import hashlib
+import json
+import struct
+
+
+# Compact binary encoding for the datagrams sent most often: chat messages and the reliable
+# transport's rel_data and rel_ack frames. Every other datagram stays JSON.
+#
+# A binary datagram starts with MAGIC, which can never begin a JSON object, so receivers
+# tell the formats apart per datagram. It is followed by a header holding the message
+# type, the sender's port and a sequence number, then a type-specific body:
+#
+#     chat:      room id, clock entry count, (port, count) per entry, user length, user, body
+#     chat_delta: the same as chat, but the clock only holds the entries that changed
+#     rel_data:  epoch, base sequence, payload (itself a binary or JSON datagram)
+#     rel_ack:   epoch, selective ack range count, (first, last) per range,
+#                NACK count, one sequence number per NACK
+#
+# Clients advertise CODEC in the codecs list of their join message, and peers only
+# send binary datagrams to clients that advertised it or sent them one.
+#
+# A client can be in several rooms over one socket, so datagrams about a room carry its
+# room id, a 32-bit hash of the room's name. JSON datagrams have it as "room_id". A room id
+# of 0 in a binary chat means none was given.
+
+MAGIC = 0xB1
+HEADER = struct.Struct("!BBHI")  # magic, type, sender port, sequence number
+CLOCK_ENTRY = struct.Struct("!HI")
+COUNT = struct.Struct("!H")
+RANGE = struct.Struct("!II")
+SEQUENCE = struct.Struct("!I")
+ROOM = struct.Struct("!I")
+EPOCH_SIZE = 4
+
+CHAT = 1
+REL_DATA = 2
+REL_ACK = 3
+CHAT_DELTA = 4
+
+CODEC = "binary2"
+
+
+def room_id(room):
+    '''
+    Returns the 32-bit id datagrams use to name a room.
+
+    args:
+        room (str): The room's name.
+    '''
+    return int.from_bytes(hashlib.md5(room.encode('utf-8')).digest()[:ROOM.size], "big") or 1
+
+
+def is_binary(data):
+    '''
+    Returns True if a datagram uses the binary encoding.
+
+    args:
+        data (bytes): The datagram.
+    '''
+    return len(data) > 0 and data[0] == MAGIC
+
+
+def encode_chat(msg, sender_port):
+    '''
+    Encode a chat message. Returns None if it cannot be represented, in which case the
+    caller sends it as JSON.
+
+    args:
+        msg (dict): The chat message, with "user", "body", "sequence_number", either
+            "message_clock" or "clock_delta", and optionally "room_id".
+        sender_port (int): This client's port.
+    '''
+    try:
+        user = msg["user"].encode('utf-8')
+        if len(user) > 255:
+            return None
+        if "clock_delta" in msg:
+            kind, clock = CHAT_DELTA, msg["clock_delta"]
+        else:
+            kind, clock = CHAT, msg["message_clock"]
+        parts = [
+            HEADER.pack(MAGIC, kind, sender_port, msg["sequence_number"]),
+            ROOM.pack(msg.get("room_id", 0)),
+            COUNT.pack(len(clock))
+        ]
+        for port, count in clock.items():
+            parts.append(CLOCK_ENTRY.pack(int(port), count))
+        parts.append(bytes([len(user)]))
+        parts.append(user)
+        parts.append(msg["body"].encode('utf-8'))
+    except (KeyError, ValueError, struct.error):
+        return None
+    return b"".join(parts)
+
+
+def encode_rel_data(epoch, seq, base, payload):
+    '''
+    Encode a reliable transport data frame. Returns None if it cannot be represented.
+
+    args:
+        epoch (str): The sender's epoch, as 8 hex digits.
+        seq (int): The frame's sequence number.
+        base (int): The lowest sequence number the sender may still retransmit.
+        payload (bytes): The encoded datagram being carried.
+    '''
+    try:
+        epoch_bytes = bytes.fromhex(epoch)
+        if len(epoch_bytes) != EPOCH_SIZE:
+            return None
+        return HEADER.pack(MAGIC, REL_DATA, 0, seq) + epoch_bytes + SEQUENCE.pack(base) + payload
+    except (ValueError, struct.error):
+        return None
+
+
+def encode_rel_ack(ack):
+    '''
+    Encode a reliable transport ack. Returns None if it cannot be represented.
+
+    args:
+        ack (dict): The rel_ack message, with "epoch", "cum", "sack" and "nack".
+    '''
+    try:
+        epoch_bytes = bytes.fromhex(ack["epoch"])
+        if len(epoch_bytes) != EPOCH_SIZE:
+            return None
+        parts = [HEADER.pack(MAGIC, REL_ACK, 0, ack["cum"]), epoch_bytes, COUNT.pack(len(ack["sack"]))]
+        parts.extend(RANGE.pack(first, last) for first, last in ack["sack"])
+        parts.append(COUNT.pack(len(ack["nack"])))
+        parts.extend(SEQUENCE.pack(seq) for seq in ack["nack"])
+    except (KeyError, ValueError, struct.error):
+        return None
+    return b"".join(parts)
+
+
+def decode(data):
+    '''
+    Decode a binary or JSON datagram into the same dict either way.
+
+    Raises ValueError for a malformed datagram.
+
+    args:
+        data (bytes): The datagram.
+    '''
+    if not is_binary(data):
+        return json.loads(data.decode('utf-8'))
+    try:
+        return decode_binary(data)
+    except (IndexError, struct.error) as e:
+        raise ValueError(f"Truncated binary datagram: {e}")
+
+
+def decode_binary(data):
+    _, kind, sender_port, seq = HEADER.unpack_from(data)
+    offset = HEADER.size
+
+    if kind == CHAT or kind == CHAT_DELTA:
+        (room,) = ROOM.unpack_from(data, offset)
+        offset += ROOM.size
+        (entries,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        clock = {}
+        for _ in range(entries):
+            port, count = CLOCK_ENTRY.unpack_from(data, offset)
+            offset += CLOCK_ENTRY.size
+            clock[str(port)] = count
+        user_length = data[offset]
+        offset += 1
+        user = data[offset:offset + user_length].decode('utf-8')
+        offset += user_length
+        msg = {
+            "user": user,
+            "body": data[offset:].decode('utf-8'),
+            "message_clock" if kind == CHAT else "clock_delta": clock,
+            "type": "chat",
+            "message_id": f"{sender_port}_{seq}",
+            "sequence_number": seq
+        }
+        if room:
+            msg["room_id"] = room
+        return msg
+
+    if kind == REL_DATA:
+        epoch = data[offset:offset + EPOCH_SIZE].hex()
+        (base,) = SEQUENCE.unpack_from(data, offset + EPOCH_SIZE)
+        payload = data[offset + EPOCH_SIZE + SEQUENCE.size:]
+        return {"type": "rel_data", "epoch": epoch, "seq": seq, "base": base, "payload": decode(payload)}
+
+    if kind == REL_ACK:
+        epoch = data[offset:offset + EPOCH_SIZE].hex()
+        offset += EPOCH_SIZE
+        (ranges,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        sack = []
+        for _ in range(ranges):
+            first, last = RANGE.unpack_from(data, offset)
+            offset += RANGE.size
+            sack.append([first, last])
+        (nacks,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        nack = [SEQUENCE.unpack_from(data, offset + i * SEQUENCE.size)[0] for i in range(nacks)]
+        return {"type": "rel_ack", "epoch": epoch, "cum": seq, "sack": sack, "nack": nack}
+
+    raise ValueError(f"Unknown binary message type {kind}")
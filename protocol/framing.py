@@ -0,0 +1,131 @@
+import asyncio
+import json
+import struct
+
+# Every framed message is a 4-byte big-endian length followed by that many bytes of
+# UTF-8 JSON. Frames are capped below 16 MiB so the first byte of a framed connection
+# is always 0x00, which lets the server tell it apart from a legacy one-shot request
+# (a bare JSON object, whose first byte is '{').
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = (1 << 24) - 1
+LEGACY_FIRST_BYTE = b"{"
+
+
+class FrameError(Exception):
+    '''
+    Raised when a peer sends a frame that cannot be decoded.
+    '''
+    pass
+
+
+def is_legacy(first_byte):
+    '''
+    Returns True if a connection starting with first_byte speaks the one-shot JSON protocol.
+
+    args:
+        first_byte (bytes): The first byte read from the connection.
+    '''
+    return first_byte == LEGACY_FIRST_BYTE
+
+
+def encode_frame(message):
+    '''
+    Encode a message as a length-prefixed frame.
+
+    args:
+        message (dict): The JSON-serializable message to encode.
+    '''
+    payload = json.dumps(message).encode("utf-8")
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {len(payload)} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    return HEADER.pack(len(payload)) + payload
+
+
+def decode_payload(payload):
+    '''
+    Decode the body of a frame.
+
+    args:
+        payload (bytes): The bytes following the length header.
+    '''
+    try:
+        return json.loads(payload.decode("utf-8"))
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise FrameError(f"Invalid frame payload: {e}")
+
+
+def recv_exactly(sock, size):
+    '''
+    Read exactly size bytes from a blocking socket. Returns None if the peer closes
+    the connection before any byte is read.
+
+    args:
+        sock (socket): The connected socket to read from.
+        size (int): The number of bytes to read.
+    '''
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            if remaining == size:
+                return None
+            raise ConnectionError("Connection closed in the middle of a frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_frame(sock, message):
+    '''
+    Send one framed message over a blocking socket.
+
+    args:
+        sock (socket): The connected socket to write to.
+        message (dict): The message to send.
+    '''
+    sock.sendall(encode_frame(message))
+
+
+def recv_frame(sock):
+    '''
+    Read one framed message from a blocking socket. Returns None on a clean close.
+
+    args:
+        sock (socket): The connected socket to read from.
+    '''
+    header = recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {size} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    payload = recv_exactly(sock, size) if size else b""
+    if payload is None:
+        raise ConnectionError("Connection closed in the middle of a frame")
+    return decode_payload(payload)
+
+
+async def read_frame(reader, header=None):
+    '''
+    Read one framed message from an asyncio stream. Returns None on a clean close.
+
+    args:
+        reader (asyncio.StreamReader): The stream to read from.
+        header (bytes): Any header bytes that were already consumed from the stream.
+    '''
+    header = header or b""
+    try:
+        header += await reader.readexactly(HEADER.size - len(header))
+    except asyncio.IncompleteReadError as e:
+        if not header and not e.partial:
+            return None
+        raise ConnectionError("Connection closed in the middle of a frame")
+    (size,) = HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {size} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    try:
+        payload = await reader.readexactly(size) if size else b""
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Connection closed in the middle of a frame")
+    return decode_payload(payload)
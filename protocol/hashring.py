@@ -0,0 +1,52 @@
+import hashlib
+from bisect import bisect_right
+
+
+def parse_node(node):
+    '''
+    Split a "host:port" node name into an (address, port) tuple.
+
+    args:
+        node (str): The node name.
+    '''
+    host, _, port = node.rpartition(":")
+    return (host, int(port))
+
+
+def hash_key(key):
+    '''
+    Map a string onto the hash ring.
+
+    args:
+        key (str): The room name or virtual node label to hash.
+    '''
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing(object):
+    def __init__(self, nodes, replicas=100):
+        '''
+        Create a consistent hash ring over NameServer nodes. Each node is placed on the
+        ring replicas times, so rooms spread evenly and adding or removing a node only
+        moves the rooms on its own arcs.
+
+        args:
+            nodes (list): Node names in "host:port" form.
+            replicas (int): Virtual points per node.
+        '''
+        self.nodes = sorted(set(nodes))
+        if not self.nodes:
+            raise ValueError("A hash ring needs at least one node")
+        self.ring = sorted((hash_key(f"{node}#{replica}"), node)
+                           for node in self.nodes for replica in range(replicas))
+        self.keys = [point for point, _ in self.ring]
+
+    def node_for(self, room_name):
+        '''
+        Returns the node that owns a room.
+
+        args:
+            room_name (str): The room to look up.
+        '''
+        index = bisect_right(self.keys, hash_key(room_name)) % len(self.ring)
+        return self.ring[index][1]
@@ -1,262 +1,638 @@
 import socket
 import json
-import time
-import os
-from datetime import datetime
+import asyncio
+import argparse
+import select
+from protocol import framing
+from protocol.hashring import HashRing
+from nameserver.wal import WriteAheadLog
+from nameserver.verifier import RoomVerifier
+from nameserver.membership import RoomDirectory
+from nameserver.sharding import ShardForwarder
+from nameserver.replication import ReplicationManager
+
+MUTATING_ACTIONS = ("join", "create", "update_room", "leave")
 
 class NameServer(object):
-    def __init__(self):
+    def __init__(self, read_timeout=10.0, backlog=1024, idle_timeout=300.0,
+                 log_file="server_log.json", snapshot_file="server_snapshot.json",
+                 fsync_policy="batch", snapshot_every=1000, cluster=None, node_id=None,
+                 replicas=None):
         '''
         Create a NameServer object with logging capabilities.
+
+        args:
+            read_timeout (float): Seconds the async server waits for a client's request.
+            backlog (int): Maximum number of pending connections queued by the listener.
+            idle_timeout (float): Seconds a long-lived framed connection may sit idle.
+            log_file (str): Path of the write-ahead log of room mutations.
+            snapshot_file (str): Path of the periodic full-state snapshot.
+            fsync_policy (str): When log records are fsynced ("always", "batch" or "never").
+            snapshot_every (int): Log records between snapshots.
+            cluster (list): "host:port" names of every node in a sharded cluster, or None to
+                own every room.
+            node_id (str): This node's own "host:port" name within the cluster.
+            replicas (list): "host:port" names of every replica of this server, in failover
+                priority order, or None to run without replication.
         '''
-        self.rooms = {}
-        self.log_file = "server_log.json"
+        self.rooms = RoomDirectory()
+        self.unverified = {}  # Recovered rooms still being verified, mapped to their stored members
+        self.verifier = RoomVerifier()
+        self.read_timeout = read_timeout
+        self.backlog = backlog
+        self.idle_timeout = idle_timeout
+        self.max_request_size = 1 << 20
+        self.max_page_size = 500
+        self.ring = HashRing(cluster) if cluster else None
+        self.node_id = node_id
+        self.forwarder = ShardForwarder()
+        if self.ring and node_id not in self.ring.nodes:
+            raise ValueError(f"Node {node_id} is not part of the cluster {self.ring.nodes}")
+        self.replication = ReplicationManager(self, replicas, node_id) if replicas else None
+        self.log_file = log_file
+        self.wal = WriteAheadLog(log_file, snapshot_file, fsync_policy=fsync_policy,
+                                 snapshot_every=snapshot_every)
         self.load_state()
 
-    def log_state(self):
+    def log_state(self, op, room_name, **fields):
         '''
-        Log the current state of rooms to a JSON file with timestamp.
+        Record a single room mutation in the write-ahead log, compacting the log into a
+        fresh snapshot once it has grown long enough.
+
+        args:
+            op (str): The mutation type ("create", "join", "leave", "update" or "delete").
+            room_name (str): The room that was mutated.
+            fields: Mutation-specific fields, such as member or members.
         '''
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "rooms": self.rooms
-        }
-        
-        # Append to log file
         try:
-            with open(self.log_file, 'a') as f:
-                f.write(json.dumps(log_entry) + '\n')
+            record = self.wal.append(op, room_name, **fields)
+            if self.replication:
+                self.replication.replicate(record)
+            if self.wal.needs_compaction():
+                self.wal.compact(self.rooms.snapshot())
         except Exception as e:
             print(f"Error writing to log: {e}")
 
-    def load_state(self):
+    def load_replicated_snapshot(self, snapshot):
         '''
-        Load the most recent state from the log file and verify rooms.
+        Replace this follower's state with a snapshot streamed from the primary.
+
+        args:
+            snapshot (dict): The snapshot frame, with the seq it covers and its rooms.
         '''
-        if not os.path.exists(self.log_file):
-            print("No previous state found.")
-            return
+        self.rooms.load({room_name: [tuple(member) for member in members]
+                         for room_name, members in snapshot["rooms"].items()})
+        self.unverified = {}
+        self.wal.seq = snapshot["seq"]
+        try:
+            self.wal.compact(self.rooms.snapshot())
+        except Exception as e:
+            print(f"Error writing snapshot: {e}")
 
+    def apply_replicated(self, record):
+        '''
+        Apply and log one mutation record streamed from the primary.
+
+        args:
+            record (dict): The primary's write-ahead log record.
+        '''
+        self.rooms.apply(record)
         try:
-            # Read the last line of the log file
-            with open(self.log_file, 'r') as f:
-                last_line = None
-                for line in f:
-                    if line.strip():
-                        last_line = line
-                
-                if last_line:
-                    state = json.loads(last_line)
-                    stored_rooms = state.get("rooms", {})
-                    
-                    # Try to verify each room with all its clients
-                    for room_name, clients in stored_rooms.items():
-                        if clients:
-                            if self.verify_room(room_name, clients):
-                                print(f"Successfully recovered room: {room_name}")
-                            else:
-                                print(f"Room {room_name} is no longer active")
-                        else:
-                            print(f"Room {room_name} had no clients - removing")
-                            if room_name in self.rooms:
-                                del self.rooms[room_name]
+            self.wal.write(record)
+            if self.wal.needs_compaction():
+                self.wal.compact(self.rooms.snapshot())
+        except Exception as e:
+            print(f"Error writing to log: {e}")
 
+    def on_promoted(self):
+        '''
+        Called when this replica becomes the primary. Its replicated state is already
+        current; only rooms recovered from its own disk still need verifying.
+        '''
+        if self.unverified:
+            asyncio.get_running_loop().create_task(self.verify_rooms())
+
+    def load_state(self):
+        '''
+        Load the most recent state from the snapshot and log. Recovered rooms are served
+        straight away but stay marked unverified until verify_rooms has probed them.
+        '''
+        try:
+            stored_rooms = self.wal.recover()
         except Exception as e:
             print(f"Error loading state: {e}")
+            return
+
+        if not stored_rooms:
+            print("No previous state found.")
+
+        for room_name, clients in stored_rooms.items():
+            if clients:
+                self.rooms.replace(room_name, clients)
+                self.unverified[room_name] = set(clients)
+            else:
+                print(f"Room {room_name} had no clients - removing")
 
-    def verify_room(self, room_name, clients):
+    async def verify_rooms(self):
         '''
-        Verify a room's existence by trying to contact each client until one responds.
-        
-        args:
-            room_name (str): Name of the room to verify
-            clients (list): List of (address, port) tuples for all clients in the room
+        Verify every recovered room concurrently, then compact the log so the verified
+        state becomes the new snapshot.
         '''
+        if self.unverified:
+            print(f"Verifying {len(self.unverified)} recovered room(s)...")
+            rooms = {room_name: list(clients) for room_name, clients in self.unverified.items()}
+            try:
+                await self.verifier.verify_all(rooms, self.finish_verification)
+            except Exception as e:
+                print(f"Error in room verification: {e}")
+
         try:
-            # Create UDP socket for verification
-            verify_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            verify_socket.settimeout(2)  # Short timeout for each attempt
-
-            # Try each client until we get a response
-            for client in clients:
-                try:
-                    # Send verification request
-                    verify_msg = {
-                        "type": "room_verify",
-                        "room": room_name
-                    }
-                    verify_socket.sendto(json.dumps(verify_msg).encode('utf-8'), tuple(client))
-
-                    # Wait for response
-                    data, _ = verify_socket.recvfrom(1024)
-                    response = json.loads(data.decode('utf-8'))
-                    
-                    if response.get("type") == "room_verify_response" and response.get("room") == room_name:
-                        # Update room with latest peer list
-                        if "active_clients" in response:
-                            self.rooms[room_name] = response["active_clients"]
-                            print(f"Updated room {room_name} with current peer list")
-                            return True
-
-                except socket.timeout:
-                    print(f"No response from client {client} in room {room_name}")
-                    continue
-                except Exception as e:
-                    print(f"Error verifying with client {client}: {e}")
-                    continue
+            self.wal.compact(self.rooms.snapshot())
+        except Exception as e:
+            print(f"Error writing snapshot: {e}")
+
+    def finish_verification(self, room_name, active_clients):
+        '''
+        Apply the outcome of verifying one recovered room. Members that joined while the
+        room was unverified are kept either way; the stored members are replaced by the
+        live peer list, or dropped if nobody answered.
+
+        args:
+            room_name (str): Name of the verified room.
+            active_clients (list): The peer list reported by a live client, or None.
+        '''
+        stored_clients = self.unverified.pop(room_name, None)
+        if stored_clients is None or room_name not in self.rooms:
+            return
 
-            # If we get here, no clients responded
+        joined_since = [client for client in self.rooms.members(room_name) if client not in stored_clients]
+        if active_clients is not None:
+            members = list(active_clients) + [client for client in joined_since if client not in active_clients]
+            print(f"Successfully recovered room: {room_name}")
+        else:
+            members = joined_since
             print(f"No clients responded in room {room_name} - closing room")
+
+        if members:
+            self.rooms.replace(room_name, members)
+            self.log_state("update", room_name, members=members)
+        else:
+            self.rooms.delete(room_name)
+            self.log_state("delete", room_name)
+
+    def handle_request(self, parsed_message, client_address):
+        '''
+        Apply a single parsed client request to the room state and build its response.
+
+        args:
+            parsed_message (dict): The decoded JSON request sent by the client.
+            client_address (tuple): The (address, port) the request arrived from.
+        '''
+        action = parsed_message["action"]
+
+        if action in MUTATING_ACTIONS and self.replication and not self.replication.is_primary():
+            return {
+                "status": "error",
+                "message": "Not the primary",
+                "primary": self.replication.primary
+            }
+
+        if action == "list":
+            print(f"{client_address} requested to list rooms")
+            if "limit" in parsed_message:
+                response = self.list_page(parsed_message)
+            elif self.rooms:
+                response = {
+                    "status": "success",
+                    "message": "Retrieved available rooms",
+                    "rooms": {
+                        room_name: {
+                            "member_count": member_count,
+                            "verified": room_name not in self.unverified
+                        }
+                        for room_name, member_count in self.rooms.member_counts().items()
+                    }
+                }
+            else:
+                response = {
+                    "status": "success",
+                    "message": "There are no active rooms available"
+                }
+
+        elif action == "join":
+            room_name = parsed_message["room"]
+            print(f"{client_address} requested to join room: {room_name}")
+            if room_name in self.rooms:
+                member = self.member_address(parsed_message, client_address)
+                joined = self.rooms.join(room_name, member)
+                response = {
+                    "status": "success",
+                    "message": f"Successfully joined room '{room_name}'",
+                    "ips": self.rooms.members(room_name)
+                }
+                if joined:
+                    self.log_state("join", room_name, member=member)  # Log after join
+            else:
+                response = {
+                    "status": "failure",
+                    "message": f"Room {room_name} does not exist"
+                }
+
+        elif action == "create":
+            room_name = parsed_message["room"]
+            print(f"{client_address} requested to create room: {room_name}")
+            if room_name:
+                member = self.member_address(parsed_message, client_address)
+                self.rooms.create(room_name, member)
+                response = {
+                    "status": "success",
+                    "message": f"Successfully created room '{room_name}'"
+                }
+                self.log_state("create", room_name, member=member)  # Log after creation
+            else:
+                response = {
+                    "status": "error",
+                    "message": "Invalid request format"
+                }
+
+        elif action == "update_room":
+            room_name = parsed_message["room"]
+            active_clients = parsed_message["active_clients"]
+            print(f"{client_address} sent updated client list for room: {room_name}")
+
+            if room_name in self.rooms:
+                self.rooms.replace(room_name, [tuple(client) for client in active_clients])
+                self.unverified.pop(room_name, None)  # A live client just vouched for the room
+                response = {
+                    "status": "success",
+                    "message": f"Successfully updated room '{room_name}'"
+                }
+                self.log_state("update", room_name, members=self.rooms.members(room_name))  # Log after update
+            else:
+                response = {
+                    "status": "error",
+                    "message": f"Room {room_name} does not exist"
+                }
+
+        elif action == "leave":
+            room_name = parsed_message["room"]
+            original_address = parsed_message["original_address"]
+            original_port = parsed_message["original_port"]
+            original_client = (original_address, original_port)
+            print(f"Client {original_client} requested to leave room {room_name}")
+
             if room_name in self.rooms:
-                del self.rooms[room_name]
-            return False
+                if self.rooms.leave(room_name, original_client):
+                    response = {
+                        "status": "success",
+                        "message": f"Successfully left room '{room_name}'"
+                    }
+                    self.log_state("leave", room_name, member=original_client)  # Log after leave
+                else:
+                    response = {
+                        "status": "error",
+                        "message": f"Client {original_client} not found in room {room_name}"
+                    }
+            else:
+                response = {
+                    "status": "error",
+                    "message": f"Room {room_name} does not exist"
+                }
+
+        elif action == "cluster":
+            response = {
+                "status": "success",
+                "message": "Retrieved cluster nodes",
+                "nodes": self.ring.nodes if self.ring else []
+            }
+
+        else:
+            response = {
+                "status": "error",
+                "message": f"Unknown action '{action}'"
+            }
+
+        return response
+
+    def list_page(self, parsed_message):
+        '''
+        Build the response for a paginated list request. The page is read from the room
+        directory's sorted indexes, and next_cursor is null once the last page is reached.
+
+        args:
+            parsed_message (dict): The list request, with limit and the optional cursor,
+                prefix, contains and sort fields.
+        '''
+        try:
+            limit = max(1, min(int(parsed_message["limit"]), self.max_page_size))
+            page, next_cursor = self.rooms.page(
+                limit,
+                cursor=parsed_message.get("cursor"),
+                prefix=parsed_message.get("prefix"),
+                contains=parsed_message.get("contains"),
+                sort=parsed_message.get("sort", "name")
+            )
+        except ValueError as e:
+            return {
+                "status": "error",
+                "message": f"Invalid list request: {e}"
+            }
+
+        return {
+            "status": "success",
+            "message": "Retrieved available rooms",
+            "rooms": {
+                room_name: {
+                    "member_count": member_count,
+                    "verified": room_name not in self.unverified
+                }
+                for room_name, member_count in page
+            },
+            "next_cursor": next_cursor
+        }
+
+    def member_address(self, parsed_message, client_address):
+        '''
+        Returns the peer address a join or create request should be recorded under. Clients
+        on a long-lived connection announce their UDP endpoint explicitly; older clients are
+        identified by the address of the connection itself.
+
+        args:
+            parsed_message (dict): The decoded join or create request.
+            client_address (tuple): The (address, port) the request arrived from.
+        '''
+        if "port" in parsed_message:
+            return (parsed_message.get("address") or client_address[0], parsed_message["port"])
+        return tuple(client_address)
+
+    def owner_of(self, parsed_message):
+        '''
+        Returns the node a request must be forwarded to, or None if this node handles it.
+        Requests that were already forwarded once are always handled locally.
+
+        args:
+            parsed_message (dict): The decoded request.
+        '''
+        if not self.ring or not isinstance(parsed_message, dict):
+            return None
+        if parsed_message.get("forwarded") or not isinstance(parsed_message.get("room"), str):
+            return None
+        owner = self.ring.node_for(parsed_message["room"])
+        return None if owner == self.node_id else owner
+
+    def forwarded_request(self, parsed_message, client_address):
+        '''
+        Returns a copy of a request ready to forward to the owning node. Requests from
+        clients that rely on their connection address carry that address explicitly.
+
+        args:
+            parsed_message (dict): The decoded request.
+            client_address (tuple): The (address, port) the request arrived from.
+        '''
+        request = dict(parsed_message, forwarded=True)
+        if request.get("action") in ("join", "create") and "port" not in request:
+            request["address"], request["port"] = client_address
+        return request
+
+    def lists_cluster(self, parsed_message):
+        '''
+        Returns True if a request is a one-shot list that must cover every shard. Paged
+        lists are merged by the client, which pages through each node itself.
+
+        args:
+            parsed_message (dict): The decoded request.
+        '''
+        return (
+            bool(self.ring) and isinstance(parsed_message, dict)
+            and parsed_message.get("action") == "list"
+            and "limit" not in parsed_message and not parsed_message.get("forwarded")
+        )
 
+    def merge_lists(self, parsed_message, responses):
+        '''
+        Combine every shard's answer to a one-shot list into one response. If any shard
+        could not answer, the whole list is an error rather than a partial directory.
+
+        args:
+            parsed_message (dict): The original list request.
+            responses (dict): Each node's response, or the exception forwarding to it raised.
+        '''
+        rooms = {}
+        for node, response in responses.items():
+            if isinstance(response, Exception) or response.get("status") != "success":
+                print(f"Error listing rooms on {node}: {response}")
+                response = {
+                    "status": "error",
+                    "message": f"Shard {node} is unavailable, so the room list would be incomplete"
+                }
+                break
+            rooms.update(response.get("rooms", {}))
+        else:
+            if rooms:
+                response = {
+                    "status": "success",
+                    "message": "Retrieved available rooms",
+                    "rooms": dict(sorted(rooms.items()))
+                }
+            else:
+                response = {
+                    "status": "success",
+                    "message": "There are no active rooms available"
+                }
+
+        if "request_id" in parsed_message:
+            response["request_id"] = parsed_message["request_id"]
+        return response
+
+    async def route(self, parsed_message, client_address):
+        '''
+        Handle a decoded request on the event loop, forwarding it to the node that owns
+        its room when this server is one shard of a cluster. A one-shot list is sent to
+        every shard and the results merged.
+
+        args:
+            parsed_message (dict): The decoded request.
+            client_address (tuple): The (address, port) the request arrived from.
+        '''
+        if self.lists_cluster(parsed_message):
+            request = dict(parsed_message, forwarded=True)
+            nodes = [node for node in self.ring.nodes if node != self.node_id]
+            answers = await asyncio.gather(
+                *(self.forwarder.forward(node, request) for node in nodes), return_exceptions=True
+            )
+            responses = {self.node_id: self.dispatch(request, client_address)}
+            responses.update(zip(nodes, answers))
+            return self.merge_lists(parsed_message, responses)
+
+        owner = self.owner_of(parsed_message)
+        if owner is None:
+            return self.dispatch(parsed_message, client_address)
+        try:
+            return await self.forwarder.forward(owner, self.forwarded_request(parsed_message, client_address))
         except Exception as e:
-            print(f"Error in room verification: {e}")
-            return False
-        finally:
-            verify_socket.close()
+            print(f"Error forwarding to {owner}: {e}")
+            return self.unavailable(owner, parsed_message)
+
+    def unavailable(self, owner, parsed_message):
+        '''
+        Returns the error response for a request whose owning node could not be reached.
+
+        args:
+            owner (str): The node that owns the request's room.
+            parsed_message (dict): The decoded request.
+        '''
+        response = {
+            "status": "error",
+            "message": f"Shard {owner} owning room '{parsed_message['room']}' is unavailable"
+        }
+        if "request_id" in parsed_message:
+            response["request_id"] = parsed_message["request_id"]
+        return response
+
+    def dispatch(self, parsed_message, client_address):
+        '''
+        Handle a decoded request, turning malformed requests into error responses and
+        echoing the request_id used to match pipelined responses. Requests for rooms owned
+        by another node are forwarded to it over a blocking connection, and a one-shot
+        list is sent to every shard and the results merged.
+
+        args:
+            parsed_message (dict): The decoded request.
+            client_address (tuple): The (address, port) the request arrived from.
+        '''
+        if self.lists_cluster(parsed_message):
+            request = dict(parsed_message, forwarded=True)
+            responses = {self.node_id: self.dispatch(request, client_address)}
+            for node in self.ring.nodes:
+                if node != self.node_id:
+                    try:
+                        responses[node] = self.forwarder.forward_blocking(node, request)
+                    except Exception as e:
+                        responses[node] = e
+            return self.merge_lists(parsed_message, responses)
+
+        owner = self.owner_of(parsed_message)
+        if owner is not None:
+            try:
+                return self.forwarder.forward_blocking(owner, self.forwarded_request(parsed_message, client_address))
+            except Exception as e:
+                print(f"Error forwarding to {owner}: {e}")
+                return self.unavailable(owner, parsed_message)
+
+        try:
+            response = self.handle_request(parsed_message, client_address)
+        except KeyError as e:
+            response = {
+                "status": "error",
+                "message": f"Missing field {e} in request"
+            }
+        except (TypeError, AttributeError):
+            response = {
+                "status": "error",
+                "message": "Invalid request format"
+            }
+
+        if isinstance(parsed_message, dict) and "request_id" in parsed_message:
+            response["request_id"] = parsed_message["request_id"]
+        return response
+
+    def handle_message(self, message, client_address):
+        '''
+        Decode a raw one-shot JSON request and return the encoded response.
+
+        args:
+            message (str): The raw request text received from the client.
+            client_address (tuple): The (address, port) the request arrived from.
+        '''
+        try:
+            parsed_message = json.loads(message)
+            print(f"Parsed message: {parsed_message}")
+            response = self.dispatch(parsed_message, client_address)
+        except json.JSONDecodeError:
+            response = {
+                "status": "error",
+                "message": "Invalid JSON format"
+            }
+
+        return json.dumps(response)
+
+    def recv_legacy(self, client_socket):
+        '''
+        Read a one-shot request from a blocking connection until it forms a complete JSON
+        document, as serve_legacy does on the event loop, so a message split across several
+        TCP segments is handled correctly. Returns the request text.
+
+        args:
+            client_socket (socket): The client's connection, with a read timeout set.
+        '''
+        buffer = b""
+        while len(buffer) <= self.max_request_size:
+            chunk = client_socket.recv(4096)
+            if not chunk:
+                break
+            buffer += chunk
+            try:
+                json.loads(buffer.decode("utf-8"))
+                break
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                pass
+        return buffer.decode("utf-8", errors="replace")
 
     def start_server(self, hostname, port):
         '''
-        Starts the server.
+        Starts the server in blocking mode, handling one connection at a time. Framed
+        connections are closed once the requests already sent on them are answered.
 
         args:
             hostname (str): The IP address of the central server that stores room information.
             port (int): The port where the central server is running. 
         '''
+        if self.replication:
+            raise ValueError("Replication requires the async server mode")
+
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server_socket.bind((hostname, port))
         server_socket.listen(1)
+        server_socket.settimeout(self.wal.batch_interval)
+
+        # Verification runs up front here, since this loop cannot serve in the meantime
+        asyncio.run(self.verify_rooms())
         print(f"Server listening on {hostname}:{port}")
 
         while True:
-            print("Waiting for a connection...")
-            client_socket, client_address = server_socket.accept()
+            try:
+                client_socket, client_address = server_socket.accept()
+            except socket.timeout:
+                # Idle: make sure batched log records reach the disk
+                self.wal.sync_if_due()
+                continue
             print(f"Connection established with {client_address}")
             
             try:
-                message = client_socket.recv(4096).decode("utf-8")
-                if not message:
+                client_socket.settimeout(self.read_timeout)
+                first_byte = client_socket.recv(1, socket.MSG_PEEK)
+                if not first_byte:
                     print("No data received. Closing connection.")
-                    client_socket.close()
                     continue
 
-                try:
-                    parsed_message = json.loads(message)
-                    print(f"Parsed message: {parsed_message}")
-                    action = parsed_message["action"]
-
-                    if action == "list":
-                        print(f"{client_address} requested to list rooms")
-                        if self.rooms:
-                            response = {
-                                "status": "success",
-                                "message": "Retrieved available rooms",
-                                "rooms": {
-                                    room_name: {
-                                        "member_count": len(members)
-                                    }
-                                    for room_name, members in self.rooms.items()
-                                }
-                            }
-                        else:
-                            response = {
-                                "status": "success",
-                                "message": "There are no active rooms available"
-                            }
-
-                    elif action == "join":
-                        room_name = parsed_message["room"]
-                        print(f"{client_address} requested to join room: {room_name}")
-                        if room_name in self.rooms:
-                            self.rooms[room_name].append(client_address)
-                            response = {
-                                "status": "success",
-                                "message": f"Successfully joined room '{room_name}'",
-                                "ips": self.rooms[room_name]
-                            }
-                            self.log_state()  # Log after join
-                        else:
-                            response = {
-                                "status": "failure",
-                                "message": f"Room {room_name} does not exist"
-                            }
-
-                    elif action == "create":
-                        room_name = parsed_message["room"]
-                        print(f"{client_address} requested to create room: {room_name}")
-                        if room_name:
-                            self.rooms[room_name] = [client_address]
-                            response = {
-                                "status": "success",
-                                "message": f"Successfully created room '{room_name}'"
-                            }
-                            self.log_state()  # Log after creation
-                        else:
-                            response = {
-                                "status": "error",
-                                "message": "Invalid request format"
-                            }
-
-                    elif action == "update_room":
-                        room_name = parsed_message["room"]
-                        active_clients = parsed_message["active_clients"]
-                        print(f"{client_address} sent updated client list for room: {room_name}")
-                        
-                        if room_name in self.rooms:
-                            self.rooms[room_name] = [tuple(client) for client in active_clients]
-                            if not self.rooms[room_name]:
-                                del self.rooms[room_name]
-                            response = {
-                                "status": "success",
-                                "message": f"Successfully updated room '{room_name}'"
-                            }
-                            self.log_state()  # Log after update
-                        else:
-                            response = {
-                                "status": "error",
-                                "message": f"Room {room_name} does not exist"
-                            }
-
-                    elif action == "leave":
-                        room_name = parsed_message["room"]
-                        original_address = parsed_message["original_address"]
-                        original_port = parsed_message["original_port"]
-                        original_client = (original_address, original_port)
-                        print(f"Client {original_client} requested to leave room {room_name}")
-                        
-                        if room_name in self.rooms:
-                            if original_client in self.rooms[room_name]:
-                                self.rooms[room_name].remove(original_client)
-                                if not self.rooms[room_name]:
-                                    del self.rooms[room_name]
-                                response = {
-                                    "status": "success",
-                                    "message": f"Successfully left room '{room_name}'"
-                                }
-                                self.log_state()  # Log after leave
-                            else:
-                                response = {
-                                    "status": "error",
-                                    "message": f"Client {original_client} not found in room {room_name}"
-                                }
-                        else:
-                            response = {
-                                "status": "error",
-                                "message": f"Room {room_name} does not exist"
-                            }
-
-                except json.JSONDecodeError:
-                    response = {
-                        "status": "error",
-                        "message": "Invalid JSON format"
-                    }
-
-                response_message = json.dumps(response)
-                client_socket.sendall(response_message.encode("utf-8"))
-                print(f"Sent response to client: {response_message}")
+                if framing.is_legacy(first_byte):
+                    message = self.recv_legacy(client_socket)
+                    response_message = self.handle_message(message, client_address)
+                    client_socket.sendall(response_message.encode("utf-8"))
+                    print(f"Sent response to client: {response_message}")
+                else:
+                    # Blocking mode only answers the frames a client has already pipelined and
+                    # then closes, so one long-lived client cannot starve the others. Clients
+                    # reconnect for their next request.
+                    while True:
+                        request = framing.recv_frame(client_socket)
+                        if request is None:
+                            break
+                        framing.send_frame(client_socket, self.dispatch(request, client_address))
+                        readable, _, _ = select.select([client_socket], [], [], 0.05)
+                        if not readable:
+                            break
 
             except Exception as e:
                 print(f"An error occurred: {e}")
@@ -264,8 +640,184 @@ class NameServer(object):
                 client_socket.close()
                 print("Closed connection with client")
 
+    async def handle_connection(self, reader, writer):
+        '''
+        Serve a single client connection on the asyncio event loop. The first byte decides
+        the protocol: a bare JSON object is a legacy one-shot request, anything else starts
+        a stream of length-prefixed frames that may carry many pipelined requests.
+
+        args:
+            reader (asyncio.StreamReader): Stream to read the client's requests from.
+            writer (asyncio.StreamWriter): Stream to write responses to.
+        '''
+        client_address = writer.get_extra_info("peername")[:2]
+
+        try:
+            first_byte = await asyncio.wait_for(reader.read(1), timeout=self.read_timeout)
+            if not first_byte:
+                print(f"No data received from {client_address}. Closing connection.")
+                return
+
+            if framing.is_legacy(first_byte):
+                await self.serve_legacy(reader, writer, first_byte, client_address)
+            else:
+                await self.serve_framed(reader, writer, first_byte, client_address)
+
+        except asyncio.TimeoutError:
+            print(f"Read from {client_address} timed out")
+        except (framing.FrameError, ConnectionError) as e:
+            print(f"Dropping connection with {client_address}: {e}")
+        except Exception as e:
+            print(f"An error occurred with {client_address}: {e}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def serve_legacy(self, reader, writer, buffer, client_address):
+        '''
+        Answer a one-shot request. The request is read until it forms a complete JSON
+        document, so a message split across several TCP segments is handled correctly.
+
+        args:
+            reader (asyncio.StreamReader): Stream to read the request from.
+            writer (asyncio.StreamWriter): Stream to write the response to.
+            buffer (bytes): Bytes of the request that were already read.
+            client_address (tuple): The (address, port) of the client.
+        '''
+        while len(buffer) <= self.max_request_size:
+            try:
+                json.loads(buffer.decode("utf-8"))
+                break
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                pass
+            chunk = await asyncio.wait_for(reader.read(4096), timeout=self.read_timeout)
+            if not chunk:
+                break
+            buffer += chunk
+
+        try:
+            parsed_message = json.loads(buffer.decode("utf-8", errors="replace"))
+            print(f"Parsed message: {parsed_message}")
+            response = await self.route(parsed_message, client_address)
+        except json.JSONDecodeError:
+            response = {
+                "status": "error",
+                "message": "Invalid JSON format"
+            }
+
+        writer.write(json.dumps(response).encode("utf-8"))
+        await writer.drain()
+
+    async def serve_framed(self, reader, writer, header, client_address):
+        '''
+        Answer framed requests on a long-lived connection until the client closes it or
+        stays idle for longer than idle_timeout. Responses are written in request order.
+
+        args:
+            reader (asyncio.StreamReader): Stream to read requests from.
+            writer (asyncio.StreamWriter): Stream to write responses to.
+            header (bytes): Bytes of the first frame header that were already read.
+            client_address (tuple): The (address, port) of the client.
+        '''
+        while True:
+            request = await asyncio.wait_for(framing.read_frame(reader, header), timeout=self.idle_timeout)
+            header = None
+            if request is None:
+                return
+            if isinstance(request, dict) and request.get("action") == "replicate" and self.replication:
+                await self.replication.serve_follower(reader, writer, request)
+                return
+            writer.write(framing.encode_frame(await self.route(request, client_address)))
+            await writer.drain()
+
+    async def serve_async(self, hostname, port):
+        '''
+        Accept and serve client connections concurrently until cancelled.
+
+        args:
+            hostname (str): The IP address to listen on.
+            port (int): The port to listen on.
+        '''
+        server = await asyncio.start_server(
+            self.handle_connection, hostname, port,
+            reuse_address=True, backlog=self.backlog
+        )
+        print(f"Server listening on {hostname}:{port} (async)")
+        flusher = asyncio.create_task(self.sync_log_periodically())
+        if self.replication:
+            # Rooms are verified only if this replica ends up as the primary
+            background = asyncio.create_task(self.replication.run())
+        else:
+            background = asyncio.create_task(self.verify_rooms())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            flusher.cancel()
+            background.cancel()
+            self.wal.close()
+
+    async def sync_log_periodically(self):
+        '''
+        Fsync batched log records while the server is idle, so no record waits on disk
+        for much longer than the log's batch interval.
+        '''
+        while True:
+            await asyncio.sleep(self.wal.batch_interval)
+            self.wal.sync_if_due()
+
+    def start_async_server(self, hostname, port):
+        '''
+        Starts the server in asyncio mode, where many client connections are handled
+        concurrently and a slow client cannot block the requests queued behind it.
+
+        args:
+            hostname (str): The IP address of the central server that stores room information.
+            port (int): The port where the central server is running. 
+        '''
+        try:
+            asyncio.run(self.serve_async(hostname, port))
+        except KeyboardInterrupt:
+            print("\nServer stopped.")
+
 if __name__ == "__main__":
-    hostname = "127.0.0.1"
-    port = 12345
-    nameserver = NameServer()
-    nameserver.start_server(hostname, port)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the p2p-messenger name server.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=12345, help="Port to listen on")
+    parser.add_argument("--mode", choices=["async", "blocking"], default="async",
+                        help="Serve connections concurrently (async) or one at a time (blocking)")
+    parser.add_argument("--read-timeout", type=float, default=10.0,
+                        help="Seconds to wait for a client's request before dropping it")
+    parser.add_argument("--idle-timeout", type=float, default=300.0,
+                        help="Seconds a persistent client connection may stay idle")
+    parser.add_argument("--log-file", default=None,
+                        help="Write-ahead log of room mutations (default server_log.json, or server_log_<port>.json in a cluster)")
+    parser.add_argument("--snapshot-file", default=None,
+                        help="Periodic snapshot of all rooms (default server_snapshot.json, or server_snapshot_<port>.json in a cluster)")
+    parser.add_argument("--fsync", choices=["always", "batch", "never"], default="batch",
+                        help="Fsync every log record, batches of records, or never")
+    parser.add_argument("--snapshot-every", type=int, default=1000,
+                        help="Log records to append before compacting into a snapshot")
+    parser.add_argument("--cluster", default=None,
+                        help="Comma-separated host:port list of every node in a sharded cluster, including this one")
+    parser.add_argument("--replicas", default=None,
+                        help="Comma-separated host:port list of every replica of this server, including this one, in failover order")
+    args = parser.parse_args()
+
+    cluster = [node.strip() for node in args.cluster.split(",") if node.strip()] if args.cluster else None
+    replicas = [node.strip() for node in args.replicas.split(",") if node.strip()] if args.replicas else None
+    if cluster and replicas:
+        parser.error("--cluster and --replicas cannot be combined")
+    suffix = f"_{args.port}" if cluster or replicas else ""
+    nameserver = NameServer(read_timeout=args.read_timeout, idle_timeout=args.idle_timeout,
+                            log_file=args.log_file or f"server_log{suffix}.json",
+                            snapshot_file=args.snapshot_file or f"server_snapshot{suffix}.json",
+                            fsync_policy=args.fsync, snapshot_every=args.snapshot_every,
+                            cluster=cluster, node_id=f"{args.host}:{args.port}", replicas=replicas)
+    if args.mode == "async":
+        nameserver.start_async_server(args.host, args.port)
+    else:
+        nameserver.start_server(args.host, args.port)
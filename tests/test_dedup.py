@@ -0,0 +1,39 @@
+import unittest
+
+from peer.dedup import DedupWindow
+
+
+class DedupWindowTest(unittest.TestCase):
+    def test_duplicates_within_window(self):
+        window = DedupWindow(window=8)
+        self.assertTrue(window.add("9", 1))
+        self.assertTrue(window.add("9", 3))
+        self.assertFalse(window.add("9", 1))
+        self.assertTrue(window.add("9", 2))
+        self.assertFalse(window.add("9", 3))
+
+    def test_live_traffic_below_window_is_a_duplicate(self):
+        window = DedupWindow(window=1024)
+        window.add("9", 2000)
+        self.assertIn(("9", 5), window)
+
+    def test_recovery_below_window_is_not_seen(self):
+        window = DedupWindow(window=1024)
+        window.add("9", 5)
+        window.add("9", 2000)
+        self.assertFalse(window.seen("9", 5))
+        self.assertTrue(window.seen("9", 2000))
+        self.assertFalse(window.seen("9", 1999))
+
+    def test_large_gap_resets_bitmap(self):
+        window = DedupWindow(window=8)
+        window.add("9", 1)
+        window.add("9", 10 ** 12)
+        high_water_mark, bitmap = window.senders["9"]
+        self.assertEqual(high_water_mark, 10 ** 12)
+        self.assertEqual(bitmap, 1)
+        self.assertTrue(window.add("9", 10 ** 12 - 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import socket
+import time
+import unittest
+
+from peer.fragments import FragmentingSocket, Reassembler, is_fragment
+
+
+class CapturingSocket(object):
+    def __init__(self):
+        '''
+        Collect the datagrams sent through a socket instead of sending them.
+        '''
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append(data)
+        return len(data)
+
+
+def fragment(data, mtu=1200):
+    sock = CapturingSocket()
+    FragmentingSocket(sock, mtu).sendto(data, ("127.0.0.1", 9))
+    return sock.sent
+
+
+class FragmentsTest(unittest.TestCase):
+    def test_round_trip_over_local_sockets(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(receiver.close)
+        self.addCleanup(sender.close)
+        receiver.bind(("127.0.0.1", 0))
+        sender.bind(("127.0.0.1", 0))
+        receiver.settimeout(2)
+
+        message = os.urandom(48 * 1024)
+        FragmentingSocket(sender, mtu=1200).sendto(message, receiver.getsockname())
+
+        reassembler = Reassembler()
+        result = None
+        while result is None:
+            data, addr = receiver.recvfrom(65535)
+            self.assertTrue(is_fragment(data))
+            self.assertLessEqual(len(data), 1200)
+            result = reassembler.add(addr, data)
+        self.assertEqual(result, message)
+        self.assertEqual(reassembler.buffered, 0)
+
+    def test_small_datagram_is_not_fragmented(self):
+        self.assertEqual(fragment(b'{"type": "chat"}'), [b'{"type": "chat"}'])
+
+    def test_reordered_and_duplicated_fragments(self):
+        message = os.urandom(10000)
+        fragments = fragment(message)
+        arrivals = list(reversed(fragments)) + fragments[:3]
+
+        reassembler = Reassembler()
+        results = [reassembler.add(("127.0.0.1", 9), data) for data in arrivals]
+        completed = [result for result in results if result is not None]
+        self.assertEqual(completed, [message])
+
+    def test_interleaved_senders(self):
+        first, second = os.urandom(5000), os.urandom(5000)
+        reassembler = Reassembler()
+        results = []
+        for a, b in zip(fragment(first), fragment(second)):
+            results.append(reassembler.add(("127.0.0.1", 1), a))
+            results.append(reassembler.add(("127.0.0.1", 2), b))
+        self.assertEqual([result for result in results if result is not None], [first, second])
+
+    def test_incomplete_set_times_out(self):
+        fragments = fragment(os.urandom(5000))
+        reassembler = Reassembler(timeout=0.05)
+        self.assertIsNone(reassembler.add(("127.0.0.1", 9), fragments[0]))
+        time.sleep(0.1)
+        for data in fragments[1:]:
+            self.assertIsNone(reassembler.add(("127.0.0.1", 9), data))
+        self.assertEqual(reassembler.discarded, 1)
+
+    def test_memory_cap_discards_oldest_sets(self):
+        reassembler = Reassembler(max_bytes=6000)
+        old = fragment(os.urandom(5000))
+        new = fragment(os.urandom(5000))
+        reassembler.add(("127.0.0.1", 1), old[0])
+        reassembler.add(("127.0.0.1", 1), old[1])
+        for data in new[:-1]:
+            reassembler.add(("127.0.0.1", 2), data)
+            self.assertLessEqual(reassembler.buffered, 6000)
+        self.assertEqual(reassembler.discarded, 1)
+        self.assertIsNotNone(reassembler.add(("127.0.0.1", 2), new[-1]))
+        # The discarded set can no longer complete
+        for data in old[2:]:
+            self.assertIsNone(reassembler.add(("127.0.0.1", 1), data))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from peer.message_store import MessageStore
+
+
+class MessageStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "messages.seg")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reopen_keeps_empty_messages(self):
+        store = MessageStore(capacity=2, path=self.path)
+        for message in ["a", "", "b", "c"]:
+            store.append(message)
+        store.close()
+
+        store = MessageStore(capacity=2, path=self.path)
+        self.assertEqual(store.last_sequence, 4)
+        self.assertEqual(store.range(1, 4), (1, ["a", "", "b", "c"]))
+        self.assertEqual(store.append("d"), 5)
+        store.close()
+
+    def test_memory_only_store_forgets_beyond_capacity(self):
+        store = MessageStore(capacity=2)
+        for message in ["a", "b", "c"]:
+            store.append(message)
+        self.assertIsNone(store.get(1))
+        self.assertEqual(store.range(1, 3), (2, ["b", "c"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import json
+import select
+import socket
+import time
+import unittest
+
+from peer.lossy import LossySocket
+from peer.reliability import ReliableTransport
+from peer.timers import TimerQueue
+
+
+class Endpoint(object):
+    def __init__(self, timers, drop, reorder, seed):
+        '''
+        A UDP socket on the loopback interface that loses and reorders what it sends,
+        with a ReliableTransport on top.
+        '''
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.lossy = LossySocket(self.sock, drop, reorder, timers=timers, seed=seed)
+        self.delivered = []
+        self.transport = ReliableTransport(
+            timers, self.lossy, lambda payload, addr: self.delivered.append(payload)
+        )
+
+    def receive(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except BlockingIOError:
+                return
+            msg = json.loads(data.decode("utf-8"))
+            if msg["type"] == "rel_data":
+                self.transport.handle_data(msg, addr)
+            else:
+                self.transport.handle_ack(msg, addr)
+
+    def close(self):
+        self.transport.stop()
+        self.sock.close()
+
+
+class ReliableTransportTest(unittest.TestCase):
+    def run_exchange(self, count, drop, reorder):
+        timers = TimerQueue()
+        sender = Endpoint(timers, drop, reorder, seed=1)
+        receiver = Endpoint(timers, drop, reorder, seed=2)
+        self.addCleanup(sender.close)
+        self.addCleanup(receiver.close)
+
+        for number in range(count):
+            sender.transport.send(receiver.address, json.dumps({"n": number}).encode("utf-8"))
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if len(receiver.delivered) == count and not sender.transport.sending[receiver.address].unacked:
+                break
+            timeout = timers.next_timeout()
+            select.select([sender.sock, receiver.sock], [], [], min(timeout if timeout is not None else 0.05, 0.05))
+            sender.receive()
+            receiver.receive()
+            timers.run_due()
+        return sender, receiver
+
+    def test_in_order_delivery_without_loss(self):
+        sender, receiver = self.run_exchange(100, 0.0, 0.0)
+        self.assertEqual([payload["n"] for payload in receiver.delivered], list(range(100)))
+
+    def test_in_order_delivery_through_lossy_socket(self):
+        sender, receiver = self.run_exchange(200, 0.2, 0.2)
+        self.assertEqual([payload["n"] for payload in receiver.delivered], list(range(200)))
+        self.assertGreater(sender.lossy.dropped, 0)
+        self.assertGreater(sender.lossy.reordered, 0)
+        self.assertEqual(sender.transport.sending[receiver.address].unacked, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from client import P2PClient
+
+
+class CountingSocket(object):
+    def __init__(self, sock):
+        '''
+        Count the datagrams sent through a socket.
+        '''
+        self.sock = sock
+        self.sent = 0
+
+    def sendto(self, data, address):
+        self.sent += 1
+        return self.sock.sendto(data, address)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def make_node(port, ports, mode, fanout):
+    '''
+    Build a client that is already in a room with every other benchmark node, without
+    going through the central server.
+    '''
+    node = P2PClient("127.0.0.1", 0, auto_run_handler=False)
+    node.address = "127.0.0.1"
+    node.port = port
+    node.user_id = f"node{port}"
+    node.enter_room("benchmark", [("127.0.0.1", peer_port) for peer_port in ports])
+    node.failure_detection = False
+    node.dissemination = mode
+    node.gossip_fanout = fanout
+    node.binary_peers.update(peer for peer in node.peers if peer[1] != port)
+    # Every node runs the same code, so each supports what the others do
+    node.peer_features.update((peer, set(node.features())) for peer in node.peers if peer[1] != port)
+    return node
+
+
+async def open_node(node):
+    '''
+    Open the node's session on the running event loop, as the chat client does. In
+    multicast mode every other node is recorded as listening on the room's group, as the
+    join answers the benchmark skips would have done, so chat goes to the group once
+    instead of also being unicast to every peer.
+    '''
+    udp_socket = await node.start()
+    if node.multicast_group:
+        node.multicast_peers.update(tuple(peer) for peer in node.peers if peer[1] != node.port)
+    return udp_socket
+
+
+def run_receiver(port, ports, mode, fanout, ready, stop, results):
+    sys.stdout = open(os.devnull, "w")
+    asyncio.run(receive(port, ports, mode, fanout, ready, stop, results))
+
+
+async def receive(port, ports, mode, fanout, ready, stop, results):
+    node = make_node(port, ports, mode, fanout)
+    latencies = []
+    handle_chat = node.handle_chat
+
+    def record(msg, addr):
+        if (str(addr[1]), msg.get("sequence_number")) not in node.received_messages:
+            latencies.append(time.time() - float(msg["body"].split()[0]))
+        handle_chat(msg, addr)
+
+    node.dispatcher.register("chat", record)
+    await open_node(node)
+    ready.put(port)
+    while not stop.is_set():
+        await asyncio.sleep(0.05)
+    await node.stop()
+    results.put((port, latencies, time.process_time()))
+
+
+async def send(port, ports, mode, fanout, messages, interval, drain):
+    '''
+    Send messages from one node at a fixed interval, then keep it running for drain
+    seconds so recovery and gossip can finish. Returns the sender's CPU time spent in
+    send_chat, its total CPU time, and the datagrams it sent while sending and in total.
+    '''
+    sender = make_node(port, ports, mode, fanout)
+    udp_socket = await open_node(sender)
+    counter = udp_socket.sock = CountingSocket(udp_socket.sock)
+
+    send_cpu = 0.0
+    start_cpu = time.process_time()
+    next_send = time.monotonic()
+    for sequence_number in range(messages):
+        await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+        began = time.process_time()
+        sender.send_chat(udp_socket, f"{time.time()} {sequence_number}")
+        udp_socket.flush()
+        send_cpu += time.process_time() - began
+        next_send += interval
+    send_datagrams = counter.sent
+
+    await asyncio.sleep(drain)
+    total_cpu = time.process_time() - start_cpu
+    total_datagrams = counter.sent
+    await sender.stop()
+    return send_cpu, total_cpu, send_datagrams, total_datagrams
+
+
+def run(mode, peers, messages, interval, fanout, base_port, drain):
+    '''
+    Send messages from one node to a room of peers nodes, each in its own process.
+    Returns a dict of measurements.
+    '''
+    ports = list(range(base_port, base_port + peers))
+    ready = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    workers = [
+        multiprocessing.Process(
+            target=run_receiver, args=(port, ports, mode, fanout, ready, stop, results)
+        )
+        for port in ports[1:]
+    ]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.get()
+
+    sys.stdout, stdout = open(os.devnull, "w"), sys.stdout
+    send_cpu, total_cpu, send_datagrams, total_datagrams = asyncio.run(
+        send(ports[0], ports, mode, fanout, messages, interval, drain)
+    )
+    sys.stdout = stdout
+
+    stop.set()
+    latencies = []
+    for _ in workers:
+        _, worker_latencies, _ = results.get()
+        latencies.extend(worker_latencies)
+    for worker in workers:
+        worker.join()
+
+    latencies.sort()
+    return {
+        "delivered": len(latencies) / (messages * (peers - 1)),
+        "p50_ms": 1000 * statistics.median(latencies) if latencies else None,
+        "p99_ms": 1000 * latencies[int(0.99 * (len(latencies) - 1))] if latencies else None,
+        "send_cpu_us": 1e6 * send_cpu / messages,
+        "sender_cpu_us": 1e6 * total_cpu / messages,
+        "send_datagrams": send_datagrams / messages,
+        "sender_datagrams": total_datagrams / messages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare full-mesh, gossip and multicast chat broadcast in a room of local processes."
+    )
+    parser.add_argument("--peers", type=int, default=30, help="Room size, including the sender.")
+    parser.add_argument("--messages", type=int, default=200, help="Chat messages to send.")
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between messages.")
+    parser.add_argument("--fanout", type=int, default=None,
+                        help="Gossip fanout. Defaults to the client's ln(room size) + 3.")
+    parser.add_argument("--modes", default="mesh,gossip", help="Comma-separated modes to run.")
+    parser.add_argument("--base-port", type=int, default=41000, help="First UDP port to use.")
+    parser.add_argument("--drain", type=float, default=2.0,
+                        help="Seconds to keep running after the last message.")
+    args = parser.parse_args()
+
+    print(f"{args.peers} peers, {args.messages} messages every {args.interval * 1000:.0f} ms")
+    print(f"{'mode':<8}{'delivered':>10}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'send us/msg':>13}{'sender us/msg':>15}{'send dgrams':>13}{'sender dgrams':>15}")
+    for offset, mode in enumerate(args.modes.split(",")):
+        result = run(mode, args.peers, args.messages, args.interval, args.fanout,
+                     args.base_port + offset * args.peers, args.drain)
+        print(f"{mode:<8}{result['delivered']:>10.1%}{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+              f"{result['send_cpu_us']:>13.0f}{result['sender_cpu_us']:>15.0f}"
+              f"{result['send_datagrams']:>13.1f}{result['sender_datagrams']:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from client import P2PClient
+from protocol.hashring import parse_node
+
+
+def percentile(ordered, fraction):
+    '''
+    Returns the value at a fraction of the way through an ordered list.
+    '''
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+def start_server(port):
+    '''
+    Run a NameServer in its own process and working directory, and wait until it accepts
+    connections. Returns the process.
+    '''
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "--port", str(port)],
+        cwd=tempfile.mkdtemp(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"Name server on port {port} did not start")
+
+
+async def run_clients(indices, rooms, args, barrier, results):
+    '''
+    Run some of the simulated clients on one event loop: join their rooms, send their
+    messages, then report what was sent and delivered.
+    '''
+    host, port = parse_node(args.server)
+    loop = asyncio.get_running_loop()
+    latencies = []
+    delivered = set()
+    duplicates = 0
+    last_delivery = 0.0
+
+    def receiver(index):
+        def on_message(room, user, body):
+            nonlocal duplicates, last_delivery
+            sender, number, sent_at = body.split()
+            if (index, sender, number) in delivered:
+                duplicates += 1
+                return
+            delivered.add((index, sender, number))
+            last_delivery = time.time()
+            latencies.append(last_delivery - float(sent_at))
+        return on_message
+
+    clients = {}
+    for index in indices:
+        client = P2PClient(host, port, auto_run_handler=False)
+        client.user_id = f"load{index}"
+        client.echo = False
+        client.failure_detection = args.failure_detector
+        client.dissemination = args.dissemination
+        client.simulated_drop = args.drop
+        client.on_message(receiver(index))
+        await client.start()
+        clients[index] = client
+
+    # The first client in each room creates it, before anyone else tries to join
+    for index, client in clients.items():
+        if index < len(rooms):
+            await client.join(rooms[index], create=True)
+    await loop.run_in_executor(None, barrier.wait)
+    for index, client in clients.items():
+        if index >= len(rooms):
+            await client.join(rooms[index % len(rooms)])
+    await loop.run_in_executor(None, barrier.wait)
+    await asyncio.sleep(args.settle)
+
+    async def send(index, client):
+        next_send = time.monotonic()
+        for number in range(args.messages):
+            client.send_message(f"{index} {number} {time.time()}")
+            next_send += 1 / args.rate
+            await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+
+    started = time.time()
+    await asyncio.gather(*(send(index, client) for index, client in clients.items()))
+    finished = time.time()
+    await asyncio.sleep(args.drain)
+
+    for client in clients.values():
+        await client.stop()
+        client.close_server_connection()
+    results.put((started, finished, last_delivery, len(delivered), duplicates, latencies))
+
+
+def run_worker(indices, rooms, args, barrier, results):
+    sys.stdout = open(os.devnull, "w")
+    asyncio.run(run_clients(indices, rooms, args, barrier, results))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run many simulated chat clients against a name server and report "
+                    "message throughput, delivery latency and loss."
+    )
+    parser.add_argument("--clients", type=int, default=100, help="Simulated clients.")
+    parser.add_argument("--rooms", type=int, default=10, help="Rooms the clients are spread over.")
+    parser.add_argument("--messages", type=int, default=20, help="Chat messages each client sends.")
+    parser.add_argument("--rate", type=float, default=2.0, help="Messages per second each client sends.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Processes to spread the clients over.")
+    parser.add_argument("--dissemination", default="mesh", choices=["mesh", "gossip", "multicast"],
+                        help="How clients send chat to their rooms.")
+    parser.add_argument("--drop", type=float, default=0.0,
+                        help="Fraction of outgoing datagrams each client drops, to exercise recovery.")
+    parser.add_argument("--no-failure-detector", dest="failure_detector", action="store_false",
+                        help="Turn off background probing of peers.")
+    parser.add_argument("--server", default=None,
+                        help="host:port of a running name server. By default one is started locally.")
+    parser.add_argument("--server-port", type=int, default=47000,
+                        help="Port for the locally started name server.")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="Seconds to wait after everyone joined before sending.")
+    parser.add_argument("--drain", type=float, default=3.0,
+                        help="Seconds to wait for deliveries after the last message is sent.")
+    args = parser.parse_args()
+    rooms_count = min(args.rooms, args.clients)
+    processes = max(1, min(args.processes, args.clients))
+
+    server = None
+    if args.server is None:
+        server = start_server(args.server_port)
+        args.server = f"127.0.0.1:{args.server_port}"
+
+    try:
+        run_name = uuid.uuid4().hex[:8]
+        rooms = [f"load-{run_name}-{number}" for number in range(rooms_count)]
+        barrier = multiprocessing.Barrier(processes)
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(list(range(worker, args.clients, processes)), rooms, args, barrier, results)
+            )
+            for worker in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        reports = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+    finally:
+        if server:
+            server.kill()
+
+    # Every message should reach every other member of its sender's room
+    sizes = [len(range(number, args.clients, rooms_count)) for number in range(rooms_count)]
+    sent = args.clients * args.messages
+    expected = sum(args.messages * size * (size - 1) for size in sizes)
+    started = min(report[0] for report in reports)
+    finished = max(report[1] for report in reports)
+    last_delivery = max(max(report[2] for report in reports), finished)
+    delivered = sum(report[3] for report in reports)
+    duplicates = sum(report[4] for report in reports)
+    latencies = sorted(latency for report in reports for latency in report[5])
+
+    print(f"{args.clients} clients in {rooms_count} rooms ({args.dissemination}), "
+          f"{args.messages} messages each at {args.rate:g}/s, {processes} processes")
+    print(f"sent:        {sent} messages in {finished - started:.2f} s ({sent / (finished - started):.0f}/s)")
+    print(f"delivered:   {delivered} of {expected} ({delivered / (last_delivery - started):.0f}/s), "
+          f"loss {1 - delivered / expected if expected else 0:.2%}, {duplicates} duplicates")
+    if latencies:
+        print(f"latency ms:  p50 {1000 * percentile(latencies, 0.5):.2f}  "
+              f"p90 {1000 * percentile(latencies, 0.9):.2f}  "
+              f"p99 {1000 * percentile(latencies, 0.99):.2f}  "
+              f"max {1000 * latencies[-1]:.2f}")
+
+
+if __name__ == "__main__":
+    main()